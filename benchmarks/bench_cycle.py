@@ -0,0 +1,141 @@
+"""
+End to end benchmark of GreenhouseServer cycles against local stand-ins
+
+Usage: python -m benchmarks.bench_cycle [--cycles N] [--mode manual|automated|both] [--latency-ms MS]
+                                        [--client-aggregates] [--json FILE]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import FakeRestApi, FakeRelayListener, FakeSmartplug, NullEmailClient, write_config
+from sgreen2_greenhouse.event_log import EVENT_LOG
+from sgreen2_greenhouse.greenhouse_server import GreenhouseServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_CONFIG = os.path.join(HERE, os.pardir, "development.ini")
+
+
+def percentile(values: list, p: float) -> float:
+    """
+    Nearest rank percentile
+    :param values: the values
+    :param p: the percentile between 0 and 100
+    :return: the percentile of the values
+    """
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(durations: list) -> dict:
+    """
+    Summarizes cycle durations
+    :param durations: how long each cycle took in seconds
+    :return: a dict of latency percentiles and throughput
+    """
+    total = sum(durations)
+    return {
+        "cycles": len(durations),
+        "mean_s": total / len(durations),
+        "p50_s": percentile(durations, 50),
+        "p90_s": percentile(durations, 90),
+        "p99_s": percentile(durations, 99),
+        "max_s": max(durations),
+        "cycles_per_s": len(durations) / total if total > 0 else None
+    }
+
+
+def run_cycles(server: GreenhouseServer, api: FakeRestApi, manual_mode: bool, cycles: int, verbose: bool) -> dict:
+    """
+    Runs and times a number of cycles in one mode
+    :param server: the greenhouse server
+    :param api: the fake REST API it talks to
+    :param manual_mode: whether to run manual mode cycles
+    :param cycles: how many cycles to run
+    :param verbose: whether to let the server print
+    :return: the summary of the cycles with the per route REST stats
+    """
+    api.settings["is_manual_mode"] = manual_mode
+    api.reset_stats()
+
+    durations = list()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        for _ in range(cycles):
+            started = time.perf_counter()
+            server.run_cycle()
+            durations.append(time.perf_counter() - started)
+        # the actuator states are written behind the cycles, count their requests too
+        server.actuator_state_writer.flush()
+        # the server logs from a thread of its own, let it finish while the output is still redirected
+        EVENT_LOG.flush()
+
+    result = summarize(durations)
+    result["rest_routes"] = {route: dict(stats) for route, stats in sorted(api.stats.items())}
+    return result
+
+
+def main(argv: list) -> int:
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--cycles", type=int, default=5, help="cycles to run per mode")
+    arg_parser.add_argument("--mode", choices=("manual", "automated", "both"), default="both")
+    arg_parser.add_argument("--latency-ms", type=float, default=0.0,
+                            help="latency injected into every REST response and smartplug reply")
+    arg_parser.add_argument("--client-aggregates", action="store_true",
+                            help="serve no /data_readings/aggregate, so the server aggregates the readings itself")
+    arg_parser.add_argument("--json", help="also write the results to this file")
+    arg_parser.add_argument("--verbose", action="store_true", help="show the server output")
+    args = arg_parser.parse_args(argv)
+
+    latency = args.latency_ms / 1000
+    api = FakeRestApi(latency, serve_aggregates=not args.client_aggregates).start()
+    relay_listener = FakeRelayListener().start()
+    bigfan_plug = FakeSmartplug(latency).start()
+    heater_plug = FakeSmartplug(latency).start()
+
+    results = {"latency_ms": args.latency_ms, "client_aggregates": args.client_aggregates, "modes": dict()}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            config_path = os.path.join(tmp, "benchmark.ini")
+            write_config(config_path, api, relay_listener, bigfan_plug, heater_plug, TEMPLATE_CONFIG)
+
+            server = GreenhouseServer(config_path)
+            server.error_notifier.email_client = NullEmailClient()
+
+            modes = ("manual", "automated") if args.mode == "both" else (args.mode,)
+            for mode in modes:
+                results["modes"][mode] = run_cycles(server, api, mode == "manual", args.cycles, args.verbose)
+
+            server.error_notifier.quit()
+    finally:
+        api.stop()
+        relay_listener.stop()
+        bigfan_plug.stop()
+        heater_plug.stop()
+
+    results["relay_messages"] = len(relay_listener.messages)
+    results["smartplug_commands"] = len(bigfan_plug.messages) + len(heater_plug.messages)
+
+    for mode, summary in results["modes"].items():
+        print("{0:>9}: {1} cycles, p50 {2:.3f}s, p90 {3:.3f}s, p99 {4:.3f}s, max {5:.3f}s, {6:.3f} cycles/s".format(
+            mode, summary["cycles"], summary["p50_s"], summary["p90_s"], summary["p99_s"], summary["max_s"],
+            summary["cycles_per_s"]))
+        for route, stats in summary["rest_routes"].items():
+            print("           {0:<36} {1:>5} requests {2:>9.3f}s {3:>10} bytes".format(
+                route, stats["count"], stats["seconds"], stats["bytes"]))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
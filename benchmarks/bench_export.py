@@ -0,0 +1,83 @@
+"""
+Bulk export of /data_readings history against a local stand-in: how long exporting a range takes with one chunk
+in flight and with several, and whether the peak memory stays flat as the range gets longer.
+
+Usage: python -m benchmarks.bench_export [--days N] [--latency-ms MS] [--chunk-hours H] [--max-parallel N]
+                                         [--format auto|parquet|npz] [--json FILE]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fakes import FakeRestApi
+from sgreen2_greenhouse.export_readings import export_readings, open_reading_writer
+
+# the stand-in only keeps a week of history
+MAX_DAYS = 7
+
+
+def bench_export(api: FakeRestApi, days: float, chunk_hours: float, max_parallel: int, file_format: str,
+                 directory: str) -> dict:
+    """
+    Exports the temperature readings of the last days
+    :return: a dict of the seconds taken, the readings exported, the file size and the peak traced memory
+    """
+    end_time = time.time()
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    writer = open_reading_writer(directory, "temp", file_format)
+    try:
+        exported = export_readings(api.url, "temp", end_time - days * 24 * 60 * 60, end_time, writer,
+                                   chunk_hours * 60 * 60, max_parallel)
+    finally:
+        writer.close()
+
+    seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"days": days, "max_parallel": max_parallel, "seconds": seconds, "readings": exported,
+            "file_bytes": os.path.getsize(writer.path), "file": os.path.basename(writer.path), "peak_bytes": peak}
+
+
+def main(argv: list) -> int:
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--days", type=float, default=MAX_DAYS, help="the longest range to export")
+    arg_parser.add_argument("--latency-ms", type=float, default=200.0, help="latency of every response")
+    arg_parser.add_argument("--chunk-hours", type=float, default=6.0, help="hours of readings per request")
+    arg_parser.add_argument("--max-parallel", type=int, default=4, help="chunks in flight for the parallel runs")
+    arg_parser.add_argument("--format", choices=("auto", "parquet", "npz"), default="auto")
+    arg_parser.add_argument("--json", help="also write the results to this file")
+    args = arg_parser.parse_args(argv)
+
+    days = min(args.days, MAX_DAYS)
+    api = FakeRestApi(args.latency_ms / 1000).start()
+    results = list()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            # the short range first, it also pays for importing pyarrow or numpy
+            for range_days, max_parallel in ((days / 4, args.max_parallel), (days, args.max_parallel), (days, 1)):
+                results.append(bench_export(api, range_days, args.chunk_hours, max_parallel, args.format, tmp))
+    finally:
+        api.stop()
+
+    for result in results:
+        print("{0:>5.2f} days, {1} in flight: {2:>7.2f}s, {3:>8} readings, {4:>10} bytes of {5}, peak memory "
+              "{6:.1f} MiB".format(result["days"], result["max_parallel"], result["seconds"], result["readings"],
+                                   result["file_bytes"], result["file"], result["peak_bytes"] / (1 << 20)))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"latency_ms": args.latency_ms, "chunk_hours": args.chunk_hours, "results": results}, f,
+                      indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
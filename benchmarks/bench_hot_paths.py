@@ -0,0 +1,273 @@
+"""
+Micro-benchmarks of the hot pure functions, scaled across sensor counts and window sizes
+
+Usage: python -m benchmarks.bench_hot_paths [--quick] [--json FILE]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+from benchmarks import synthetic
+from benchmarks.fakes import NullEmailClient
+from sgreen2_greenhouse.actuator_registry import ActuatorRegistry
+from sgreen2_greenhouse.error_notifier import ErrorNotifier, Error, ErrorSeverity
+from sgreen2_greenhouse.event_log import EVENT_LOG, INFO, EventLog
+from sgreen2_greenhouse.greenhouse_server import GreenhouseServer
+from sgreen2_greenhouse.reading_rollups import ReadingRollups
+from sgreen2_greenhouse.tplink_smartplug import TpLinkSmartplug
+from sgreen2_pi import _gpio_stub
+from sgreen2_pi.solenoid_relay_controller import SolenoidRelayController
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_CONFIG = os.path.join(HERE, os.pardir, "development.ini")
+
+SENSOR_COUNTS = (2, 10, 50)
+WINDOW_SIZES = (30, 300, 3000)
+ACTUATOR_COUNTS = (15, 100, 1000)
+ERROR_COUNTS = (10, 100, 1000)
+# the smartplug protocol as implemented only has one byte for the command length
+COMMAND_LENGTHS = (40, 120, 250)
+SOLENOID_COUNTS = (7, 20)
+
+QUICK_SENSOR_COUNTS = (2, 10)
+QUICK_WINDOW_SIZES = (30, 300)
+
+
+def measure(function, repeat: int) -> dict:
+    """
+    Times a function with timeit, running it enough times per sample to take at least 0.2 seconds
+    :param function: the function to time, called without arguments
+    :param repeat: how many samples to take
+    :return: the best and median seconds per call over the samples
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    samples = sorted(sample / number for sample in timer.repeat(repeat=repeat, number=number))
+
+    return {"best_s": samples[0], "median_s": samples[len(samples) // 2], "calls_per_sample": number}
+
+
+def bench_reading_rollups(sensor_counts, window_sizes, repeat) -> list:
+    results = list()
+    for num_sensors in sensor_counts:
+        for window_size in window_sizes:
+            readings = synthetic.make_readings("temp", num_sensors, window_size)
+            # every call starts empty, else the readings would only be skipped as duplicates after the first one
+            result = measure(lambda: ReadingRollups().ingest("temp", readings), repeat)
+            result.update(operation="ingest", sensors=num_sensors, window=window_size)
+            results.append(result)
+
+            rollups = ReadingRollups()
+            rollups.ingest("temp", readings)
+            result = measure(lambda: rollups.aggregate_by_sensor("temp", 5 * 60), repeat)
+            result.update(operation="aggregate", sensors=num_sensors, window=window_size)
+            results.append(result)
+
+    return results
+
+
+def bench_actuator_registry(actuator_counts, repeat) -> list:
+    results = list()
+    for num_actuators in actuator_counts:
+        actuators = synthetic.make_actuators(num_actuators, sort_by_type=False)
+        # the next fetch with one actuator switched
+        switched = [dict(actuator) for actuator in actuators]
+        switched[0]["state"] = not switched[0]["state"]
+
+        result = measure(lambda: ActuatorRegistry(GreenhouseServer.actuator_device).update(actuators), repeat)
+        result.update(operation="build", actuators=num_actuators)
+        results.append(result)
+
+        registry = ActuatorRegistry(GreenhouseServer.actuator_device)
+        registry.update(actuators)
+        result = measure(lambda: registry.update(switched if registry.version % 2 else actuators), repeat)
+        result.update(operation="apply_diff", actuators=num_actuators)
+        results.append(result)
+
+        # the worst case for the old scan: the last actuator
+        name = actuators[-1]["name"]
+        result = measure(lambda: registry.get(name), repeat)
+        result.update(operation="get", actuators=num_actuators)
+        results.append(result)
+
+        result = measure(lambda: registry.of_type("fan"), repeat)
+        result.update(operation="of_type", actuators=num_actuators)
+        results.append(result)
+
+    return results
+
+
+def bench_check_margin_and_range(server: GreenhouseServer, sensor_counts, repeat) -> list:
+    results = list()
+    for num_sensors in sensor_counts:
+        for in_range in (True, False):
+            averages = synthetic.make_averages(num_sensors)
+            max_expected = 150 if in_range else 0
+
+            def check():
+                server.check_margin_and_range(averages, "temp", 0, max_expected, 10,
+                                              sensor_display_type="Temperature", sensor_display_unit="degrees")
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = measure(check, repeat)
+                EVENT_LOG.flush()
+            result.update(sensors=num_sensors, in_range=in_range)
+            results.append(result)
+
+    return results
+
+
+def bench_event_log(repeat) -> list:
+    """
+    What a line on a hot path costs the caller: print, an event that is written out by the event log's thread and an
+    event below the level
+    """
+    results = list()
+    msg = "fan01:fan:on"
+    event_log = EventLog(INFO, max_queue=10 ** 9)
+    logger = event_log.logger("bench")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for operation, function in (("print", lambda: print("SENDING: " + msg)),
+                                    ("event_log", lambda: logger.info("SENDING", message=msg)),
+                                    ("event_log_disabled", lambda: logger.debug("SENDING", message=msg))):
+            result = measure(function, repeat)
+            result.update(operation=operation)
+            results.append(result)
+
+        event_log.flush(60)
+
+    return results
+
+
+def bench_error_notifier(error_counts, repeat) -> list:
+    results = list()
+    for num_errors in error_counts:
+        error_keys = synthetic.make_error_keys(num_errors)
+        errors = [Error(ErrorSeverity.LOW, "Synthetic error " + key, key) for key in error_keys]
+
+        notifier = ErrorNotifier(NullEmailClient(), 5)
+
+        def add_errors():
+            for error in errors:
+                notifier.add_error(error)
+
+        def add_and_remove_errors():
+            for error in errors:
+                notifier.add_error(error)
+            for key in error_keys:
+                notifier.remove_error(key)
+
+        result = measure(add_errors, repeat)
+        result.update(operation="add_error", errors=num_errors)
+        results.append(result)
+
+        result = measure(add_and_remove_errors, repeat)
+        result.update(operation="add_error+remove_error", errors=num_errors)
+        results.append(result)
+
+    return results
+
+
+def bench_smartplug_crypto(command_lengths, repeat) -> list:
+    # the routines are private to the class, reach them through their mangled names
+    encrypt = getattr(TpLinkSmartplug, "_TpLinkSmartplug__encrypt")
+    decrypt = getattr(TpLinkSmartplug, "_TpLinkSmartplug__decrypt")
+
+    results = list()
+    for length in command_lengths:
+        command = synthetic.make_smartplug_command(length)
+        encrypted = encrypt(command)
+
+        result = measure(lambda: encrypt(command), repeat)
+        result.update(operation="encrypt", length=len(command))
+        results.append(result)
+
+        result = measure(lambda: decrypt(encrypted[4:]), repeat)
+        result.update(operation="decrypt", length=len(command))
+        results.append(result)
+
+    return results
+
+
+def bench_solenoid_relays(solenoid_counts, repeat) -> list:
+    results = list()
+    for count in solenoid_counts:
+        pi_pins = dict(master=1)
+        pi_pins.update(("solenoid{0:02d}".format(i), i + 2) for i in range(count))
+        controller = SolenoidRelayController(pi_pins, gpio=_gpio_stub)
+        zones = [name for name in pi_pins if name != "master"]
+
+        def one_at_a_time():
+            for name in zones:
+                controller.turn_on(name)
+            for name in zones:
+                controller.turn_off(name)
+
+        def bulk():
+            controller.apply({name: True for name in zones})
+            controller.apply({name: False for name in zones})
+
+        for operation, function in (("one_at_a_time", one_at_a_time), ("bulk", bulk)):
+            _gpio_stub.writes.clear()
+            function()
+            writes = len(_gpio_stub.writes)
+
+            result = measure(function, repeat)
+            result.update(operation=operation, solenoids=count, pin_writes=writes)
+            results.append(result)
+            _gpio_stub.writes.clear()
+
+    return results
+
+
+def main(argv: list) -> int:
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--quick", action="store_true", help="only run the smaller scales")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="samples to take per benchmark")
+    arg_parser.add_argument("--json", help="write the results to this file")
+    args = arg_parser.parse_args(argv)
+
+    sensor_counts = QUICK_SENSOR_COUNTS if args.quick else SENSOR_COUNTS
+    window_sizes = QUICK_WINDOW_SIZES if args.quick else WINDOW_SIZES
+    actuator_counts = ACTUATOR_COUNTS[:2] if args.quick else ACTUATOR_COUNTS
+    error_counts = ERROR_COUNTS[:2] if args.quick else ERROR_COUNTS
+    command_lengths = COMMAND_LENGTHS[:2] if args.quick else COMMAND_LENGTHS
+
+    server = GreenhouseServer(TEMPLATE_CONFIG)
+    server.error_notifier = ErrorNotifier(NullEmailClient(), server.error_notifier.total_stages)
+
+    benchmarks = {
+        "reading_rollups": bench_reading_rollups(sensor_counts, window_sizes, args.repeat),
+        "actuator_registry": bench_actuator_registry(actuator_counts, args.repeat),
+        "check_margin_and_range": bench_check_margin_and_range(server, sensor_counts, args.repeat),
+        "error_notifier": bench_error_notifier(error_counts, args.repeat),
+        "event_log": bench_event_log(args.repeat),
+        "tplink_smartplug_crypto": bench_smartplug_crypto(command_lengths, args.repeat),
+        "solenoid_relays": bench_solenoid_relays(SOLENOID_COUNTS[:1] if args.quick else SOLENOID_COUNTS, args.repeat)
+    }
+
+    for name, results in benchmarks.items():
+        print(name)
+        for result in results:
+            scale = ", ".join(key + "=" + str(value) for key, value in result.items()
+                              if key not in ("best_s", "median_s", "calls_per_sample"))
+            print("    {0:<48} best {1:>12.2f}us  median {2:>12.2f}us".format(
+                scale, result["best_s"] * 1e6, result["median_s"] * 1e6))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"time": time.time(), "python": platform.python_version(), "machine": platform.machine(),
+                       "benchmarks": benchmarks}, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,137 @@
+"""
+Bytes and latency of the REST payload formats over a slow link: the 24 hour /data_readings GET of the greenhouse server
+and the reading uploads of data_reading_listener, as JSON or MessagePack, with and without gzip, against a local
+stand-in with a bandwidth limit. Also checks that an api that only speaks plain JSON is fallen back to.
+
+Usage: python -m benchmarks.bench_payloads [--requests N] [--uploads N] [--latency-ms MS] [--bandwidth-kbps KBPS]
+                                           [--json FILE]
+"""
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+
+from benchmarks.fakes import FakeRestApi
+from sgreen2_greenhouse.payload_codec import PayloadNegotiator, decode_response, load_msgpack
+from sgreen2_greenhouse.rest_request import RestGet, RestRequest
+from sgreen2_pi.upload_lane import UploadLane
+
+# (payload format, gzip)
+FORMATS = (("json", False), ("json", True), ("msgpack", False), ("msgpack", True))
+
+SOIL_WINDOW_SECONDS = 24 * 60 * 60
+UPLOAD_TIMEOUT_SECONDS = 60
+
+
+def bench_readings_get(api: FakeRestApi, negotiator: PayloadNegotiator, requests: int) -> dict:
+    """
+    Times the 24 hour soil moisture GET, including decoding the body
+    :return: a dict of the mean seconds and response bytes per request
+    """
+    RestRequest.negotiator = negotiator
+    api.reset_stats()
+    params = {"type": "soil", "start_time": int(time.time() - SOIL_WINDOW_SECONDS) * 1000}
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = RestGet.send(api.url + "/data_readings", params)
+        readings = decode_response(response)
+    seconds = time.perf_counter() - started
+
+    stats = api.stats["GET /data_readings"]
+    return {"mean_s": seconds / requests, "response_bytes": stats["bytes"] / stats["count"],
+            "requests_sent": stats["count"], "readings": len(readings)}
+
+
+def bench_uploads(api: FakeRestApi, negotiator: PayloadNegotiator, uploads: int) -> dict:
+    """
+    Times uploading readings through an UploadLane
+    :return: a dict of the mean seconds and request bytes per upload
+    """
+    api.reset_stats()
+    lane = UploadLane("bench", api.url, timeout=5, max_queue=uploads, negotiator=negotiator)
+
+    readings = [{"sensor": {"type": "temp", "name": "temp01"}, "reading": 70 + i % 10,
+                 "created_at": int(time.time() * 1000) + i} for i in range(uploads)]
+
+    started = time.perf_counter()
+    lane.start()
+    for reading in readings:
+        lane.put(json.dumps(reading), reading)
+
+    while lane.uploaded + lane.failed + lane.dropped < uploads:
+        if time.perf_counter() - started > UPLOAD_TIMEOUT_SECONDS:
+            raise RuntimeError("uploads did not finish: " + str(lane.status()))
+        time.sleep(.01)
+    seconds = time.perf_counter() - started
+
+    stats = api.stats["POST /data_readings"]
+    return {"mean_s": seconds / uploads, "request_bytes": stats["request_bytes"] / stats["count"],
+            "requests_sent": stats["count"], "failed": lane.failed}
+
+
+def main(argv: list) -> int:
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--requests", type=int, default=5, help="24 hour GETs per format")
+    arg_parser.add_argument("--uploads", type=int, default=200, help="reading uploads per format")
+    arg_parser.add_argument("--latency-ms", type=float, default=20.0, help="latency of every response")
+    arg_parser.add_argument("--bandwidth-kbps", type=float, default=2000.0,
+                            help="the bandwidth of the link in kilobits per second")
+    arg_parser.add_argument("--json", help="also write the results to this file")
+    args = arg_parser.parse_args(argv)
+
+    formats = [(payload_format, use_gzip) for payload_format, use_gzip in FORMATS
+               if payload_format == "json" or load_msgpack() is not None]
+    if load_msgpack() is None:
+        print("msgpack is not installed, only JSON is measured")
+
+    results = {"latency_ms": args.latency_ms, "bandwidth_kbps": args.bandwidth_kbps, "formats": dict()}
+    api = FakeRestApi(args.latency_ms / 1000, bandwidth=args.bandwidth_kbps * 1000 / 8).start()
+    legacy_api = FakeRestApi(args.latency_ms / 1000, bandwidth=args.bandwidth_kbps * 1000 / 8,
+                             accept_msgpack=False, accept_gzip=False).start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for payload_format, use_gzip in formats:
+                name = payload_format + ("+gzip" if use_gzip else "")
+                # every reading is one small body, let gzip loose on them too to show what it does to them
+                negotiator = PayloadNegotiator(payload_format, use_gzip, gzip_min_bytes=0)
+                results["formats"][name] = {
+                    "get": bench_readings_get(api, negotiator, args.requests),
+                    "upload": bench_uploads(api, negotiator, args.uploads)
+                }
+
+            # an api that only speaks JSON costs one extra request per endpoint
+            best = PayloadNegotiator(formats[-1][0], True, gzip_min_bytes=0)
+            results["legacy_api"] = {"get": bench_readings_get(legacy_api, best, args.requests),
+                                     "upload": bench_uploads(legacy_api, best, args.uploads)}
+    finally:
+        api.stop()
+        legacy_api.stop()
+        RestRequest.negotiator = PayloadNegotiator()
+
+    baseline = results["formats"]["json"]
+    print("{0:<14} {1:>14} {2:>10} {3:>16} {4:>12}".format("format", "GET bytes", "GET ms", "upload bytes",
+                                                          "upload ms"))
+    for name, result in list(results["formats"].items()) + [("legacy api", results["legacy_api"])]:
+        print("{0:<14} {1:>8.0f} {2:>5.0%} {3:>10.1f} {4:>10.1f} {5:>5.0%} {6:>12.2f}".format(
+            name, result["get"]["response_bytes"],
+            result["get"]["response_bytes"] / baseline["get"]["response_bytes"], result["get"]["mean_s"] * 1000,
+            result["upload"]["request_bytes"],
+            result["upload"]["request_bytes"] / baseline["upload"]["request_bytes"],
+            result["upload"]["mean_s"] * 1000))
+
+    legacy = results["legacy_api"]
+    print("legacy api: {0} GETs and {1} uploads sent for {2} and {3}".format(
+        legacy["get"]["requests_sent"], legacy["upload"]["requests_sent"], args.requests, args.uploads))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,135 @@
+"""
+Cold start benchmark of the main programs: how long importing each one takes, which imports that time goes to, and
+whether any of the heavy dependencies that are meant to load lazily got imported eagerly. Exits with 1 when a program
+goes over its budget or imports one of those dependencies at start up, so it can gate changes like a test would.
+
+Usage: python -m benchmarks.bench_startup [--repeat N] [--budget-scale X] [--top N] [--json FILE]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(HERE, os.pardir))
+
+# program -> (module, import time budget in ms on a desktop class machine)
+PROGRAMS = {
+    "greenhouse_server": ("sgreen2_greenhouse.greenhouse_server", 60),
+    "actuator_state_listener": ("sgreen2_pi.actuator_state_listener", 40),
+    "data_reading_listener": ("sgreen2_pi.data_reading_listener", 50)
+}
+
+# dependencies that are only imported once they are needed, none of them may be imported at start up
+LAZY_MODULES = ("requests", "dateutil", "smtplib", "email.mime", "http.client", "RPi", "msgpack", "pyarrow", "numpy")
+
+TOP_IMPORTS = 10
+
+
+def parse_importtime(stderr: str) -> list:
+    """
+    Parses the output of python -X importtime
+    :param stderr: the standard error of the process
+    :return: a list of (module, self microseconds, cumulative microseconds, nesting level)
+    """
+    imports = list()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            # the header
+            continue
+
+        level = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), level))
+
+    return imports
+
+
+def measure_program(module: str) -> dict:
+    """
+    Imports a program's module in a fresh interpreter
+    :param module: the module of the program
+    :return: a dict of the import time of the module, every import and which lazy dependencies were imported
+    """
+    code = "import sys, {0}; print(','.join(sorted(m for m in sys.modules if m.startswith({1!r}))))".format(
+        module, LAZY_MODULES)
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env,
+                             capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError("importing " + module + " failed:\n" + process.stderr)
+
+    imports = parse_importtime(process.stderr)
+    # children are printed before their parent, so the module's imports are the nested lines right before it. Anything
+    # else was imported by site before the program started
+    end = next(i for i, (name, _, _, level) in enumerate(imports) if name == module and level == 0)
+    start = end
+    while start > 0 and imports[start - 1][3] > 0:
+        start -= 1
+    imports = imports[start:end + 1]
+
+    imported = {name for name in process.stdout.strip().split(",") if name} & {name for name, _, _, _ in imports}
+    eager = [lazy for lazy in LAZY_MODULES if any(name == lazy or name.startswith(lazy + ".") for name in imported)]
+
+    return {"total_us": imports[-1][2], "imports": imports, "eager_lazy_modules": eager}
+
+
+def main(argv: list) -> int:
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters to start per program")
+    arg_parser.add_argument("--budget-scale", type=float, default=1.0,
+                            help="multiply the budgets, e.g. 10 on a Pi Zero")
+    arg_parser.add_argument("--top", type=int, default=TOP_IMPORTS, help="how many of the slowest imports to show")
+    arg_parser.add_argument("--json", help="write the results to this file")
+    args = arg_parser.parse_args(argv)
+
+    results = dict()
+    failures = list()
+    for program, (module, budget_ms) in PROGRAMS.items():
+        # the first start compiles the .pyc files, don't count it
+        measure_program(module)
+        runs = sorted((measure_program(module) for _ in range(args.repeat)), key=lambda run: run["total_us"])
+        median = runs[len(runs) // 2]
+
+        budget_ms *= args.budget_scale
+        total_ms = median["total_us"] / 1000
+        slowest = sorted(median["imports"], key=lambda entry: entry[1], reverse=True)[:args.top]
+
+        results[program] = {"module": module, "median_ms": total_ms, "best_ms": runs[0]["total_us"] / 1000,
+                            "budget_ms": budget_ms, "eager_lazy_modules": median["eager_lazy_modules"],
+                            "slowest_imports": [{"module": name, "self_ms": self_us / 1000,
+                                                 "cumulative_ms": cumulative_us / 1000}
+                                                for name, self_us, cumulative_us, _ in slowest]}
+
+        print("{0}: median {1:.1f}ms, best {2:.1f}ms, budget {3:.1f}ms".format(
+            program, total_ms, results[program]["best_ms"], budget_ms))
+        for entry in results[program]["slowest_imports"]:
+            print("    {0:<48} self {1:>8.2f}ms  cumulative {2:>8.2f}ms".format(
+                entry["module"], entry["self_ms"], entry["cumulative_ms"]))
+
+        if total_ms > budget_ms:
+            failures.append("{0} took {1:.1f}ms to import, over its budget of {2:.1f}ms".format(
+                program, total_ms, budget_ms))
+        if median["eager_lazy_modules"]:
+            failures.append(program + " imported " + ", ".join(median["eager_lazy_modules"]) + " at start up")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"time": time.time(), "python": platform.python_version(), "machine": platform.machine(),
+                       "programs": results, "failures": failures}, f, indent=2)
+
+    for failure in failures:
+        print("FAIL: " + failure)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,492 @@
+"""
+Local stand-ins for everything the greenhouse server talks to: the REST API, the RelayListener on the Pis and the
+TP-Link smartplugs. Each one listens on 127.0.0.1 on a free port and can inject a fixed latency into its replies.
+"""
+import gzip
+import json
+import socket
+import socketserver
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+from sgreen2_greenhouse.payload_codec import load_msgpack, JSON_CONTENT_TYPE, MSGPACK_CONTENT_TYPE, \
+    MSGPACK_CONTENT_TYPES
+from sgreen2_greenhouse.reading_aggregates import aggregate_readings
+
+# responses smaller than this are not gzipped
+GZIP_MIN_RESPONSE_BYTES = 1024
+
+DEFAULT_SETTINGS = {
+    "watering_times": ["06:00"],
+    "error_flush_times": ["20:00"],
+    "email_addresses": [],
+    "is_manual_mode": False,
+    "temperature": {"min": 50, "max": 90},
+    "soil_moisture": {"min": 30, "max": 90},
+    "lights": {"start_time": "06:00", "end_time": "20:00"}
+}
+
+DEFAULT_ACTUATORS = [
+    {"name": "bigfan", "type": "fan", "state": False},
+    {"name": "fan01", "type": "fan", "state": False},
+    {"name": "fan02", "type": "fan", "state": False},
+    {"name": "fan03", "type": "fan", "state": False},
+    {"name": "fan04", "type": "fan", "state": False},
+    {"name": "heater01", "type": "heater", "state": False},
+    {"name": "lights01", "type": "lights", "state": False},
+    {"name": "lights02", "type": "lights", "state": False},
+    {"name": "solenoid01", "type": "water", "state": False},
+    {"name": "solenoid02", "type": "water", "state": False},
+    {"name": "solenoid03", "type": "water", "state": False},
+    {"name": "solenoid04", "type": "water", "state": False},
+    {"name": "solenoid05", "type": "water", "state": False},
+    {"name": "solenoid06", "type": "water", "state": False},
+    {"name": "solenoid07", "type": "water", "state": False}
+]
+
+DEFAULT_SENSORS = {
+    "temp": ["temp01", "temp02"],
+    "humid": ["humid01", "humid02"],
+    "fanspeed": ["fan01", "fan03"],
+    "soil": ["soil01", "soil02", "soil03", "soil04", "soil05"],
+    "batt": ["batt01", "batt02", "batt03", "batt04", "batt05"]
+}
+
+# how often each type of sensor posts, in seconds
+DEFAULT_READING_INTERVALS = {
+    "temp": 10,
+    "humid": 10,
+    "fanspeed": 10,
+    "soil": 120,
+    "batt": 120
+}
+
+# what decode_body returns for a body the api does not understand
+UNSUPPORTED = object()
+
+# readings are never generated further back than this
+MAX_HISTORY_SECONDS = 7 * 24 * 60 * 60
+
+
+def synthetic_reading(sensor_type: str, sensor: str, reading_time: int, fan_is_on: bool = False) -> dict:
+    """
+    Makes a deterministic reading that looks like a row from /data_readings
+    :param sensor_type: the type of the sensor
+    :param sensor: the name of the sensor
+    :param reading_time: when the reading was recorded in seconds since the epoch
+    :param fan_is_on: for fanspeed sensors, whether the fan it watches is on
+    :return: a reading dict
+    """
+    noise = (zlib.crc32((sensor + str(reading_time)).encode()) % 1000) / 1000
+
+    reading = {"sensor": {"type": sensor_type, "name": sensor}, "created_at": reading_time * 1000}
+    if sensor_type == "temp":
+        reading["reading"] = 70 + 10 * noise
+    elif sensor_type == "humid":
+        reading["reading"] = 40 + 20 * noise
+    elif sensor_type == "fanspeed":
+        reading["reading"] = 1000 + 100 * noise if fan_is_on else 0
+    elif sensor_type == "soil":
+        reading["reading"] = 40 + 20 * noise
+    elif sensor_type == "batt":
+        reading["reading"] = 3.5 + noise
+        reading["health"] = "ok"
+    else:
+        reading["reading"] = noise
+
+    return reading
+
+
+class _RestApiHandler(BaseHTTPRequestHandler):
+    """
+    Serves the subset of the REST API the greenhouse server uses
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.api.handle(self, "GET")
+
+    def do_POST(self):
+        self.server.api.handle(self, "POST")
+
+    def do_PUT(self):
+        self.server.api.handle(self, "PUT")
+
+    def do_DELETE(self):
+        self.server.api.handle(self, "DELETE")
+
+
+class FakeRestApi:
+    """
+    A stand-in for the REST API serving /settings, /actuators, /data_readings, /data_readings/aggregate and
+    /greenhouse_server_state
+    """
+
+    def __init__(self, latency: float = 0.0, settings: dict = None, actuators: list = None, sensors: dict = None,
+                 reading_intervals: dict = None, clock=time.time, reading_source=None, bandwidth: float = None,
+                 accept_msgpack: bool = True, accept_gzip: bool = True, serve_aggregates: bool = True,
+                 honour_end_time: bool = True):
+        """
+        The constructor
+        :param latency: how many seconds to wait before answering each request
+        :param settings: the settings to serve
+        :param actuators: the actuators to serve
+        :param sensors: a dict of sensor type and sensor names to generate readings for
+        :param reading_intervals: a dict of sensor type and how often its sensors post in seconds
+        :param clock: gives the current time in seconds since the epoch
+        :param reading_source: called with (sensor type, start time in seconds, now) to get the readings to serve
+        instead of the synthetic ones
+        :param bandwidth: how many bytes per second the link carries, None for no limit
+        :param accept_msgpack: whether MessagePack bodies are understood and sent when asked for, else they get a 415
+        :param accept_gzip: whether gzipped bodies are understood and sent when asked for, else they get a 415
+        :param serve_aggregates: whether /data_readings/aggregate exists, else it gets a 404 like an older api
+        :param honour_end_time: whether /data_readings stops at end_time, else it is ignored like an older api
+        """
+        self.latency = latency
+        self.settings = json.loads(json.dumps(settings if settings is not None else DEFAULT_SETTINGS))
+        self.actuators = json.loads(json.dumps(actuators if actuators is not None else DEFAULT_ACTUATORS))
+        self.sensors = sensors if sensors is not None else DEFAULT_SENSORS
+        self.reading_intervals = reading_intervals if reading_intervals is not None else DEFAULT_READING_INTERVALS
+        self.clock = clock
+        self.reading_source = reading_source
+        self.bandwidth = bandwidth
+        self.accept_msgpack = accept_msgpack and load_msgpack() is not None
+        self.accept_gzip = accept_gzip
+        self.serve_aggregates = serve_aggregates
+        self.honour_end_time = honour_end_time
+        self.posted_readings = list()
+
+        # route -> {"count": requests, "seconds": time spent handling, "bytes": response bytes,
+        # "request_bytes": request body bytes}
+        self.stats = dict()
+        self.__lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _RestApiHandler)
+        self.server.daemon_threads = True
+        self.server.api = self
+        self.__thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:" + str(self.server.server_address[1])
+
+    def start(self) -> "FakeRestApi":
+        self.__thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_stats(self) -> None:
+        with self.__lock:
+            self.stats.clear()
+
+    def readings(self, sensor_type: str, start_time: int, end_time: Optional[int] = None) -> list:
+        """
+        Generates the readings of a sensor type since a time, newest first like the real API
+        :param sensor_type: the type of the sensors
+        :param start_time: the start of the window in milliseconds since the epoch
+        :param end_time: the end of the window in milliseconds since the epoch, not included, now if not given
+        :return: a list of readings
+        """
+        interval = self.reading_intervals.get(sensor_type, 60)
+        now = int(self.clock())
+        start = max(start_time // 1000, now - MAX_HISTORY_SECONDS)
+        if end_time is not None:
+            now = min(now, (end_time - 1) // 1000)
+
+        if self.reading_source is not None:
+            return self.reading_source(sensor_type, start, now)
+        fan_states = {actuator["name"]: actuator["state"] for actuator in self.actuators}
+
+        result = list()
+        reading_time = now - now % interval
+        while reading_time >= start:
+            for sensor in self.sensors.get(sensor_type, list()):
+                result.append(synthetic_reading(sensor_type, sensor, reading_time, fan_states.get(sensor, False)))
+            reading_time -= interval
+
+        return result
+
+    def handle(self, handler: BaseHTTPRequestHandler, method: str) -> None:
+        """
+        Routes a request and writes the response
+        :param handler: the request handler
+        :param method: the http method
+        :return: None
+        """
+        started = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+
+        length = int(handler.headers.get("content-length") or 0)
+        body = handler.rfile.read(length) if length else b""
+
+        content_type = JSON_CONTENT_TYPE
+        headers = {key.lower(): value for key, value in handler.headers.items()}
+        request = self.decode_body(body, headers)
+        if request is UNSUPPORTED:
+            route, status, data = method + " " + urlparse(handler.path).path, 415, b"unsupported body encoding"
+        else:
+            route, status, payload = self.route(method, handler.path, request)
+            data, content_type = self.encode_payload(payload, headers)
+
+        use_gzip = self.accept_gzip and len(data) >= GZIP_MIN_RESPONSE_BYTES and \
+            "gzip" in headers.get("accept-encoding", "")
+        if use_gzip:
+            data = gzip.compress(data, compresslevel=6)
+
+        if self.bandwidth:
+            time.sleep((len(body) + len(data)) / self.bandwidth)
+
+        handler.send_response(status)
+        handler.send_header("content-type", content_type)
+        if use_gzip:
+            handler.send_header("content-encoding", "gzip")
+        handler.send_header("content-length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+        with self.__lock:
+            stats = self.stats.setdefault(route, {"count": 0, "seconds": 0.0, "bytes": 0, "request_bytes": 0})
+            stats["count"] += 1
+            stats["seconds"] += time.perf_counter() - started
+            stats["bytes"] += len(data)
+            stats["request_bytes"] += len(body)
+
+    def decode_body(self, body: bytes, headers: dict):
+        """
+        Decodes a request body the way the api is set up to understand
+        :param body: the raw body
+        :param headers: the request headers with lower case names
+        :return: the decoded body, None if there is none, UNSUPPORTED if the api does not understand it
+        """
+        if not body:
+            return None
+
+        if headers.get("content-encoding") == "gzip":
+            if not self.accept_gzip:
+                return UNSUPPORTED
+            body = gzip.decompress(body)
+
+        if headers.get("content-type", JSON_CONTENT_TYPE).split(";")[0] in MSGPACK_CONTENT_TYPES:
+            if not self.accept_msgpack:
+                return UNSUPPORTED
+            return load_msgpack().unpackb(body, raw=False)
+
+        return json.loads(body)
+
+    def encode_payload(self, payload, headers: dict) -> tuple:
+        """
+        Encodes a response payload in the format the client asked for
+        :param payload: the payload, None for no body
+        :param headers: the request headers with lower case names
+        :return: a tuple of (body, content type)
+        """
+        if payload is None:
+            return b"", JSON_CONTENT_TYPE
+
+        if self.accept_msgpack and MSGPACK_CONTENT_TYPE in headers.get("accept", ""):
+            return load_msgpack().packb(payload), MSGPACK_CONTENT_TYPE
+
+        return json.dumps(payload).encode(), JSON_CONTENT_TYPE
+
+    def respond(self, method: str, path: str, body: bytes) -> tuple:
+        """
+        Answers a JSON request without any http, so it can also be called in process
+        :param method: the http method
+        :param path: the path with the query string
+        :param body: the JSON request body
+        :return: a tuple of (route, status code, JSON response body)
+        """
+        route, status, payload = self.route(method, path, json.loads(body) if body else None)
+        return route, status, json.dumps(payload).encode() if payload is not None else b""
+
+    def route(self, method: str, path: str, request) -> tuple:
+        """
+        Routes a request
+        :param method: the http method
+        :param path: the path with the query string
+        :param request: the decoded request body, None if there is none
+        :return: a tuple of (route, status code, response payload or None)
+        """
+        url = urlparse(path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+
+        status = 200
+        payload = None
+        route = method + " /" + (parts[0] if parts else "")
+
+        if parts == ["settings"] and method == "GET":
+            payload = self.settings
+        elif parts == ["actuators"] and method == "GET":
+            payload = self.actuators
+        elif len(parts) == 3 and parts[0] == "actuators" and parts[2] == "state" and method in ("PUT", "DELETE"):
+            route = method + " /actuators/<name>/state"
+            for actuator in self.actuators:
+                if actuator["name"] == parts[1]:
+                    actuator["state"] = method == "PUT"
+        elif parts == ["data_readings"] and method == "GET":
+            end_time = int(params["end_time"]) if "end_time" in params and self.honour_end_time else None
+            payload = self.readings(params.get("type", ""), int(params.get("start_time", 0)), end_time)
+        elif parts == ["data_readings", "aggregate"] and method == "GET" and self.serve_aggregates:
+            route = "GET /data_readings/aggregate"
+            payload = aggregate_readings(self.readings(params.get("type", ""), int(params.get("start_time", 0)),
+                                                       int(params["end_time"]) if "end_time" in params else None))
+        elif parts == ["data_readings"] and method == "POST":
+            self.posted_readings.append(request)
+        elif parts == ["greenhouse_server_state"] and method == "POST":
+            pass
+        else:
+            status = 404
+
+        return route, status, payload
+
+
+class _TcpStandIn:
+    """
+    Base class for the socket stand-ins
+    """
+
+    def __init__(self, latency: float = 0.0):
+        """
+        The constructor
+        :param latency: how many seconds to wait before handling each message
+        """
+        self.latency = latency
+        self.messages = list()
+
+        stand_in = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                stand_in.handle(self.request)
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self):
+        self.__thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, sock: socket.socket) -> None:
+        pass
+
+
+class FakeRelayListener(_TcpStandIn):
+    """
+    A stand-in for the RelayListener on the Pis. Records every ACTUATOR_NAME:TYPE:[on|off] message
+    """
+
+    def handle(self, sock: socket.socket) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+        message = sock.recv(2048).decode()
+        if message:
+            self.messages.append((time.time(), message))
+
+
+class FakeSmartplug(_TcpStandIn):
+    """
+    A stand-in for a TP-Link smartplug speaking its XOR autokey protocol
+    """
+
+    def __init__(self, latency: float = 0.0):
+        _TcpStandIn.__init__(self, latency)
+        self.is_on = False
+
+    @staticmethod
+    def encrypt(string: str) -> bytes:
+        key = 171
+        result = bytearray(len(string).to_bytes(4, "big"))
+        for i in string.encode("latin-1"):
+            key = key ^ i
+            result.append(key)
+        return bytes(result)
+
+    @staticmethod
+    def decrypt(data: bytes) -> str:
+        key = 171
+        result = bytearray()
+        for i in data:
+            result.append(key ^ i)
+            key = i
+        return result.decode("latin-1")
+
+    def handle(self, sock: socket.socket) -> None:
+        data = sock.recv(2048)
+        if len(data) < 4:
+            return
+
+        command = json.loads(self.decrypt(data[4:]))
+        self.messages.append((time.time(), command))
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        response = {"system": {"set_relay_state": {"err_code": 0}}}
+        if "set_relay_state" in command.get("system", dict()):
+            self.is_on = bool(command["system"]["set_relay_state"]["state"])
+        elif "get_sysinfo" in command.get("system", dict()):
+            response = {"system": {"get_sysinfo": {"relay_state": int(self.is_on), "err_code": 0}}}
+
+        sock.sendall(self.encrypt(json.dumps(response)))
+
+
+class NullEmailClient:
+    """
+    Stands in for the EmailClient so error digests are recorded instead of sent
+    """
+
+    def __init__(self):
+        self.sent = list()
+
+    def send_message(self, subject: str, message: str, to_list: list) -> None:
+        self.sent.append({"time": time.time(), "subject": subject, "message": message, "to": list(to_list)})
+
+
+def write_config(path: str, api: FakeRestApi, relay_listener: FakeRelayListener, bigfan_plug: FakeSmartplug,
+                 heater_plug: FakeSmartplug, template: str) -> None:
+    """
+    Writes a config file that points the greenhouse server at the stand-ins
+    :param path: where to write the config
+    :param api: the fake REST API
+    :param relay_listener: the fake RelayListener that stands in for every Pi
+    :param bigfan_plug: the fake bigfan smartplug
+    :param heater_plug: the fake heater smartplug
+    :param template: the config file to copy everything else from
+    :return: None
+    """
+    import configparser
+
+    config = configparser.ConfigParser()
+    config.read(template)
+
+    config["rest"] = {"base_url": api.url}
+    config["greenhouse"]["greenhouse_ip"] = "127.0.0.1"
+    config["smartplug"] = {"bigfan_smartplug_ip": "127.0.0.1", "bigfan_smartplug_port": str(bigfan_plug.port),
+                           "heater_smartplug_ip": "127.0.0.1", "heater_smartplug_port": str(heater_plug.port)}
+    config["pi"] = {"solenoid_pi_ip": "127.0.0.1", "fan_pi_ip": "127.0.0.1", "lights_pi_ip": "127.0.0.1",
+                    "socket_port": str(relay_listener.port)}
+
+    with open(path, "w") as f:
+        config.write(f)
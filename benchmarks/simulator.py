@@ -0,0 +1,480 @@
+"""
+Time warp simulator of the greenhouse server. Runs the real control cycles against an in process REST API, fake
+actuators and a synthetic or recorded greenhouse on a virtual clock, so days of cycles take seconds. Writes the
+actuator timeline and every error email for profiling and for comparing two versions of the control logic.
+
+Usage: python -m benchmarks.simulator [--days N] [--cycle-seconds S] [--start ISO] [--readings FILE]
+                                      [--config FILE] [--json FILE] [--compare FILE] [--verbose]
+"""
+import argparse
+import bisect
+import contextlib
+import heapq
+import io
+import itertools
+import json
+import math
+import os
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime
+from unittest import mock
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks.fakes import FakeRestApi, NullEmailClient
+from sgreen2_greenhouse import error_notifier, greenhouse_server
+from sgreen2_greenhouse.event_log import EVENT_LOG
+from sgreen2_greenhouse.greenhouse_server import GreenhouseServer
+from sgreen2_greenhouse.payload_codec import PayloadNegotiator
+from sgreen2_greenhouse.reading_rollups import get_reading_time
+from sgreen2_greenhouse.rest_request import RestRequest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_CONFIG = os.path.join(HERE, os.pardir, "development.ini")
+
+# the virtual clock jumps to the next sleeper once nothing has touched it for this many real seconds
+DEFAULT_QUIET_SECONDS = .002
+
+# the synthetic greenhouse
+SOIL_WATERED = 85.0
+SOIL_START = 50.0
+SOIL_DRYING_PER_HOUR = 1.5
+SOIL_MIN = 5.0
+
+
+class VirtualClock:
+    """
+    Stands in for time.time, time.sleep and datetime.now. Time only moves when every thread that is waiting for it is
+    asleep: once nothing has read the clock or answered a request for quiet_seconds of real time, the clock jumps
+    straight to the earliest sleeper's wake up time
+    """
+
+    def __init__(self, start: float, quiet_seconds: float = DEFAULT_QUIET_SECONDS):
+        """
+        The constructor
+        :param start: the virtual time to start at in seconds since the epoch
+        :param quiet_seconds: how long nothing may happen before the clock jumps
+        """
+        self.now_seconds = start
+        self.quiet_seconds = quiet_seconds
+        self.jumps = 0
+
+        # heap of (wake up time, ticket) of the threads that are asleep
+        self.__sleepers = list()
+        self.__tickets = itertools.count()
+        self.__busy = 0
+        self.__last_activity = time.perf_counter()
+        self.__condition = threading.Condition()
+
+    def time(self) -> float:
+        self.__last_activity = time.perf_counter()
+        return self.now_seconds
+
+    def now(self, tz=None) -> datetime:
+        return datetime.fromtimestamp(self.time(), tz)
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Blocks the calling thread until the clock reaches now + seconds
+        :param seconds: how many virtual seconds to sleep
+        :return: None
+        """
+        with self.__condition:
+            wake_up = self.now_seconds + max(0.0, seconds)
+            entry = (wake_up, next(self.__tickets))
+            heapq.heappush(self.__sleepers, entry)
+
+            try:
+                while self.now_seconds < wake_up:
+                    self.__condition.wait(self.quiet_seconds)
+
+                    # only the earliest sleeper moves the clock, and only when nothing else is going on
+                    if self.now_seconds < wake_up and self.__sleepers[0] == entry and not self.__busy and \
+                            time.perf_counter() - self.__last_activity >= self.quiet_seconds:
+                        self.now_seconds = wake_up
+                        self.jumps += 1
+                        self.__condition.notify_all()
+            finally:
+                self.__sleepers.remove(entry)
+                heapq.heapify(self.__sleepers)
+                self.__last_activity = time.perf_counter()
+
+    @contextlib.contextmanager
+    def busy(self):
+        """
+        Holds the clock still while a thread does work that does not read it, e.g. answering a request
+        """
+        with self.__condition:
+            self.__busy += 1
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__busy -= 1
+                self.__last_activity = time.perf_counter()
+
+    def datetime_class(self) -> type:
+        """
+        :return: a datetime class whose now is the virtual time, to stand in for datetime in the modules that use it
+        """
+        clock = self
+
+        class VirtualDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return clock.now(tz)
+
+        return VirtualDatetime
+
+
+class ActuatorTimeline:
+    """
+    The fake actuators: records every time an actuator actually changes state
+    """
+
+    def __init__(self, clock: VirtualClock, actuators: list):
+        """
+        The constructor
+        :param clock: the virtual clock
+        :param actuators: the actuators with their starting states
+        """
+        self.clock = clock
+        self.commands = 0
+        # name -> ([switch times], [states]) so the state at any time can be bisected
+        self.history = {actuator["name"]: ([clock.time()], [bool(actuator["state"])]) for actuator in actuators}
+        self.__lock = threading.Lock()
+
+    def set_actuator_state(self, actuator: dict, deadline=None) -> bool:
+        """
+        Stands in for GreenhouseServer.set_actuator_state
+        :param actuator: the actuator
+        :param deadline: unused, there is nothing to time out
+        :return: True, the switch always works
+        """
+        now = self.clock.time()
+        with self.__lock:
+            self.commands += 1
+            times, states = self.history.setdefault(actuator["name"], ([now], [False]))
+            if states[-1] != bool(actuator["state"]):
+                times.append(now)
+                states.append(bool(actuator["state"]))
+
+        return True
+
+    def state_at(self, name: str, at: float) -> bool:
+        times, states = self.history.get(name, ((), ()))
+        i = bisect.bisect_right(times, at) - 1
+        return states[i] if i >= 0 else False
+
+    def last_turned_on(self, name: str, at: float):
+        """
+        :return: the last time the actuator was turned on at or before a time, None if it never was
+        """
+        times, states = self.history.get(name, ((), ()))
+        for i in range(bisect.bisect_right(times, at) - 1, 0, -1):
+            if states[i]:
+                return times[i]
+        return None
+
+    def summary(self, end: float) -> dict:
+        """
+        :param end: when the simulation ended
+        :return: a dict of actuator and its switches, seconds on and on intervals as ISO times
+        """
+        result = dict()
+        for name, (times, states) in sorted(self.history.items()):
+            intervals = list()
+            for i, state in enumerate(states):
+                if state:
+                    intervals.append((times[i], times[i + 1] if i + 1 < len(times) else end))
+
+            result[name] = {"switches": len(times) - 1, "on_seconds": sum(off - on for on, off in intervals),
+                            "intervals": [[datetime.fromtimestamp(on).isoformat(), datetime.fromtimestamp(off)
+                                          .isoformat()] for on, off in intervals]}
+        return result
+
+
+class SyntheticGreenhouse:
+    """
+    A greenhouse that reacts to the fake actuators: the temperature follows the sun and drops while a fan is on, the
+    fan speed sensors see their fan, and the soil dries out until its solenoid waters it
+    """
+
+    def __init__(self, api: FakeRestApi, timeline: ActuatorTimeline, soil_solenoids: dict, start: float):
+        """
+        The constructor
+        :param api: the fake REST API, for its sensors and reading intervals
+        :param timeline: the fake actuators
+        :param soil_solenoids: a dict of soil sensor and the solenoid that waters it
+        :param start: when the simulation started
+        """
+        self.api = api
+        self.timeline = timeline
+        self.soil_solenoids = soil_solenoids
+        self.start = start
+        self.fans = [actuator["name"] for actuator in api.actuators if actuator["type"] == "fan"]
+        self.heaters = [actuator["name"] for actuator in api.actuators if actuator["type"] == "heater"]
+
+    def value(self, sensor_type: str, sensor: str, at: int) -> float:
+        noise = (zlib.crc32((sensor + str(at)).encode()) % 1000) / 1000 - .5
+        local_time = datetime.fromtimestamp(at)
+        # peaks mid afternoon
+        sun = math.sin(2 * math.pi * (local_time.hour + local_time.minute / 60 - 9) / 24)
+
+        if sensor_type == "temp":
+            cooling = 8 if any(self.timeline.state_at(fan, at) for fan in self.fans) else 0
+            heating = 6 if any(self.timeline.state_at(heater, at) for heater in self.heaters) else 0
+            return 70 + 22 * sun - cooling + heating + 2 * noise
+        if sensor_type == "humid":
+            return 55 - 15 * sun + 4 * noise
+        if sensor_type == "fanspeed":
+            return 1100 + 100 * noise if self.timeline.state_at(sensor, at) else 0
+        if sensor_type == "soil":
+            solenoid = self.soil_solenoids.get(sensor)
+            watered = self.timeline.last_turned_on(solenoid, at) if solenoid else None
+            moisture = SOIL_START if watered is None else SOIL_WATERED
+            hours_dry = (at - (self.start if watered is None else watered)) / 3600
+            return max(SOIL_MIN, moisture - SOIL_DRYING_PER_HOUR * hours_dry + noise)
+        if sensor_type == "batt":
+            return 3.7 + .1 * noise
+
+        return noise
+
+    def readings(self, sensor_type: str, start: int, now: int) -> list:
+        """
+        The reading source of the fake REST API
+        :return: the readings between start and now, newest first
+        """
+        interval = self.api.reading_intervals.get(sensor_type, 60)
+
+        result = list()
+        reading_time = now - now % interval
+        while reading_time >= start:
+            for sensor in self.api.sensors.get(sensor_type, list()):
+                reading = {"sensor": {"type": sensor_type, "name": sensor}, "created_at": reading_time * 1000,
+                           "reading": self.value(sensor_type, sensor, reading_time)}
+                if sensor_type == "batt":
+                    reading["health"] = "ok"
+                result.append(reading)
+            reading_time -= interval
+
+        return result
+
+
+class RecordedReadings:
+    """
+    Replays readings recorded from /data_readings, one JSON row per line
+    """
+
+    def __init__(self, path: str):
+        self.by_type = dict()
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    reading = json.loads(line)
+                    self.by_type.setdefault(reading["sensor"]["type"], list()).append(
+                        (get_reading_time(reading, 0), reading))
+
+        for rows in self.by_type.values():
+            rows.sort(key=lambda row: row[0])
+
+    def first_time(self) -> float:
+        return min(rows[0][0] for rows in self.by_type.values())
+
+    def readings(self, sensor_type: str, start: int, now: int) -> list:
+        rows = self.by_type.get(sensor_type, list())
+        times = [reading_time for reading_time, _ in rows]
+        return [reading for _, reading in reversed(rows[bisect.bisect_left(times, start):
+                                                        bisect.bisect_right(times, now)])]
+
+
+def in_process_request(api: FakeRestApi, clock: VirtualClock, routes: dict):
+    """
+    Makes a stand-in for requests.request that answers from the fake REST API without any sockets
+    :param api: the fake REST API
+    :param clock: the virtual clock, held still while a request is answered
+    :param routes: counts the requests per route
+    :return: the stand-in
+    """
+    import requests
+
+    def request(method: str, url: str, params: dict = None, data=None, headers: dict = None, **kwargs):
+        path = urlsplit(url).path + ("?" + urlencode(params) if params else "")
+        body = data.encode() if isinstance(data, str) else (data or b"")
+
+        with clock.busy():
+            route, status, content = api.respond(method.upper(), path, body)
+
+        routes[route] = routes.get(route, 0) + 1
+
+        response = requests.Response()
+        response.url = url
+        response.status_code = status
+        response.encoding = "utf-8"
+        response.headers["content-type"] = "application/json"
+        response._content = content
+        return response
+
+    return request
+
+
+def simulate(server: GreenhouseServer, clock: VirtualClock, end: float, cycle_seconds: float) -> int:
+    """
+    Runs cycles until the virtual clock reaches the end, starting one every cycle_seconds like a server whose cycles
+    take that long
+    :return: how many cycles ran
+    """
+    cycles = 0
+    while clock.time() < end:
+        cycle_start = clock.time()
+        server.run_cycle()
+        cycles += 1
+        clock.sleep(cycle_seconds - (clock.time() - cycle_start))
+
+    # let a watering that is still going finish, the clock moves on by itself while the driver waits
+    if server.irrigation_run is not None:
+        server.irrigation_run.join()
+    server.actuator_state_writer.flush()
+    server.error_notifier.quit()
+
+    return cycles
+
+
+def compare(previous: dict, current: dict, tolerance_seconds: float) -> list:
+    """
+    Compares two simulation results
+    :param previous: the results to compare against
+    :param current: the new results
+    :param tolerance_seconds: how far the on time of an actuator may move before it counts as a difference
+    :return: a list of differences, empty if the two behave the same
+    """
+    differences = list()
+    for name in sorted(set(previous["actuators"]) | set(current["actuators"])):
+        before = previous["actuators"].get(name, {"switches": 0, "on_seconds": 0})
+        after = current["actuators"].get(name, {"switches": 0, "on_seconds": 0})
+        if before["switches"] != after["switches"]:
+            differences.append("{0}: {1} switches, was {2}".format(name, after["switches"], before["switches"]))
+        if abs(before["on_seconds"] - after["on_seconds"]) > tolerance_seconds:
+            differences.append("{0}: on for {1:.0f}s, was {2:.0f}s".format(name, after["on_seconds"],
+                                                                          before["on_seconds"]))
+
+    if len(previous["emails"]) != len(current["emails"]):
+        differences.append("{0} error emails, was {1}".format(len(current["emails"]), len(previous["emails"])))
+
+    return differences
+
+
+def main(argv: list) -> int:
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--days", type=float, default=2, help="how many virtual days to run")
+    arg_parser.add_argument("--cycle-seconds", type=float, default=60, help="virtual seconds from cycle to cycle")
+    arg_parser.add_argument("--start", help="the virtual start time, e.g. 2024-06-01T00:00 (defaults to midnight "
+                                            "today, or the first recorded reading)")
+    arg_parser.add_argument("--readings", help="replay these recorded readings, one JSON row per line, instead of "
+                                               "the synthetic greenhouse")
+    arg_parser.add_argument("--config", default=TEMPLATE_CONFIG, help="the greenhouse server config file")
+    arg_parser.add_argument("--quiet-ms", type=float, default=DEFAULT_QUIET_SECONDS * 1000,
+                            help="real time nothing may happen before the virtual clock jumps")
+    arg_parser.add_argument("--json", help="write the results to this file")
+    arg_parser.add_argument("--compare", help="compare with the results of an earlier run, exits with 1 if they differ")
+    arg_parser.add_argument("--tolerance-seconds", type=float, default=60,
+                            help="how far the on time of an actuator may move in --compare")
+    arg_parser.add_argument("--verbose", action="store_true", help="show the server output")
+    args = arg_parser.parse_args(argv)
+
+    recorded = RecordedReadings(args.readings) if args.readings else None
+    if args.start:
+        start = datetime.fromisoformat(args.start).timestamp()
+    elif recorded is not None:
+        start = recorded.first_time()
+    else:
+        start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    end = start + args.days * 24 * 60 * 60
+
+    clock = VirtualClock(start, args.quiet_ms / 1000)
+    api = FakeRestApi(clock=clock.time)
+    # every request is answered in process, the http server is never started
+    api.server.server_close()
+    timeline = ActuatorTimeline(clock, api.actuators)
+    routes = dict()
+
+    server = GreenhouseServer(args.config)
+    email_client = NullEmailClient()
+    server.error_notifier.email_client = email_client
+    server.set_actuator_state = timeline.set_actuator_state
+    # nothing goes over a wire, keep every body plain JSON for the in process api
+    RestRequest.negotiator = PayloadNegotiator("json", gzip=False)
+
+    soil_solenoids = dict(server.config["soil_moisture"]) if "soil_moisture" in server.config else dict()
+    soil_solenoids = {key[:-len("_solenoid")]: solenoid for key, solenoid in soil_solenoids.items()
+                      if key.endswith("_solenoid")}
+    api.reading_source = recorded.readings if recorded is not None else \
+        SyntheticGreenhouse(api, timeline, soil_solenoids, start).readings
+
+    from dateutil import parser
+    parse = parser.parse
+    virtual_datetime = clock.datetime_class()
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    with contextlib.ExitStack() as patches:
+        patches.enter_context(mock.patch("time.time", clock.time))
+        patches.enter_context(mock.patch("time.sleep", clock.sleep))
+        patches.enter_context(mock.patch.object(greenhouse_server, "datetime", virtual_datetime))
+        patches.enter_context(mock.patch.object(error_notifier, "datetime", virtual_datetime))
+        # the schedules are parsed relative to today
+        patches.enter_context(mock.patch.object(parser, "parse", lambda timestr, **kwargs: parse(
+            timestr, default=clock.now().replace(hour=0, minute=0, second=0, microsecond=0), **kwargs)))
+        patches.enter_context(mock.patch("requests.request", in_process_request(api, clock, routes)))
+        patches.enter_context(output)
+
+        cycles = simulate(server, clock, end, args.cycle_seconds)
+        EVENT_LOG.flush()
+    wall_seconds = time.perf_counter() - started
+
+    results = {
+        "start": datetime.fromtimestamp(start).isoformat(),
+        "end": datetime.fromtimestamp(clock.now_seconds).isoformat(),
+        "days": args.days,
+        "cycle_seconds": args.cycle_seconds,
+        "readings": args.readings or "synthetic",
+        "cycles": cycles,
+        "wall_seconds": wall_seconds,
+        "speedup": (clock.now_seconds - start) / wall_seconds,
+        "clock_jumps": clock.jumps,
+        "actuator_commands": timeline.commands,
+        "rest_requests": dict(sorted(routes.items())),
+        "actuators": timeline.summary(clock.now_seconds),
+        "emails": [{"time": datetime.fromtimestamp(email["time"]).isoformat(), "subject": email["subject"],
+                    "message": email["message"]} for email in email_client.sent]
+    }
+
+    print("{0} cycles from {1} to {2} in {3:.1f}s ({4:.0f}x real time)".format(
+        cycles, results["start"], results["end"], wall_seconds, results["speedup"]))
+    for name, actuator in results["actuators"].items():
+        if actuator["switches"]:
+            print("    {0:<12} {1:>4} switches, on for {2:>9.0f}s".format(name, actuator["switches"],
+                                                                        actuator["on_seconds"]))
+    print("    {0} error emails".format(len(results["emails"])))
+    for email in results["emails"]:
+        print("        " + email["time"] + " " + email["subject"] + ": " +
+              email["message"].split("\n")[0][:80])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            differences = compare(json.load(f), results, args.tolerance_seconds)
+        for difference in differences:
+            print("DIFF: " + difference)
+        return 1 if differences else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,78 @@
+"""
+Synthetic data generators for the benchmarks
+"""
+import json
+import random
+import time
+
+from benchmarks.fakes import synthetic_reading
+
+ACTUATOR_TYPES = ("fan", "heater", "lights", "water")
+
+
+def make_sensor_names(sensor_type: str, num_sensors: int) -> list:
+    return [sensor_type + "{0:02d}".format(i + 1) for i in range(num_sensors)]
+
+
+def make_readings(sensor_type: str, num_sensors: int, readings_per_sensor: int, interval: int = 10,
+                  now: int = None) -> list:
+    """
+    Makes rows like the ones /data_readings returns, newest first
+    :param sensor_type: the type of the sensors
+    :param num_sensors: how many sensors posted
+    :param readings_per_sensor: how many readings each sensor posted
+    :param interval: seconds between the readings of a sensor
+    :param now: the time of the newest readings in seconds since the epoch (defaults to now)
+    :return: a list of readings
+    """
+    now = int(time.time()) if now is None else now
+    sensors = make_sensor_names(sensor_type, num_sensors)
+
+    return [synthetic_reading(sensor_type, sensor, now - i * interval)
+            for i in range(readings_per_sensor) for sensor in sensors]
+
+
+def make_averages(num_sensors: int, center: float = 75.0, spread: float = 5.0, seed: int = 0) -> dict:
+    """
+    Makes an average reading per sensor like the ones check_margin_and_range takes
+    :param num_sensors: how many sensors
+    :param center: the middle of the readings
+    :param spread: how far readings can be from the center
+    :param seed: the random seed
+    :return: a dict of sensor name and average reading
+    """
+    rng = random.Random(seed)
+    return {sensor: center + rng.uniform(-spread, spread) for sensor in make_sensor_names("temp", num_sensors)}
+
+
+def make_actuators(num_actuators: int, sort_by_type: bool = True, seed: int = 0) -> list:
+    """
+    Makes rows like the ones /actuators returns
+    :param num_actuators: how many actuators
+    :param sort_by_type: whether to sort them by type like the REST API does
+    :param seed: the random seed
+    :return: a list of actuators
+    """
+    rng = random.Random(seed)
+    actuators = [{"name": "actuator{0:03d}".format(i), "type": rng.choice(ACTUATOR_TYPES), "state": rng.random() < .5}
+                 for i in range(num_actuators)]
+
+    if sort_by_type:
+        actuators.sort(key=lambda actuator: actuator["type"])
+
+    return actuators
+
+
+def make_error_keys(num_errors: int) -> list:
+    return ["error_{0:04d}".format(i) for i in range(num_errors)]
+
+
+def make_smartplug_command(length: int) -> str:
+    """
+    Makes a json command of roughly a given length for the smartplug encryption routines
+    :param length: the approximate length of the command
+    :return: a json string
+    """
+    command = {"system": {"set_relay_state": {"state": 1}}, "padding": ""}
+    command["padding"] = "x" * max(0, length - len(json.dumps(command)))
+    return json.dumps(command)
@@ -20,6 +20,17 @@ pis_require = [
     'RPi.gpio'
 ]
 
+# optional, smaller REST bodies than JSON where the api accepts them
+msgpack_require = [
+    'msgpack'
+]
+
+# optional, Parquet files for export_readings, numpy alone is enough for .npz files
+export_require = [
+    'numpy',
+    'pyarrow'
+]
+
 
 setup(name='sgreen2_greenhouse',
       version='0.0',
@@ -31,12 +42,14 @@ setup(name='sgreen2_greenhouse',
       author='Matthew Kuo',
       author_email='mjk0827@tamu.edu',
       url='',
-      packages=find_packages(),
+      packages=find_packages(exclude=["benchmarks", "benchmarks.*", "tests", "tests.*"]),
       include_package_data=True,
       zip_safe=False,
       install_requires=requires,
       extras_require={
           'pis': pis_require,
-          'greenhouse': greenhouse_require
+          'greenhouse': greenhouse_require,
+          'msgpack': msgpack_require,
+          'export': export_require
       }
       )
@@ -1,6 +1,7 @@
 #include <SPI.h>
 #include <nRF24L01.h>
 #include <RF24.h>
+#include <util/crc16.h>
 
 #include "src/libs/FanMonitor.h"
 #include "src/libs/DHT.h"
@@ -50,6 +51,18 @@ const char *data_mask = "{\"sensor\": {\"type\": \"%s\", \"name\": \"%s\"}, \"re
 #define BATTERY_TYPE "batt"
 #define BATTERY_UNIT "batt_volts"
 
+//Set to 1 to send compact binary records instead of JSON lines
+//The Pi must be configured with serial_format = binary, see sgreen2_pi/serial_framing.py for the format
+#define USE_BINARY_FRAMING 0
+#define FRAME_SYNC 0xA5
+#define FRAME_PAYLOAD_LENGTH 7
+#define TEMPERATURE_CODE 1
+#define HUMIDITY_CODE 2
+#define FANSPEED_CODE 3
+#define SOIL_CODE 4
+#define BATTERY_CODE 5
+#define NO_HEALTH_CODE 0
+
 char temperature_01_data[100];
 char temperature_02_data[100];
 char humidity_01_data[100];
@@ -72,6 +85,24 @@ struct payload_t {
   float voltage_reading;
 };
 
+//Writes one record: sync, length, type code, sensor number, reading, health code, crc16 of length and payload
+void send_binary_record(uint8_t type_code, uint8_t sensor_number, float reading, uint8_t health_code) {
+  uint8_t frame[2 + FRAME_PAYLOAD_LENGTH + 2];
+  frame[0] = FRAME_SYNC;
+  frame[1] = FRAME_PAYLOAD_LENGTH;
+  frame[2] = type_code;
+  frame[3] = sensor_number;
+  memcpy(&frame[4], &reading, sizeof(float));
+  frame[8] = health_code;
+  uint16_t crc = 0;
+  for(uint8_t i = 1; i < 2 + FRAME_PAYLOAD_LENGTH; ++i){
+    crc = _crc_xmodem_update(crc, frame[i]);
+  }
+  frame[9] = crc >> 8;
+  frame[10] = crc & 0xFF;
+  Serial.write(frame, sizeof(frame));
+}
+
 void setup() {
   // put your setup code here, to run once:
   Serial.begin(9600);
@@ -108,10 +139,15 @@ void loop() {
   uint16_t fan_speed_03 = fan_monitor_03.getSpeed();
   digitalWrite(FAN_VCC_PIN, LOW);
   // Send fan data
+#if USE_BINARY_FRAMING
+  send_binary_record(FANSPEED_CODE, 1, fan_speed_01, NO_HEALTH_CODE);
+  send_binary_record(FANSPEED_CODE, 3, fan_speed_03, NO_HEALTH_CODE);
+#else
   sprintf(fan_01_data, data_mask, FAN_TYPE, FAN_ID_01, String(fan_speed_01).c_str(), FANSPEED_UNIT);
   Serial.println(fan_01_data);
   sprintf(fan_03_data, data_mask, FAN_TYPE, FAN_ID_03, String(fan_speed_03).c_str(), FANSPEED_UNIT);
   Serial.println(fan_03_data);
+#endif
   //Read humidity
   digitalWrite(DHT_01_VCC_PIN, HIGH);
   digitalWrite(DHT_02_VCC_PIN, HIGH);
@@ -125,29 +161,45 @@ void loop() {
   digitalWrite(DHT_02_VCC_PIN, LOW);
   //Send temperature and humidity data for sensor 1
   if(!(isnan(humidity_01) || isnan(temperature_01))){
+#if USE_BINARY_FRAMING
+    send_binary_record(TEMPERATURE_CODE, 1, temperature_01, NO_HEALTH_CODE);
+    send_binary_record(HUMIDITY_CODE, 1, humidity_01, NO_HEALTH_CODE);
+#else
     sprintf(temperature_01_data, data_mask, TEMPERATURE_TYPE, TEMPERATURE_ID_01, String(temperature_01).c_str(), TEMPERATURE_UNIT);
     Serial.println(temperature_01_data);
     sprintf(humidity_01_data, data_mask, HUMIDITY_TYPE, HUMIDITY_ID_01, String(humidity_01).c_str(), HUMIDITY_UNIT);
     Serial.println(humidity_01_data);
+#endif
   }
   //Send temperatue and humidity data for sensor 2
   if(!(isnan(humidity_02) || isnan(temperature_02))){
+#if USE_BINARY_FRAMING
+    send_binary_record(TEMPERATURE_CODE, 2, temperature_02, NO_HEALTH_CODE);
+    send_binary_record(HUMIDITY_CODE, 2, humidity_02, NO_HEALTH_CODE);
+#else
     sprintf(temperature_02_data, data_mask, TEMPERATURE_TYPE, TEMPERATURE_ID_02, String(temperature_02).c_str(), TEMPERATURE_UNIT);
     Serial.println(temperature_02_data);
     sprintf(humidity_02_data, data_mask, HUMIDITY_TYPE, HUMIDITY_ID_02, String(humidity_02).c_str(), HUMIDITY_UNIT);
     Serial.println(humidity_02_data);
+#endif
   }
   //Read data transmitted to RF24 module
   while(radio.available()){
     payload_t payload;
     radio.read(&payload, sizeof(payload));
 //    radio.flush_rx();
+#if USE_BINARY_FRAMING
+    uint8_t module_number = (payload.id[0] - '0') * 10 + (payload.id[1] - '0');
+    send_binary_record(SOIL_CODE, module_number, payload.soil_moisture_reading, NO_HEALTH_CODE);
+    send_binary_record(BATTERY_CODE, module_number, payload.voltage_reading, NO_HEALTH_CODE);
+#else
     String soil_id = String(SOIL_TYPE) + String(payload.id);
     String battery_id = String(BATTERY_TYPE) + String(payload.id);
     sprintf(soil_moisture_data, data_mask, SOIL_TYPE, soil_id.c_str(), String(payload.soil_moisture_reading).c_str(), SOIL_UNIT);
     Serial.println(soil_moisture_data);
     sprintf(voltage_reading_data, data_mask, BATTERY_TYPE, battery_id.c_str(), String(payload.voltage_reading).c_str(), BATTERY_UNIT);
     Serial.println(voltage_reading_data);
+#endif
   }
 //  for(int i=0; i < sizeof(addresses)/sizeof(addresses[0]); ++i){
 //    if(radio.available()){
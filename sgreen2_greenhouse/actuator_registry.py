@@ -0,0 +1,121 @@
+import threading
+from typing import Callable, Optional
+
+
+class ActuatorRegistry:
+    """
+    The actuators from /actuators, indexed by name, by type and by the device that switches them. Each fetch is
+    applied as a diff: actuators that did not change keep the same dict, so the indexes are only touched for actuators
+    that were added, removed or changed. A changed actuator gets a new dict rather than being updated in place, so a
+    thread that still holds the old one never sees it half updated
+    """
+
+    def __init__(self, device_of: Callable[[dict], Optional[str]] = lambda actuator: None):
+        """
+        The constructor
+        :param device_of: gives the device that switches an actuator, e.g. a smartplug or a pi, None if there is none
+        """
+        self.device_of = device_of
+        # bumped every time a fetch changes something
+        self.version = 0
+
+        self.__by_name = dict()
+        # type or device -> a dict of name and actuator, so removing one is O(1) and the order of the rows is kept
+        self.__by_type = dict()
+        self.__by_device = dict()
+        self.__lock = threading.Lock()
+
+    def update(self, actuators: list) -> dict:
+        """
+        Applies a fetch of /actuators
+        :param actuators: the actuators the REST API returned
+        :return: a dict of the names that were added, removed and changed
+        """
+        added = list()
+        changed = list()
+
+        with self.__lock:
+            removed = set(self.__by_name)
+
+            for row in actuators:
+                name = row["name"]
+                actuator = self.__by_name.get(name)
+
+                if actuator is None:
+                    actuator = dict(row)
+                    self.__by_name[name] = actuator
+                    self.__index(actuator)
+                    added.append(name)
+                    continue
+
+                removed.discard(name)
+                if actuator == row:
+                    continue
+
+                # the type or the device may have changed, move it in the indexes
+                self.__unindex(actuator)
+                actuator = dict(row)
+                self.__by_name[name] = actuator
+                self.__index(actuator)
+                changed.append(name)
+
+            for name in removed:
+                self.__unindex(self.__by_name.pop(name))
+
+            if added or removed or changed:
+                self.version += 1
+
+        return {"added": added, "removed": sorted(removed), "changed": changed}
+
+    def get(self, name: str) -> Optional[dict]:
+        """
+        Finds an actuator by name
+        :param name: the name of the actuator
+        :return: the actuator, None if there is no such actuator
+        """
+        return self.__by_name.get(name)
+
+    def of_type(self, actuator_type: str) -> list:
+        """
+        Finds the actuators of a type
+        :param actuator_type: the type of the actuators, e.g. fan
+        :return: a list of actuators in the order the REST API returned them
+        """
+        return list(self.__by_type.get(actuator_type, dict()).values())
+
+    def on_device(self, device: str) -> list:
+        """
+        Finds the actuators switched by a device
+        :param device: the device, as given by device_of
+        :return: a list of actuators in the order the REST API returned them
+        """
+        return list(self.__by_device.get(device, dict()).values())
+
+    def devices(self) -> list:
+        """
+        :return: a list of every device that switches at least one actuator
+        """
+        return list(self.__by_device)
+
+    def __iter__(self):
+        return iter(list(self.__by_name.values()))
+
+    def __len__(self) -> int:
+        return len(self.__by_name)
+
+    def __index(self, actuator: dict) -> None:
+        self.__by_type.setdefault(actuator["type"], dict())[actuator["name"]] = actuator
+
+        device = self.device_of(actuator)
+        if device is not None:
+            self.__by_device.setdefault(device, dict())[actuator["name"]] = actuator
+
+    def __unindex(self, actuator: dict) -> None:
+        for index, key in ((self.__by_type, actuator["type"]), (self.__by_device, self.device_of(actuator))):
+            group = index.get(key)
+            if group is None:
+                continue
+
+            group.pop(actuator["name"], None)
+            if not group:
+                del index[key]
@@ -0,0 +1,156 @@
+import threading
+import time
+from typing import Callable, Optional
+
+from sgreen2_greenhouse.circuit_breaker import Backoff, CircuitBreaker, CircuitOpenError
+from sgreen2_greenhouse.event_log import get_logger
+from sgreen2_greenhouse.rest_request import RestDelete, RestPut, RestRequest, DEFAULT_TIMEOUT_SECONDS
+
+LOG = get_logger("actuator_state_writer")
+
+DEFAULT_MAX_PARALLEL_WRITES = 4
+# how long to wait before writing again after a batch had failures, doubling up to the max
+DEFAULT_RETRY_BASE_SECONDS = 1
+DEFAULT_RETRY_MAX_SECONDS = 60
+
+
+class ActuatorStateWriter:
+    """
+    Write-behind persistence of the actuator states to /actuators/<name>/state. Writing a state only records it as the
+    latest one wanted for the actuator and returns, a background thread sends what is waiting in batches. A state that
+    is written again before it went out replaces the one waiting, so an actuator that flaps costs at most one request
+    per batch. The writes of an actuator never overlap, and one that fails is sent again with backoff unless a newer
+    state came in meanwhile, so the database ends up with the latest state of every actuator
+    """
+
+    def __init__(self, base_url: Callable[[], str], breaker: Optional[Callable[[], CircuitBreaker]] = None,
+                 max_parallel: int = DEFAULT_MAX_PARALLEL_WRITES, timeout: float = DEFAULT_TIMEOUT_SECONDS,
+                 retry_base_seconds: float = DEFAULT_RETRY_BASE_SECONDS,
+                 retry_max_seconds: float = DEFAULT_RETRY_MAX_SECONDS):
+        """
+        The constructor. The writer thread is only started by the first write
+        :param base_url: gives the base url of the REST API when a batch is sent, so a failover is followed
+        :param breaker: gives the circuit breaker of the REST API when a batch is sent
+        :param max_parallel: how many writes of a batch are sent at the same time
+        :param timeout: the timeout of each write in seconds
+        :param retry_base_seconds: the first delay after a batch had failures
+        :param retry_max_seconds: the longest delay after a batch had failures
+        """
+        self.base_url = base_url
+        self.breaker = breaker
+        self.max_parallel = max(1, max_parallel)
+        self.timeout = timeout
+        self.backoff = Backoff(retry_base_seconds, retry_max_seconds)
+
+        # actuator name -> the state still to be written
+        self.pending = dict()
+        # how many states were replaced by a newer one before they went out
+        self.coalesced = 0
+        # how many states were sent and not to be sent again
+        self.written = 0
+
+        self.__sending = False
+        # time.monotonic() before which no batch is sent
+        self.__retry_at = 0.0
+        self.__condition = threading.Condition()
+        self.__thread = None
+
+    def write(self, name: str, state: bool) -> None:
+        """
+        Queues the state of an actuator to be written without blocking
+        :param name: the name of the actuator
+        :param state: True to PUT the state, False to DELETE it
+        :return: None
+        """
+        with self.__condition:
+            if name in self.pending:
+                self.coalesced += 1
+            self.pending[name] = state
+
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__write_states, name="actuator_state_writer",
+                                                 daemon=True)
+                self.__thread.start()
+
+            self.__condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits for every queued state to be written
+        :param timeout: how many seconds to wait at most, forever if not given
+        :return: True if nothing was left to write in time
+        """
+        with self.__condition:
+            return self.__condition.wait_for(lambda: not self.pending and not self.__sending, timeout)
+
+    def __write_states(self) -> None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(self.max_parallel, "actuator_state") as executor:
+            while True:
+                with self.__condition:
+                    while not self.pending or time.monotonic() < self.__retry_at:
+                        self.__condition.wait(self.__retry_at - time.monotonic() if self.pending else None)
+
+                    # whatever comes in while this batch is out waits for the next one
+                    batch = self.pending
+                    self.pending = dict()
+                    self.__sending = True
+
+                # a batch that could not be sent at all is sent again, the writer thread must not die
+                written = [False] * len(batch)
+                try:
+                    written = list(executor.map(self.__send, batch.items()))
+                except Exception as err:
+                    LOG.error("writing actuator states failed", error=repr(err))
+                finally:
+                    with self.__condition:
+                        for (name, state), ok in zip(batch.items(), written):
+                            if ok:
+                                self.written += 1
+                            else:
+                                # a newer state of the actuator replaces the one that failed
+                                self.pending.setdefault(name, state)
+
+                        if all(written):
+                            self.backoff.reset()
+                            self.__retry_at = 0.0
+                        else:
+                            self.__retry_at = time.monotonic() + self.backoff.next_delay()
+
+                        self.__sending = False
+                        self.__condition.notify_all()
+
+    def __send(self, item: tuple) -> bool:
+        """
+        Writes the state of an actuator
+        :param item: the (name, state) of the actuator
+        :return: False if the write should be tried again
+        """
+        import requests
+
+        name, state = item
+        url = self.base_url() + "/actuators/" + name + "/state"
+        breaker = self.breaker() if self.breaker is not None else None
+
+        try:
+            response = RestPut.send(url, self.timeout, breaker) if state else \
+                RestDelete.send(url, self.timeout, breaker)
+        except (requests.RequestException, CircuitOpenError) as err:
+            response = RestRequest.failed_response(url, err)
+        except Exception as err:
+            LOG.error("actuator state not written, retrying", actuator=name, state=state, error=repr(err))
+            return False
+
+        if response.status_code >= 500:
+            LOG.warning("actuator state not written, retrying", actuator=name, state=state,
+                        status=response.status_code)
+            return False
+
+        if not response.ok:
+            # the api will not take it however often it is sent
+            LOG.warning("actuator state rejected", actuator=name, state=state, status=response.status_code)
+        else:
+            LOG.debug("actuator state written", actuator=name, state=state)
+
+        return True
@@ -1,14 +1,31 @@
-import json
 import threading
-import time
 from datetime import timedelta
-from statistics import mean
-
-from dateutil import parser
 
+from sgreen2_greenhouse.actuator_registry import ActuatorRegistry
 from sgreen2_greenhouse.error_notifier import ErrorSeverity, Error
+from sgreen2_greenhouse.event_log import get_logger
 from sgreen2_greenhouse.greenhouse_server import GreenhouseServer
-from sgreen2_greenhouse.rest_request import RestGetThread, RestGet
+from sgreen2_greenhouse.irrigation_planner import IrrigationPlanner, IrrigationRun
+from sgreen2_greenhouse.reading_aggregates import pooled_mean
+
+LOG = get_logger("automated_actuators")
+
+
+class AggregateFetchThread(threading.Thread):
+    """
+    Thread that fetches the aggregates of a sensor type, see GreenhouseServer.fetch_aggregates
+    """
+
+    def __init__(self, greenhouse_server: GreenhouseServer, sensor_type: str, window_seconds: int):
+        threading.Thread.__init__(self)
+        self.gs = greenhouse_server
+        self.sensor_type = sensor_type
+        self.window_seconds = window_seconds
+        self.response = None
+        self.aggregates = dict()
+
+    def run(self):
+        self.response, self.aggregates = self.gs.fetch_aggregates(self.sensor_type, self.window_seconds)
 
 
 class AutomatedFans(threading.Thread):
@@ -16,7 +33,7 @@ class AutomatedFans(threading.Thread):
     Thread that executes logic for automating the fans
     """
 
-    def __init__(self, greenhouse_server: GreenhouseServer, actuators: list, settings: dict):
+    def __init__(self, greenhouse_server: GreenhouseServer, actuators: ActuatorRegistry, settings: dict):
         threading.Thread.__init__(self)
         self.gs = greenhouse_server
         self.actuators = actuators
@@ -27,34 +44,35 @@ class AutomatedFans(threading.Thread):
         # get data
         ################################################################################################################
 
-        five_minutes_ago = int(time.time() - 5 * 60) * 1000
-
-        temperature_thread = RestGetThread(self.gs.active_url + "/data_readings",
-                                           {"type": "temp", "start_time": five_minutes_ago})
-        humidity_thread = RestGetThread(self.gs.active_url + "/data_readings",
-                                        {"type": "humid", "start_time": five_minutes_ago})
+        five_minutes = 5 * 60
 
-        temperature_thread.start()
-        humidity_thread.start()
+        fetch_threads = {sensor_type: AggregateFetchThread(self.gs, sensor_type, five_minutes)
+                         for sensor_type in ("temp", "humid")}
+        for thread in fetch_threads.values():
+            thread.start()
 
-        temperature_thread.join()
-        humidity_thread.join()
-
-        temperature_data = json.loads(temperature_thread.response.text)
-        humidity_data = json.loads(humidity_thread.response.text)
+        for thread in fetch_threads.values():
+            thread.join()
 
         ################################################################################################################
         # check for errors
         ################################################################################################################
 
-        if self.gs.is_error_response("fetch_temp", "Fetching temperature data failed", temperature_thread.response):
+        # readings that are being pushed to us are aggregated without a request
+        if fetch_threads["temp"].response is not None and \
+                self.gs.is_error_response("fetch_temp", "Fetching temperature data failed",
+                                          fetch_threads["temp"].response):
             return
 
-        if self.gs.is_error_response("fetch_humid", "Fetching humidity data failed", humidity_thread.response):
+        if fetch_threads["humid"].response is not None and \
+                self.gs.is_error_response("fetch_humid", "Fetching humidity data failed",
+                                          fetch_threads["humid"].response):
             return
 
-        temp_data_by_sensor = self.gs.group_data_by_sensor(temperature_data)
-        humidity_data_by_sensor = self.gs.group_data_by_sensor(humidity_data)
+        temp_aggregates = fetch_threads["temp"].aggregates
+        avg_temp_by_sensor = {sensor: aggregate["avg"] for sensor, aggregate in temp_aggregates.items()}
+        avg_humidity_by_sensor = {sensor: aggregate["avg"] for sensor, aggregate in
+                                  fetch_threads["humid"].aggregates.items()}
 
         # did all the sensors post data?
         ################################################################################################################
@@ -63,40 +81,33 @@ class AutomatedFans(threading.Thread):
 
         self.gs.detect_missing_sensors(ErrorSeverity.MID, "missing_sensors_temp",
                                        "Not all temperature sensors submitted data in the last 5 minutes",
-                                       temp_data_by_sensor, num_temp_sensors)
+                                       "temp", five_minutes, num_temp_sensors,
+                                       self.gs.configured_sensors("temperature"))
 
         self.gs.detect_missing_sensors(ErrorSeverity.MID, "missing_sensors_humid",
                                        "Not all humidity sensors submitted data in the last 5 minutes",
-                                       humidity_data_by_sensor, num_humid_sensors)
+                                       "humid", five_minutes, num_humid_sensors,
+                                       self.gs.configured_sensors("humidity"))
 
         ################################################################################################################
         # take action
         ################################################################################################################
 
-        actuator_groups = self.gs.group_actuators(self.actuators)
-
-        db_threads = list()
-
-        if len(temperature_data) > 0:
-            avg_temp = mean([reading["reading"] for reading in temperature_data])
-
+        avg_temp = pooled_mean(temp_aggregates)
+        if avg_temp is not None:
             turn_on_fans = float(avg_temp) > int(self.settings["temperature"]["max"])
             turn_on_heater = float(avg_temp) < int(self.settings["temperature"]["min"])
 
-            fans = actuator_groups["fan"]
-            heaters = actuator_groups["heater"]
+            fans = self.actuators.of_type("fan")
+            heaters = self.actuators.of_type("heater")
 
             for fan in fans:
                 fan["state"] = turn_on_fans
-                db_threads.append(self.gs.set_actuator_state_and_update_db(fan))
+                self.gs.set_actuator_state_and_update_db(fan)
 
             for heater in heaters:
                 heater["state"] = turn_on_heater
-                db_threads.append(self.gs.set_actuator_state_and_update_db(heater))
-
-            # join threads
-            for thread in db_threads:
-                thread.join()
+                self.gs.set_actuator_state_and_update_db(heater)
 
         # continue less serious error checks
         # check if fans are doing what it should be doing
@@ -110,7 +121,7 @@ class AutomatedFans(threading.Thread):
         min_expected_temp = int(self.gs.config["ranges"]["min_temperature"])
         max_expected_temp = int(self.gs.config["ranges"]["max_temperature"])
 
-        self.gs.check_margin_and_range(temp_data_by_sensor, "temp", min_expected_temp, max_expected_temp,
+        self.gs.check_margin_and_range(avg_temp_by_sensor, "temp", min_expected_temp, max_expected_temp,
                                        temperature_margin, sensor_display_type="Temperature",
                                        sensor_display_unit="degrees")
 
@@ -118,7 +129,7 @@ class AutomatedFans(threading.Thread):
         min_expected_humidity = int(self.gs.config["ranges"]["min_humidity"])
         max_expected_humidity = int(self.gs.config["ranges"]["max_humidity"])
 
-        self.gs.check_margin_and_range(humidity_data_by_sensor, "humid", min_expected_humidity, max_expected_humidity,
+        self.gs.check_margin_and_range(avg_humidity_by_sensor, "humid", min_expected_humidity, max_expected_humidity,
                                        humidity_margin, sensor_display_type="Humidity", sensor_display_unit="percent")
 
         check_fans_thread.join()
@@ -138,32 +149,29 @@ class ActuatorBatteries(threading.Thread):
         # get data
         ################################################################################################################
 
-        one_day_ago = int(time.time() - (24 * 60 * 60)) * 1000
-
-        battery_response = RestGet.send(self.gs.active_url + "/data_readings",
-                                        {"type": "batt", "start_time": one_day_ago})
+        one_day = 24 * 60 * 60
 
-        battery_data = json.loads(battery_response.text)
+        battery_response, battery_aggregates = self.gs.fetch_aggregates("batt", one_day)
 
         ################################################################################################################
         # error checking
         ################################################################################################################
 
-        if self.gs.is_error_response("fetch_batt", "Fetching battery data failed", battery_response):
+        if battery_response is not None and \
+                self.gs.is_error_response("fetch_batt", "Fetching battery data failed", battery_response):
             return
 
-        battery_data_by_sensor = self.gs.group_data_by_sensor(battery_data)
         num_battery_sensors = int(self.gs.config["sensors"]["number_battery_sensors"])
 
         self.gs.detect_missing_sensors(ErrorSeverity.MID, "missing_sensors_batt",
                                        "Not all battery sensors submitted data in the last 24 hours",
-                                       battery_data_by_sensor, num_battery_sensors)
+                                       "batt", one_day, num_battery_sensors, self.gs.configured_sensors("battery"))
 
-        for sensor in battery_data_by_sensor:
+        for sensor in battery_aggregates:
             error_key = "low_battery_" + sensor
-            if battery_data_by_sensor[sensor][0]["health"] == "critical":
+            if battery_aggregates[sensor]["health"] == "critical":
                 error_message = "Module " + sensor + " needs battery replacement"
-                print(error_message)
+                LOG.warning(error_message)
                 self.gs.error_notifier.add_error(Error(ErrorSeverity.MID, error_message, error_key))
             else:
                 self.gs.error_notifier.remove_error(error_key)
@@ -174,7 +182,7 @@ class AutomatedSolenoids(threading.Thread):
     Thread that handles logic of automating the solenoids
     """
 
-    def __init__(self, greenhouse_server: GreenhouseServer, actuators: list, settings: dict):
+    def __init__(self, greenhouse_server: GreenhouseServer, actuators: ActuatorRegistry, settings: dict):
         threading.Thread.__init__(self)
         self.gs = greenhouse_server
         self.actuators = actuators
@@ -185,46 +193,46 @@ class AutomatedSolenoids(threading.Thread):
         # get data
         ################################################################################################################
 
-        one_day_ago = int(time.time() - (24 * 60 * 60)) * 1000
+        one_day = 24 * 60 * 60
 
-        soil_moisture_response = RestGet.send(self.gs.active_url + "/data_readings",
-                                              {"type": "soil", "start_time": one_day_ago})
-
-        soil_moisture_data = json.loads(soil_moisture_response.text)
+        soil_moisture_response, soil_moisture_aggregates = self.gs.fetch_aggregates("soil", one_day)
 
         ################################################################################################################
         # error checking
         ################################################################################################################
 
-        if self.gs.is_error_response("fetch_soil", "Fetching soil moisture data failed", soil_moisture_response):
+        if soil_moisture_response is not None and \
+                self.gs.is_error_response("fetch_soil", "Fetching soil moisture data failed", soil_moisture_response):
             return
 
-        soil_moisture_data_by_sensor = self.gs.group_data_by_sensor(soil_moisture_data)
+        latest_soil_moisture_by_sensor = {sensor: aggregate["latest"] for sensor, aggregate in
+                                          soil_moisture_aggregates.items()}
         num_soil_sensors = int(self.gs.config["sensors"]["number_soil_sensors"])
 
         self.gs.detect_missing_sensors(ErrorSeverity.MID, "missing_sensors_soil",
                                        "Not all soil moisture sensors submitted data in the last 24 hours",
-                                       soil_moisture_data_by_sensor, num_soil_sensors)
+                                       "soil", one_day, num_soil_sensors, self.gs.configured_sensors("soil"))
 
         # are the soil moisture readings within an expected range?
         ################################################################################################################
 
         min_expected_soil = int(self.gs.config["ranges"]["min_soil_moisture"])
         max_expected_soil = int(self.gs.config["ranges"]["max_soil_moisture"])
-        for sensor in soil_moisture_data_by_sensor:
-            reading = soil_moisture_data_by_sensor[sensor][0]
+        for sensor, reading in latest_soil_moisture_by_sensor.items():
             error_key = "exceeds_max_soil_" + sensor
             if reading > self.settings["soil_moisture"]["max"]:
                 error_message = "Soil moisture sensor " + sensor + \
                                 " reading above configured max\n\tYou may need to check if the water is leaking.\n" + \
                                 "\tReading: " + "{0:.2f}".format(reading)
 
-                print(error_message)
+                LOG.warning(error_message)
                 self.gs.error_notifier.add_error(Error(ErrorSeverity.MID, error_message, error_key))
             else:
                 self.gs.error_notifier.remove_error(error_key)
 
-        self.gs.check_margin_and_range(soil_moisture_data_by_sensor, "soil", min_expected_soil, max_expected_soil, None,
+        self.gs.check_margin_and_range({sensor: aggregate["avg"] for sensor, aggregate in
+                                        soil_moisture_aggregates.items()}, "soil",
+                                       min_expected_soil, max_expected_soil, None,
                                        sensor_display_type="Soil moisture", sensor_display_unit="percent")
 
         ################################################################################################################
@@ -233,28 +241,40 @@ class AutomatedSolenoids(threading.Thread):
 
         for i in range(len(self.gs.watering_times)):
             if self.gs.get_current_time() >= self.gs.watering_times[i]:
+                # a run that is still going from the last watering time is not doubled up, this watering time stays
+                # due so it runs in the first cycle after that run is done
+                if self.gs.irrigation_run is not None and self.gs.irrigation_run.is_alive():
+                    LOG.info("watering postponed until the last run is done",
+                             watering_time=self.gs.watering_times[i].isoformat())
+                    break
+
                 self.gs.watering_times[i] += timedelta(days=1)
 
-                solenoid_threads = list()
-                if len(soil_moisture_data_by_sensor) > 0:
-                    for sensor in soil_moisture_data_by_sensor:
-                        # we don't know which solenoid corresponds to this soil moisture sensor
-                        if not (sensor + "_solenoid") in self.gs.config["soil_moisture"]:
+                zone_seconds = dict()
+                solenoids = dict()
+                for sensor, reading in latest_soil_moisture_by_sensor.items():
+                    # we don't know which solenoid corresponds to this soil moisture sensor
+                    if not (sensor + "_solenoid") in self.gs.config["soil_moisture"]:
+                        continue
+
+                    if reading < self.settings["soil_moisture"]["min"]:
+                        solenoid_name = self.gs.config["soil_moisture"][sensor + "_solenoid"]
+                        if self.actuators.get(solenoid_name) is None:
                             continue
 
-                        reading = soil_moisture_data_by_sensor[sensor][0]
-                        if reading < self.settings["soil_moisture"]["min"]:
-                            solenoid_name = self.gs.config["soil_moisture"][sensor + "_solenoid"]
-                            solenoid = self.gs.find_actuator(self.actuators, solenoid_name)
-                            num_seconds = int(self.gs.config["solenoid"][solenoid_name + "_seconds"])
-                            solenoid_thread = threading.Thread(target=self.gs.turn_on_actuator_and_update_db_for_time,
-                                                               args=(solenoid, num_seconds))
-                            solenoid_thread.start()
-                            solenoid_threads.append(solenoid_thread)
+                        # the run outlives this cycle, it gets a copy it can switch on and off on its own
+                        solenoids[solenoid_name] = dict(self.actuators.get(solenoid_name))
+                        zone_seconds[solenoid_name] = int(self.gs.config["solenoid"][solenoid_name + "_seconds"])
 
-                # join the solenoid threads
-                for thread in solenoid_threads:
-                    thread.join()
+                if zone_seconds:
+                    # every zone shares the master solenoid and the supply pressure
+                    max_concurrent_zones = self.gs.config["solenoid"].get("max_concurrent_zones")
+                    schedule = IrrigationPlanner.plan(zone_seconds, int(max_concurrent_zones)
+                                                      if max_concurrent_zones else None)
+
+                    # water in the background so the rest of the cycle is not held up until the last zone is done
+                    self.gs.irrigation_run = IrrigationRun(self.gs, schedule, solenoids)
+                    self.gs.irrigation_run.start()
 
                 break
 
@@ -264,13 +284,15 @@ class AutomatedLights(threading.Thread):
     Thread that handles the logic of automating the lights
     """
 
-    def __init__(self, greenhouse_server: GreenhouseServer, actuators: list, settings: dict):
+    def __init__(self, greenhouse_server: GreenhouseServer, actuators: ActuatorRegistry, settings: dict):
         threading.Thread.__init__(self)
         self.gs = greenhouse_server
         self.actuators = actuators
         self.settings = settings
 
     def run(self):
+        from dateutil import parser
+
         lights_start_time = parser.parse(self.settings["lights"]["start_time"])
         lights_end_time = parser.parse(self.settings["lights"]["end_time"])
 
@@ -290,9 +312,7 @@ class AutomatedLights(threading.Thread):
             else:
                 lights_end_time += timedelta(days=1)
 
-        actuator_groups = self.gs.group_actuators(self.actuators)
-
         turn_on_lights = lights_start_time <= now <= lights_end_time
-        for light in actuator_groups["lights"]:
+        for light in self.actuators.of_type("lights"):
             light["state"] = turn_on_lights
             self.gs.set_actuator_state_and_update_db(light)
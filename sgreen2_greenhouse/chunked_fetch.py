@@ -0,0 +1,234 @@
+import math
+import time
+from collections import deque
+from typing import Callable, Iterator, Optional, TYPE_CHECKING, Union
+
+from sgreen2_greenhouse.circuit_breaker import CircuitBreaker
+from sgreen2_greenhouse.event_log import get_logger
+from sgreen2_greenhouse.payload_codec import decode_response
+from sgreen2_greenhouse.reading_rollups import get_reading_time
+from sgreen2_greenhouse.rest_request import RestGetThread, DEFAULT_TIMEOUT_SECONDS
+
+if TYPE_CHECKING:
+    from requests import Response
+
+LOG = get_logger("chunked_fetch")
+
+DEFAULT_CHUNK_SECONDS = 6 * 60 * 60
+DEFAULT_MAX_PARALLEL_CHUNKS = 4
+# how many times a chunk that failed is fetched again, the chunks that came in are kept
+DEFAULT_CHUNK_RETRIES = 1
+
+
+class ChunkFetchError(Exception):
+    """
+    A chunk of a time range could not be fetched
+    """
+
+    def __init__(self, chunk: tuple, response: "Response"):
+        """
+        The constructor
+        :param chunk: the (start, end) of the chunk in seconds since the epoch
+        :param response: the response to the chunk's request
+        """
+        Exception.__init__(self, "fetching readings from {0} to {1} failed with {2}".format(
+            chunk[0], chunk[1], response.status_code))
+        self.chunk = chunk
+        self.response = response
+
+
+def split_time_range(start_time: float, end_time: float, chunk_seconds: float = DEFAULT_CHUNK_SECONDS) -> list:
+    """
+    Splits a time range into chunks
+    :param start_time: the start of the range in seconds since the epoch
+    :param end_time: the end of the range in seconds since the epoch, not included
+    :param chunk_seconds: how long each chunk is, the last one may be shorter
+    :return: a list of (start, end) chunks, oldest first
+    """
+    chunks = list()
+    chunk_start = start_time
+    while chunk_start < end_time:
+        chunk_end = min(chunk_start + chunk_seconds, end_time)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+
+    return chunks
+
+
+def chunk_query(sensor_type: str, chunk: tuple) -> dict:
+    """
+    :param sensor_type: the type of the sensors
+    :param chunk: the (start, end) of the chunk in seconds since the epoch
+    :return: the url parameters to fetch the readings of a chunk from /data_readings
+    """
+    return {"type": sensor_type, "start_time": int(chunk[0] * 1000), "end_time": int(chunk[1] * 1000)}
+
+
+def chunk_readings(readings: list, chunk: tuple, last: bool = False) -> list:
+    """
+    Keeps the readings that fall into a chunk, so neighbouring chunks never share a reading even if the api rounds
+    the times. A reading without a usable time is taken to be the newest, like the rollups take it
+    to be from now, so it is kept in the last chunk
+    :param readings: the raw json readings from the database
+    :param chunk: the (start, end) of the chunk in seconds since the epoch
+    :param last: whether this is the last chunk of the range
+    :return: the readings of the chunk, oldest first
+    """
+    timed = [(get_reading_time(reading, math.inf), reading) for reading in readings]
+    return [reading for reading_time, reading in sorted(timed, key=lambda pair: pair[0])
+            if chunk[0] <= reading_time < chunk[1] or (last and reading_time == math.inf)]
+
+
+def ignores_end_time(readings: list, chunk: tuple) -> bool:
+    """
+    Whether the api sent readings past the end of the chunk they were asked for with
+    :param readings: the raw json readings the chunk was answered with
+    :param chunk: the (start, end) of the chunk in seconds since the epoch
+    :return: True if a reading is at or after the end of the chunk, readings without a usable time do not count
+    """
+    return any(get_reading_time(reading, -math.inf) >= chunk[1] for reading in readings)
+
+
+def fetch_chunks(base_url: str, sensor_type: str, chunks: list, max_parallel: int = DEFAULT_MAX_PARALLEL_CHUNKS,
+                 timeout: Union[float, Callable[[], float]] = DEFAULT_TIMEOUT_SECONDS,
+                 breaker: Optional[CircuitBreaker] = None, retries: int = DEFAULT_CHUNK_RETRIES,
+                 end_time_support: Optional[dict] = None) -> Iterator[tuple]:
+    """
+    Fetches the readings of a sensor type chunk by chunk, max_parallel chunks at a time. The chunks are handed out in
+    order as soon as they and every chunk before them are in, and at most max_parallel of them are held at once, so
+    memory does not grow with the length of the range. A chunk that fails is fetched again on its own.
+    Chunking only pays off if the api honours end_time, else every chunk sends everything from its start on. Until that
+    is known for an api the first chunk is fetched on its own: if it comes back with readings past its end, the api is
+    remembered not to honour end_time and that one response is the whole range. An api is remembered to honour it once
+    a later chunk has readings the first one was not sent
+    :param base_url: the base url of the REST API
+    :param sensor_type: the type of the sensors
+    :param chunks: the (start, end) chunks, see split_time_range
+    :param max_parallel: how many chunks to fetch at the same time
+    :param timeout: the timeout of each chunk's request in seconds, or a function giving it when the request is sent
+    :param breaker: the circuit breaker of the REST API
+    :param retries: how many times to fetch a chunk again after it failed
+    :param end_time_support: a dict of base url and whether the api honours end_time, read and updated here so it is
+    only found out once per api
+    :return: an iterator of (chunk, readings of the chunk oldest first, the response of the chunk)
+    :raises ChunkFetchError: when a chunk could not be fetched
+    """
+    end_time_support = dict() if end_time_support is None else end_time_support
+
+    def fetch(chunk: tuple) -> RestGetThread:
+        thread = RestGetThread(base_url + "/data_readings", chunk_query(sensor_type, chunk),
+                               timeout() if callable(timeout) else timeout, breaker)
+        thread.start()
+        return thread
+
+    def fetch_alone(chunk: tuple) -> "Response":
+        for _ in range(retries + 1):
+            thread = fetch(chunk)
+            thread.join()
+            if thread.response.ok:
+                break
+
+        if not thread.response.ok:
+            raise ChunkFetchError(chunk, thread.response)
+
+        return thread.response
+
+    supported = end_time_support.get(base_url)
+    if len(chunks) > 1 and not supported:
+        whole_range = (chunks[0][0], chunks[-1][1])
+
+        if supported is False:
+            response = fetch_alone(whole_range)
+            yield whole_range, chunk_readings(decode_response(response), whole_range, True), response
+            return
+
+        first_chunk = chunks[0]
+        first_sent = time.time()
+        response = fetch_alone(first_chunk)
+        readings = decode_response(response)
+
+        if ignores_end_time(readings, first_chunk):
+            LOG.warning("fetching readings in one request from now on, the api ignores end_time", url=base_url)
+            end_time_support[base_url] = False
+            # everything from the start of the range on is already here
+            yield whole_range, chunk_readings(readings, whole_range, True), response
+            return
+
+        yield first_chunk, chunk_readings(readings, first_chunk), response
+        chunks = chunks[1:]
+        probing = True
+    else:
+        probing = False
+
+    last_chunk = chunks[-1] if chunks else None
+    remaining = iter(chunks)
+    # (chunk, thread, attempts) in the order of the chunks
+    in_flight = deque()
+
+    def fetch_next() -> None:
+        chunk = next(remaining, None)
+        if chunk is not None:
+            in_flight.append((chunk, fetch(chunk), 1))
+
+    for _ in range(max(1, max_parallel)):
+        fetch_next()
+
+    while in_flight:
+        chunk, thread, attempts = in_flight.popleft()
+        thread.join()
+
+        if not thread.response.ok:
+            if attempts > retries:
+                raise ChunkFetchError(chunk, thread.response)
+
+            # only this chunk is fetched again, it stays first in line
+            in_flight.appendleft((chunk, fetch(chunk), attempts + 1))
+            continue
+
+        # keep max_parallel requests going while this chunk is being handled
+        fetch_next()
+        readings = chunk_readings(decode_response(thread.response), chunk, chunk == last_chunk)
+
+        if probing and any(get_reading_time(reading, math.inf) < first_sent for reading in readings):
+            # the first chunk was not sent these although they were there, so the api stopped it at its end_time
+            end_time_support[base_url] = True
+            probing = False
+
+        yield chunk, readings, thread.response
+
+
+def fetch_time_range(base_url: str, sensor_type: str, start_time: float, end_time: float,
+                     chunk_seconds: float = DEFAULT_CHUNK_SECONDS, max_parallel: int = DEFAULT_MAX_PARALLEL_CHUNKS,
+                     timeout: Union[float, Callable[[], float]] = DEFAULT_TIMEOUT_SECONDS,
+                     breaker: Optional[CircuitBreaker] = None, retries: int = DEFAULT_CHUNK_RETRIES,
+                     end_time_support: Optional[dict] = None) -> tuple:
+    """
+    Fetches every reading of a sensor type over a time range as chunks fetched at the same time, so the latency is
+    that of the slowest chunk rather than of the whole range, see fetch_chunks
+    :param base_url: the base url of the REST API
+    :param sensor_type: the type of the sensors
+    :param start_time: the start of the range in seconds since the epoch
+    :param end_time: the end of the range in seconds since the epoch, not included
+    :param chunk_seconds: how long each chunk is
+    :param max_parallel: how many chunks to fetch at the same time
+    :param timeout: the timeout of each chunk's request in seconds, or a function giving it when the request is sent
+    :param breaker: the circuit breaker of the REST API
+    :param retries: how many times to fetch a chunk again after it failed
+    :param end_time_support: a dict of base url and whether the api honours end_time, see fetch_chunks
+    :return: a tuple of (the response of the last chunk, or of the chunk that failed; the readings oldest first, empty
+    if a chunk failed)
+    """
+    readings = list()
+    response = None
+    chunks = split_time_range(start_time, end_time, chunk_seconds)
+
+    try:
+        for _, chunk, response in fetch_chunks(base_url, sensor_type, chunks, min(max_parallel, len(chunks)),
+                                               timeout, breaker, retries, end_time_support):
+            # the chunks do not overlap and come in order, so they are already merged
+            readings.extend(chunk)
+    except ChunkFetchError as err:
+        # the chunks that came in are not handed out, the caller fetches the whole range again
+        return err.response, list()
+
+    return response, readings
@@ -0,0 +1,189 @@
+import random
+import threading
+import time
+
+from sgreen2_greenhouse.event_log import get_logger
+
+LOG = get_logger("circuit_breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(ConnectionError):
+    """
+    Raised instead of calling a downstream that is known to be down. It is an OSError so the code that already handles
+    connection errors handles it the same way
+    """
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter: every delay is twice the one before, up to a maximum, and then a random part of it
+    is taken off so that retries do not line up
+    """
+
+    def __init__(self, base_seconds: float, max_seconds: float, jitter: float = .5):
+        """
+        The constructor
+        :param base_seconds: the first delay
+        :param max_seconds: the longest delay
+        :param jitter: up to which fraction of each delay is taken off at random
+        """
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        """
+        :return: how many seconds to wait before the next attempt
+        """
+        delay = min(self.max_seconds, self.base_seconds * 2 ** self.attempts)
+        self.attempts += 1
+        return delay * (1 - self.jitter * random.random())
+
+    def reset(self) -> None:
+        self.attempts = 0
+
+
+class CircuitBreaker:
+    """
+    Tracks whether one downstream, e.g. a pi, a smartplug or a REST API, is up. After failure_threshold failures in a
+    row the breaker opens and every call fails fast with CircuitOpenError until the backoff is over. Then a single call
+    is let through as a probe: if it succeeds the breaker closes, if it fails the breaker opens again for longer
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, base_backoff_seconds: float = 5,
+                 max_backoff_seconds: float = 300):
+        """
+        The constructor
+        :param name: the name of the downstream
+        :param failure_threshold: how many failures in a row open the breaker
+        :param base_backoff_seconds: how long the breaker stays open the first time
+        :param max_backoff_seconds: the longest the breaker stays open
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.backoff = Backoff(base_backoff_seconds, max_backoff_seconds)
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.retry_time = 0.0
+        self.fast_failures = 0
+        self.__lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """
+        Checks whether a call to the downstream can go ahead
+        :return: None
+        :raises CircuitOpenError: if the breaker is open, or half open with a probe already in flight
+        """
+        with self.__lock:
+            if self.state == CLOSED:
+                return
+
+            if self.state == OPEN and time.monotonic() >= self.retry_time:
+                # let this call through as the probe
+                self.__set_state(HALF_OPEN)
+                return
+
+            self.fast_failures += 1
+            raise CircuitOpenError(self.name + " is down, retrying in {0:.0f} seconds".format(
+                max(0.0, self.retry_time - time.monotonic())))
+
+    def record_success(self) -> None:
+        with self.__lock:
+            self.consecutive_failures = 0
+            self.backoff.reset()
+            if self.state != CLOSED:
+                self.__set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        with self.__lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.retry_time = time.monotonic() + self.backoff.next_delay()
+                self.__set_state(OPEN)
+
+    def call(self, function, *args, failure_types: tuple = (OSError,), **kwargs):
+        """
+        Calls a function through the breaker
+        :param function: the function that talks to the downstream
+        :param failure_types: the exceptions that mean the downstream is down
+        :return: what the function returned
+        :raises CircuitOpenError: if the breaker is open
+        """
+        self.before_call()
+        try:
+            result = function(*args, **kwargs)
+        except failure_types:
+            self.record_failure()
+            raise
+        except Exception:
+            # the downstream answered, it just did not like the call
+            self.record_success()
+            raise
+
+        self.record_success()
+        return result
+
+    def status(self) -> dict:
+        """
+        :return: a dict of the state of the breaker
+        """
+        return {"name": self.name, "state": self.state, "consecutive_failures": self.consecutive_failures,
+                "retry_in_seconds": max(0.0, self.retry_time - time.monotonic()) if self.state == OPEN else 0.0,
+                "fast_failures": self.fast_failures}
+
+    def __set_state(self, state: str) -> None:
+        # only queued, the breaker's lock is held here
+        LOG.info("circuit breaker state", breaker=self.name, previous=self.state, state=state)
+        self.state = state
+
+
+class CircuitBreakers:
+    """
+    A circuit breaker per downstream, created the first time the downstream is used
+    """
+
+    def __init__(self, failure_threshold: int = 3, base_backoff_seconds: float = 5, max_backoff_seconds: float = 300):
+        """
+        The constructor
+        :param failure_threshold: how many failures in a row open a breaker
+        :param base_backoff_seconds: how long a breaker stays open the first time
+        :param max_backoff_seconds: the longest a breaker stays open
+        """
+        self.failure_threshold = failure_threshold
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+        self.breakers = dict()
+        self.__lock = threading.Lock()
+
+    def get(self, name: str) -> CircuitBreaker:
+        """
+        :param name: the name of the downstream, e.g. pi_192.168.1.101
+        :return: the breaker of the downstream
+        """
+        with self.__lock:
+            if name not in self.breakers:
+                self.breakers[name] = CircuitBreaker(name, self.failure_threshold, self.base_backoff_seconds,
+                                                     self.max_backoff_seconds)
+
+            return self.breakers[name]
+
+    def is_open(self, name: str) -> bool:
+        """
+        :param name: the name of the downstream
+        :return: whether calls to the downstream are failing fast
+        """
+        breaker = self.breakers.get(name)
+        return breaker is not None and breaker.state == OPEN and time.monotonic() < breaker.retry_time
+
+    def status(self) -> list:
+        """
+        :return: a list of the state of every breaker
+        """
+        return [breaker.status() for breaker in list(self.breakers.values())]
@@ -0,0 +1,79 @@
+import threading
+import time
+from typing import Optional
+
+# operations are never given less than this, so a cycle that is out of budget still fails fast instead of not trying
+MIN_OPERATION_TIMEOUT_SECONDS = .5
+
+
+class Deadline:
+    """
+    A time budget for one cycle of the greenhouse server. Every REST call, pi socket and smartplug socket of the cycle
+    takes its timeout from the time that is left, so one unreachable device cannot stretch the cycle without limit.
+    Operations that start after the budget ran out are remembered so the overrun can be reported
+    """
+
+    def __init__(self, budget_seconds: float):
+        """
+        The constructor. Starts the clock
+        :param budget_seconds: how many seconds the cycle may take
+        """
+        self.budget_seconds = budget_seconds
+        self.start_time = time.monotonic()
+        self.end_time = self.start_time + budget_seconds
+
+        # (operation, seconds past the deadline when it started)
+        self.overruns = list()
+        self.__lock = threading.Lock()
+
+    def remaining(self) -> float:
+        """
+        :return: how many seconds are left, negative once the deadline has passed
+        """
+        return self.end_time - time.monotonic()
+
+    def elapsed(self) -> float:
+        """
+        :return: how many seconds have passed since the deadline was started
+        """
+        return time.monotonic() - self.start_time
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, operation: str, maximum: Optional[float] = None) -> float:
+        """
+        Gives the timeout for an operation that is about to start
+        :param operation: what the operation is, for the overrun report
+        :param maximum: the longest the operation should take even if there is more time left
+        :return: the seconds left, capped at maximum and at least MIN_OPERATION_TIMEOUT_SECONDS
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            with self.__lock:
+                self.overruns.append((operation, -remaining))
+
+        if maximum is not None:
+            remaining = min(remaining, maximum)
+
+        return max(remaining, MIN_OPERATION_TIMEOUT_SECONDS)
+
+    def overrun_message(self) -> Optional[str]:
+        """
+        Describes how the deadline was overrun
+        :return: a message, None if every operation started within the budget and the budget was not exceeded
+        """
+        if not self.overruns and not self.expired():
+            return None
+
+        message = "The cycle took {0:.1f} seconds, over its budget of {1:.1f} seconds".format(
+            self.elapsed(), self.budget_seconds)
+
+        with self.__lock:
+            overruns = list(self.overruns)
+
+        if overruns:
+            message += "\n\tStarted after the deadline:" + "".join(
+                "\n\t" + operation + " ({0:.1f}s late)".format(seconds) for operation, seconds in overruns)
+
+        return message
@@ -1,6 +1,3 @@
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 from typing import List
 
 
@@ -30,6 +27,11 @@ class EmailClient:
         :param to_list: a list of email addresses
         :return: None
         """
+        # only needed when there is an error digest to send, so don't slow down every start up with them
+        import smtplib
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+
         smtp_client = smtplib.SMTP(host=self.smtp_server, port=self.port)
 
         smtp_client.starttls()
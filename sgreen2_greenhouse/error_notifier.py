@@ -87,6 +87,8 @@ class ErrorNotifier:
         self.total_severity = 0
 
         self.__current_email_thread = None
+        # errors are added and removed from many threads at once, e.g. the automated threads and the actuator lanes
+        self.__lock = threading.Lock()
 
     def add_error(self, error: Error) -> None:
         """
@@ -95,21 +97,23 @@ class ErrorNotifier:
         :return: None
         """
 
-        # add the error to the first available stage
-        for stage in range(self.total_stages):
-            if error.error_key not in self.active_errors[stage] or error.severity == ErrorSeverity.CRITICAL:
-                self.active_errors[stage][error.error_key] = \
-                    datetime.now(timezone.utc).astimezone().strftime("%x %X ") + str(error.severity) + ": " + \
-                    error.message
+        message = datetime.now(timezone.utc).astimezone().strftime("%x %X ") + str(error.severity) + ": " + \
+            error.message
 
-                # if the error was inserted into the last stage, add the error to the buffer
-                if stage == self.total_stages - 1 or error.severity == ErrorSeverity.CRITICAL:
-                    self.total_severity += error.severity.value
-                    self.message_buffer[error.error_key] = error
+        with self.__lock:
+            # add the error to the first available stage
+            for stage in range(self.total_stages):
+                if error.error_key not in self.active_errors[stage] or error.severity == ErrorSeverity.CRITICAL:
+                    self.active_errors[stage][error.error_key] = message
 
-                # as soon as we hit a stage where the error is not, break
-                if error.severity != ErrorSeverity.CRITICAL:
-                    break
+                    # if the error was inserted into the last stage, add the error to the buffer
+                    if stage == self.total_stages - 1 or error.severity == ErrorSeverity.CRITICAL:
+                        self.total_severity += error.severity.value
+                        self.message_buffer[error.error_key] = error
+
+                    # as soon as we hit a stage where the error is not, break
+                    if error.severity != ErrorSeverity.CRITICAL:
+                        break
 
     def remove_error(self, error_key) -> None:
         """
@@ -118,12 +122,13 @@ class ErrorNotifier:
         :return: None
         """
 
-        for stage in range(self.total_stages):
-            self.active_errors[stage].pop(error_key, None)
+        with self.__lock:
+            for stage in range(self.total_stages):
+                self.active_errors[stage].pop(error_key, None)
 
-        if error_key in self.message_buffer:
-            self.total_severity -= self.message_buffer[error_key].severity.value
-            self.message_buffer.pop(error_key)
+            if error_key in self.message_buffer:
+                self.total_severity -= self.message_buffer[error_key].severity.value
+                self.message_buffer.pop(error_key)
 
     def send_message(self, email_addresses: list, flush: bool = False) -> None:
         """
@@ -136,18 +141,21 @@ class ErrorNotifier:
             self.__current_email_thread.join()
             self.__current_email_thread = None
 
-        if self.total_severity >= ErrorSeverity.HIGH.value or (flush and self.total_severity > 0):
+        with self.__lock:
+            if self.total_severity < ErrorSeverity.HIGH.value and not (flush and self.total_severity > 0):
+                return
+
             self.total_severity = 0
             self.message_buffer.clear()
 
-            subject = "sGreen Errors"
-
             # only get final stage errors
             message = "\n\n".join(list(self.active_errors[self.total_stages - 1].values()))
 
-            self.__current_email_thread = threading.Thread(target=self.email_client.send_message,
-                                                           args=(subject, message, email_addresses))
-            self.__current_email_thread.start()
+        subject = "sGreen Errors"
+
+        self.__current_email_thread = threading.Thread(target=self.email_client.send_message,
+                                                       args=(subject, message, email_addresses))
+        self.__current_email_thread.start()
 
     def quit(self):
         if self.__current_email_thread:
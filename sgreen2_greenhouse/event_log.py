@@ -0,0 +1,246 @@
+import sys
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {level: name.upper() for name, level in LEVELS.items()}
+
+DEFAULT_RING_SIZE = 500
+# events waiting to be written past this are dropped instead of growing without bound behind a stuck console
+DEFAULT_MAX_QUEUE = 10000
+
+
+class EventLog:
+    """
+    Asynchronous structured logging for the loops of the greenhouse server and the pis. Logging an event only appends
+    it to a queue, a background thread formats it and writes it out, so a slow console, journald or SD card never holds
+    up a cycle or the serial reads. An event below the level costs one comparison. The most recent events, including
+    ones below the level down to ring_level, are kept in memory so they can be looked at after something went wrong
+    """
+
+    def __init__(self, level: int = INFO, ring_level: Optional[int] = None, ring_size: int = DEFAULT_RING_SIZE,
+                 max_queue: int = DEFAULT_MAX_QUEUE, path: Optional[str] = None, json_lines: bool = False):
+        """
+        The constructor. The writer thread is only started by the first event that is written
+        :param level: the lowest level that is written out
+        :param ring_level: the lowest level kept in the ring of recent events, the same as level if not given
+        :param ring_size: how many recent events to keep in memory
+        :param max_queue: how many events can wait to be written before new ones are dropped
+        :param path: the file to append to, standard output if not given
+        :param json_lines: whether to write every event as a JSON object instead of a line of key=value fields
+        """
+        self.level = level
+        self.ring_level = level if ring_level is None else ring_level
+        # the lowest level that is looked at at all
+        self.threshold = min(self.level, self.ring_level)
+        self.max_queue = max_queue
+        self.path = path
+        self.json_lines = json_lines
+
+        # (time, level, component, event, fields)
+        self.recent = deque(maxlen=ring_size)
+        self.dropped = 0
+
+        self.__queue = deque()
+        self.__wake = threading.Event()
+        self.__idle = threading.Event()
+        self.__idle.set()
+        self.__thread = None
+        self.__file = None
+        self.__lock = threading.Lock()
+
+    def configure(self, config: dict) -> None:
+        """
+        Applies the optional [log] section of a config
+        :param config: the section, e.g. config["log"]
+        :return: None
+        """
+        self.level = LEVELS[config.get("level", "info").lower()]
+        self.ring_level = LEVELS[config["ring_level"].lower()] if "ring_level" in config else self.level
+        self.threshold = min(self.level, self.ring_level)
+        self.max_queue = int(config.get("max_queue", str(DEFAULT_MAX_QUEUE)))
+        self.json_lines = config.get("format", "text") == "json"
+        self.recent = deque(self.recent, maxlen=int(config.get("ring_size", str(DEFAULT_RING_SIZE))))
+
+        with self.__lock:
+            if config.get("path") != self.path and self.__file is not None:
+                self.__file.close()
+                self.__file = None
+            self.path = config.get("path")
+
+    def logger(self, component: str) -> "EventLogger":
+        """
+        :param component: what is logging, e.g. greenhouse_server
+        :return: a logger for the component
+        """
+        return EventLogger(self, component)
+
+    def log(self, level: int, component: str, event: str, fields: dict) -> None:
+        """
+        Logs an event without blocking
+        :param level: the level of the event
+        :param component: what logged it
+        :param event: what happened
+        :param fields: anything that goes with it
+        :return: None
+        """
+        if level < self.threshold:
+            return
+
+        record = (time.time(), level, component, event, fields)
+        self.recent.append(record)
+        if level < self.level:
+            return
+
+        if len(self.__queue) >= self.max_queue:
+            self.dropped += 1
+            return
+
+        self.__queue.append(record)
+        # setting and clearing an Event takes a lock, skip it while the writer already has work
+        if self.__idle.is_set():
+            self.__idle.clear()
+        if self.__thread is None:
+            self.__start()
+        if not self.__wake.is_set():
+            self.__wake.set()
+
+    def recent_events(self, level: int = DEBUG, limit: Optional[int] = None) -> list:
+        """
+        :param level: the lowest level to return
+        :param limit: return at most this many of the newest events
+        :return: the recent events as formatted lines, oldest first
+        """
+        lines = [self.format(record) for record in list(self.recent) if record[1] >= level]
+        return lines[-limit:] if limit else lines
+
+    def flush(self, timeout: float = 1) -> bool:
+        """
+        Waits for every queued event to be written
+        :param timeout: how many seconds to wait at most
+        :return: True if the queue was emptied in time
+        """
+        return self.__idle.wait(timeout)
+
+    def format(self, record: tuple) -> str:
+        """
+        Formats an event as a line
+        :param record: the event
+        :return: the line, without a newline
+        """
+        event_time, level, component, event, fields = record
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event_time)) + \
+            ".{0:03d}".format(int(event_time * 1000) % 1000)
+
+        if self.json_lines:
+            import json
+
+            line = {"time": timestamp, "level": LEVEL_NAMES[level], "component": component, "event": event}
+            line.update(fields)
+            return json.dumps(line, default=str)
+
+        line = timestamp + " " + LEVEL_NAMES[level] + " " + component + ": " + event
+        if fields:
+            line += " " + " ".join(key + "=" + (repr(value) if isinstance(value, str) and " " in value else
+                                                str(value)) for key, value in fields.items())
+
+        return line
+
+    def __start(self) -> None:
+        with self.__lock:
+            if self.__thread is not None:
+                return
+
+            import atexit
+
+            # write out what is still queued when the program exits
+            atexit.register(self.flush)
+            self.__thread = threading.Thread(target=self.__write_events, name="event_log", daemon=True)
+            self.__thread.start()
+
+    def __write_events(self) -> None:
+        while True:
+            self.__wake.wait()
+            self.__wake.clear()
+
+            lines = list()
+            while self.__queue:
+                lines.append(self.format(self.__queue.popleft()))
+
+            if lines:
+                try:
+                    stream = self.__stream()
+                    stream.write("\n".join(lines) + "\n")
+                    stream.flush()
+                except (OSError, ValueError):
+                    # nowhere to write to, the events are still in the ring
+                    pass
+
+            if not self.__queue:
+                self.__idle.set()
+                # an event may have been queued between the check and the set
+                if self.__queue:
+                    self.__idle.clear()
+
+    def __stream(self):
+        if self.path is None:
+            # looked up every time so a redirected stdout is honoured
+            return sys.stdout
+
+        with self.__lock:
+            if self.__file is None:
+                self.__file = open(self.path, "a")
+
+            return self.__file
+
+
+class EventLogger:
+    """
+    Logs the events of one component to an EventLog
+    """
+
+    def __init__(self, event_log: EventLog, component: str):
+        self.event_log = event_log
+        self.component = component
+
+    def enabled(self, level: int) -> bool:
+        """
+        :param level: a level
+        :return: whether an event of the level would be kept, to skip building expensive fields when it is not
+        """
+        return level >= self.event_log.threshold
+
+    def debug(self, event: str, **fields) -> None:
+        if DEBUG >= self.event_log.threshold:
+            self.event_log.log(DEBUG, self.component, event, fields)
+
+    def info(self, event: str, **fields) -> None:
+        if INFO >= self.event_log.threshold:
+            self.event_log.log(INFO, self.component, event, fields)
+
+    def warning(self, event: str, **fields) -> None:
+        if WARNING >= self.event_log.threshold:
+            self.event_log.log(WARNING, self.component, event, fields)
+
+    def error(self, event: str, **fields) -> None:
+        if ERROR >= self.event_log.threshold:
+            self.event_log.log(ERROR, self.component, event, fields)
+
+
+# the event log of the process
+EVENT_LOG = EventLog()
+
+
+def get_logger(component: str) -> EventLogger:
+    """
+    :param component: what is logging, e.g. greenhouse_server
+    :return: a logger for the component that logs to the event log of the process
+    """
+    return EVENT_LOG.logger(component)
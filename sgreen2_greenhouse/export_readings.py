@@ -0,0 +1,250 @@
+import configparser
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from sgreen2_greenhouse.chunked_fetch import DEFAULT_CHUNK_RETRIES, DEFAULT_CHUNK_SECONDS, \
+    DEFAULT_MAX_PARALLEL_CHUNKS, fetch_chunks, split_time_range
+from sgreen2_greenhouse.circuit_breaker import CircuitBreaker
+from sgreen2_greenhouse.payload_codec import PayloadNegotiator, DEFAULT_GZIP_MIN_BYTES
+from sgreen2_greenhouse.reading_rollups import get_reading_time
+from sgreen2_greenhouse.rest_request import RestRequest
+
+# a chunk of history is a lot bigger than what a cycle fetches
+DEFAULT_EXPORT_TIMEOUT_SECONDS = 30
+
+# how much of a spooled column is copied into the npz at a time
+NPZ_COPY_BYTES = 1 << 20
+
+
+def reading_columns(readings: list) -> tuple:
+    """
+    Splits readings into columns
+    :param readings: the raw json readings from the database
+    :return: a tuple of (times in milliseconds since the epoch, now for a reading without a usable time like in the
+    rollups, sensor names, readings, healths or None)
+    """
+    return ([int(get_reading_time(reading) * 1000) for reading in readings],
+            [reading["sensor"]["name"] for reading in readings],
+            [float(reading["reading"]) for reading in readings],
+            [reading.get("health") for reading in readings])
+
+
+class ParquetReadingWriter:
+    """
+    Writes readings to a Parquet file with pyarrow, one row group per chunk, with the columns time (UTC), sensor,
+    reading and health
+    """
+
+    def __init__(self, path: str, compression: str = "zstd"):
+        import pyarrow
+        import pyarrow.parquet
+
+        self.path = path
+        self.rows = 0
+        self.__pyarrow = pyarrow
+        self.schema = pyarrow.schema([("time", pyarrow.timestamp("ms", tz="UTC")),
+                                      ("sensor", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+                                      ("reading", pyarrow.float64()),
+                                      ("health", pyarrow.dictionary(pyarrow.int8(), pyarrow.string()))])
+        self.__writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression=compression)
+
+    def write(self, readings: list) -> None:
+        if not readings:
+            return
+
+        pyarrow = self.__pyarrow
+        times, sensors, values, healths = reading_columns(readings)
+        self.__writer.write_table(pyarrow.Table.from_arrays([
+            pyarrow.array(times, self.schema.field("time").type),
+            pyarrow.array(sensors, pyarrow.string()).dictionary_encode(),
+            pyarrow.array(values, pyarrow.float64()),
+            pyarrow.DictionaryArray.from_arrays(*self.__encode_healths(healths))
+        ], schema=self.schema))
+        self.rows += len(readings)
+
+    def close(self) -> None:
+        self.__writer.close()
+
+    def __encode_healths(self, healths: list) -> tuple:
+        pyarrow = self.__pyarrow
+        names = sorted({health for health in healths if health is not None})
+        index = {name: i for i, name in enumerate(names)}
+        return (pyarrow.array([index.get(health) for health in healths], pyarrow.int8()),
+                pyarrow.array(names, pyarrow.string()))
+
+
+class NpzReadingWriter:
+    """
+    Writes readings to a compressed NumPy .npz file, for where pyarrow is not installed. The columns are spooled to
+    temporary files as the chunks come in and only copied into the archive on close, so memory does not grow with the
+    number of readings. The arrays are time (int64 milliseconds since the epoch), sensor (int32 index into
+    sensor_names), reading (float64) and health (int8 index into health_names, -1 for none)
+    """
+
+    COLUMNS = (("time", "<i8"), ("sensor", "<i4"), ("reading", "<f8"), ("health", "i1"))
+
+    def __init__(self, path: str):
+        import numpy
+
+        self.path = path
+        self.rows = 0
+        self.__numpy = numpy
+        self.sensor_names = dict()
+        self.health_names = dict()
+        self.__spools = {name: open(path + "." + name + ".tmp", "w+b") for name, _ in self.COLUMNS}
+
+    def write(self, readings: list) -> None:
+        if not readings:
+            return
+
+        numpy = self.__numpy
+        times, sensors, values, healths = reading_columns(readings)
+        columns = {
+            "time": times,
+            "sensor": [self.sensor_names.setdefault(sensor, len(self.sensor_names)) for sensor in sensors],
+            "reading": values,
+            "health": [-1 if health is None else self.health_names.setdefault(health, len(self.health_names))
+                       for health in healths]
+        }
+
+        for name, dtype in self.COLUMNS:
+            numpy.asarray(columns[name], dtype=dtype).tofile(self.__spools[name])
+        self.rows += len(readings)
+
+    def close(self) -> None:
+        import zipfile
+
+        numpy = self.__numpy
+        with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, dtype in self.COLUMNS:
+                spool = self.__spools[name]
+                spool.seek(0)
+                with archive.open(name + ".npy", "w", force_zip64=True) as entry:
+                    numpy.lib.format.write_array_header_1_0(entry, {"descr": numpy.dtype(dtype).str,
+                                                                    "fortran_order": False, "shape": (self.rows,)})
+                    for block in iter(lambda: spool.read(NPZ_COPY_BYTES), b""):
+                        entry.write(block)
+
+            for name, names in (("sensor_names", self.sensor_names), ("health_names", self.health_names)):
+                with archive.open(name + ".npy", "w") as entry:
+                    numpy.save(entry, numpy.array(list(names), dtype=str))
+
+        for spool in self.__spools.values():
+            spool.close()
+            os.remove(spool.name)
+
+
+def open_reading_writer(directory: str, sensor_type: str, file_format: str = "auto"):
+    """
+    Opens the file to export the readings of a sensor type to
+    :param directory: the directory to write to
+    :param sensor_type: the type of the sensors, used as the file name
+    :param file_format: parquet, npz or auto for Parquet if pyarrow is installed else npz
+    :return: a ParquetReadingWriter or NpzReadingWriter
+    """
+    if file_format == "auto":
+        import importlib.util
+
+        file_format = "parquet" if importlib.util.find_spec("pyarrow") is not None else "npz"
+
+    if file_format == "parquet":
+        return ParquetReadingWriter(os.path.join(directory, sensor_type + ".parquet"))
+    if file_format == "npz":
+        return NpzReadingWriter(os.path.join(directory, sensor_type + ".npz"))
+
+    raise ValueError("file_format must be auto, parquet or npz, not " + file_format)
+
+
+def export_readings(base_url: str, sensor_type: str, start_time: float, end_time: float, writer,
+                    chunk_seconds: float = DEFAULT_CHUNK_SECONDS, max_parallel: int = DEFAULT_MAX_PARALLEL_CHUNKS,
+                    timeout: float = DEFAULT_EXPORT_TIMEOUT_SECONDS, breaker: Optional[CircuitBreaker] = None,
+                    retries: int = DEFAULT_CHUNK_RETRIES, end_time_support: Optional[dict] = None) -> int:
+    """
+    Exports the readings of a sensor type over a time range, chunk by chunk, see chunked_fetch.py
+    :param base_url: the base url of the REST API
+    :param sensor_type: the type of the sensors
+    :param start_time: the start of the range in seconds since the epoch
+    :param end_time: the end of the range in seconds since the epoch, not included
+    :param writer: where the readings go, see open_reading_writer. It is not closed
+    :param chunk_seconds: how long each chunk is
+    :param max_parallel: how many chunks to fetch at the same time
+    :param timeout: the timeout of each chunk's request in seconds
+    :param breaker: the circuit breaker of the REST API
+    :param retries: how many times to fetch a chunk again after it failed
+    :param end_time_support: a dict of base url and whether the api honours end_time, see fetch_chunks
+    :return: how many readings were exported
+    :raises ChunkFetchError: when a chunk could not be fetched
+    """
+    exported = 0
+    for _, readings, _ in fetch_chunks(base_url, sensor_type, split_time_range(start_time, end_time, chunk_seconds),
+                                       max_parallel, timeout, breaker, retries, end_time_support):
+        writer.write(readings)
+        exported += len(readings)
+
+    return exported
+
+
+def parse_time(value: str) -> float:
+    """
+    :param value: an ISO date or time, local time unless it has a time zone
+    :return: the time in seconds since the epoch
+    """
+    return datetime.fromisoformat(value).timestamp()
+
+
+def main(argv: list) -> int:
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Exports the history of /data_readings to a Parquet or .npz "
+                                                     "file per sensor type")
+    arg_parser.add_argument("configfile", help="a config with a [rest] section, e.g. production.ini")
+    arg_parser.add_argument("--types", default="temp,humid,soil,fanspeed,batt",
+                            help="comma separated sensor types to export")
+    arg_parser.add_argument("--start", required=True, help="the start of the range, e.g. 2020-03-01")
+    arg_parser.add_argument("--end", help="the end of the range, not included (defaults to now)")
+    arg_parser.add_argument("--out", default=".", help="the directory to write the files to")
+    arg_parser.add_argument("--format", choices=("auto", "parquet", "npz"), default="auto")
+    arg_parser.add_argument("--chunk-hours", type=float, default=DEFAULT_CHUNK_SECONDS / 3600,
+                            help="how many hours of readings each request fetches")
+    arg_parser.add_argument("--max-parallel", type=int, default=DEFAULT_MAX_PARALLEL_CHUNKS,
+                            help="how many chunks to fetch at the same time")
+    arg_parser.add_argument("--timeout", type=float, default=DEFAULT_EXPORT_TIMEOUT_SECONDS,
+                            help="the timeout of each request in seconds")
+    arg_parser.add_argument("--retries", type=int, default=DEFAULT_CHUNK_RETRIES,
+                            help="how many times to fetch a chunk again after it failed")
+    args = arg_parser.parse_args(argv)
+
+    config = configparser.ConfigParser()
+    config.read(args.configfile)
+    RestRequest.negotiator = PayloadNegotiator(
+        config["rest"].get("payload_format", "json"), config["rest"].getboolean("gzip", True),
+        int(config["rest"].get("gzip_min_bytes", str(DEFAULT_GZIP_MIN_BYTES))))
+
+    start_time = parse_time(args.start)
+    end_time = parse_time(args.end) if args.end else time.time()
+    os.makedirs(args.out, exist_ok=True)
+    # found out with the first sensor type, the others go straight to chunks or one request
+    end_time_support = dict()
+
+    for sensor_type in [sensor_type.strip() for sensor_type in args.types.split(",") if sensor_type.strip()]:
+        started = time.perf_counter()
+        writer = open_reading_writer(args.out, sensor_type, args.format)
+        try:
+            exported = export_readings(config["rest"]["base_url"], sensor_type, start_time, end_time, writer,
+                                       args.chunk_hours * 3600, args.max_parallel, args.timeout,
+                                       retries=args.retries, end_time_support=end_time_support)
+        finally:
+            writer.close()
+
+        print("{0}: {1} readings to {2} in {3:.1f}s".format(sensor_type, exported, writer.path,
+                                                             time.perf_counter() - started))
+
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.exit(main(sys.argv[1:]))
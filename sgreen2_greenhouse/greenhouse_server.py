@@ -1,23 +1,58 @@
 import configparser
-import http.client as httplib
-import json
 import socket
 import threading
 import time
 import traceback
 
 from datetime import datetime, timedelta
-from dateutil import parser
-from statistics import mean
-from typing import Optional
-
-from requests import Response
+from typing import Optional, TYPE_CHECKING
 
+from sgreen2_greenhouse.actuator_registry import ActuatorRegistry
+from sgreen2_greenhouse.actuator_state_writer import ActuatorStateWriter, DEFAULT_MAX_PARALLEL_WRITES
+from sgreen2_greenhouse.chunked_fetch import DEFAULT_CHUNK_RETRIES, DEFAULT_MAX_PARALLEL_CHUNKS, fetch_time_range
+from sgreen2_greenhouse.circuit_breaker import Backoff, CircuitBreaker, CircuitBreakers, CircuitOpenError
+from sgreen2_greenhouse.deadline import Deadline
 from sgreen2_greenhouse.email_client import EmailClient
 from sgreen2_greenhouse.error_notifier import ErrorNotifier, Error, ErrorSeverity
-from sgreen2_greenhouse.rest_request import RestPutThread, RestDeleteThread, RestThread, RestGet, RestPost
+from sgreen2_greenhouse.event_log import EVENT_LOG, get_logger
+from sgreen2_greenhouse.heartbeat_index import HeartbeatIndex, format_duration
+from sgreen2_greenhouse.memory_profiler import MemoryProfiler
+from sgreen2_greenhouse.online_statistics import SensorStatistics
+from sgreen2_greenhouse.payload_codec import PayloadNegotiator, decode_response, DEFAULT_GZIP_MIN_BYTES
+from sgreen2_greenhouse.reading_aggregates import AGGREGATE_PATH, AGGREGATE_UNSUPPORTED_STATUS_CODES, \
+    aggregates_by_sensor
+from sgreen2_greenhouse.reading_rollups import ReadingRollups
+from sgreen2_greenhouse.reading_stream import ReadingStreamSubscriber
+from sgreen2_greenhouse.rest_request import RestGet, RestPost, RestRequest, DEFAULT_TIMEOUT_SECONDS
 from sgreen2_greenhouse.tplink_smartplug import TpLinkSmartplug
 
+if TYPE_CHECKING:
+    from requests import Response
+
+LOG = get_logger("greenhouse_server")
+
+# how many of the most recent events go into the email when the server dies
+RECENT_EVENTS_IN_CRASH_REPORT = 20
+# how long stopping waits for the actuator states that are still queued to be written
+ACTUATOR_STATE_FLUSH_SECONDS = 10
+
+# how many seconds before the newest ingested reading to start incremental fetches from
+READING_FETCH_OVERLAP_SECONDS = 5
+# how often the api is asked for the readings a live stream may have lost
+DEFAULT_STREAM_BACKFILL_SECONDS = 5 * 60
+
+# how many devices manual mode switches at the same time by default
+DEFAULT_MAX_PARALLEL_DEVICES = 4
+
+# actuators that are switched by a TP-Link smartplug instead of a pi
+SMARTPLUG_ACTUATORS = ("bigfan", "heater01")
+# actuator type -> the [pi] key of the ip of the pi that switches it
+PI_IP_KEYS = {
+    "fan": "fan_pi_ip",
+    "lights": "lights_pi_ip",
+    "water": "solenoid_pi_ip"
+}
+
 
 class GreenhouseServer:
     """
@@ -32,6 +67,10 @@ class GreenhouseServer:
         self.config = configparser.ConfigParser()
         self.config.read(configfile)
 
+        # levels, file and ring of recent events of the event log, see event_log.py
+        if "log" in self.config:
+            EVENT_LOG.configure(self.config["log"])
+
         self.base_url = self.config["rest"]["base_url"]
         self.local_base_url = None
 
@@ -40,6 +79,27 @@ class GreenhouseServer:
 
         self.active_url = self.base_url
 
+        # MessagePack and gzip where the api accepts them, see payload_codec.py
+        RestRequest.negotiator = PayloadNegotiator(
+            self.config["rest"].get("payload_format", "json"), self.config["rest"].getboolean("gzip", True),
+            int(self.config["rest"].get("gzip_min_bytes", str(DEFAULT_GZIP_MIN_BYTES))))
+
+        # every REST call and actuator switch of a cycle shares this budget, see deadline.py
+        self.cycle_budget_seconds = float(self.config["greenhouse"].get("cycle_budget_seconds", "30"))
+        self.deadline = Deadline(self.cycle_budget_seconds)
+        # how many devices manual mode switches at once, the actuators of one device are still switched in order
+        self.max_parallel_devices = max(1, int(self.config["greenhouse"].get("max_parallel_devices",
+                                                                             str(DEFAULT_MAX_PARALLEL_DEVICES))))
+
+        # a circuit breaker per REST API, pi and smartplug so one that is down fails fast instead of eating the cycle
+        breaker_config = self.config["breaker"] if "breaker" in self.config else dict()
+        self.circuit_breakers = CircuitBreakers(int(breaker_config.get("failure_threshold", "3")),
+                                                float(breaker_config.get("base_backoff_seconds", "5")),
+                                                float(breaker_config.get("max_backoff_seconds", "300")))
+        # how long run waits before the next cycle after a connection error
+        self.connection_backoff = Backoff(float(breaker_config.get("base_backoff_seconds", "5")),
+                                          float(breaker_config.get("max_backoff_seconds", "300")))
+
         email_server = self.config["email"]["smtp_server"]
         email_port = int(self.config["email"]["tls_port"])
         email_username = self.config["email"]["username"]
@@ -66,8 +126,78 @@ class GreenhouseServer:
 
         self.watering_times = list()
         self.error_flush_times = list()
+        # writes the actuator states to the database in the background, see actuator_state_writer.py
+        self.actuator_state_writer = ActuatorStateWriter(
+            lambda: self.active_url, self.api_breaker,
+            int(self.config["rest"].get("max_parallel_state_writes", str(DEFAULT_MAX_PARALLEL_WRITES))))
+        # the solenoid schedule that is currently watering, see irrigation_planner.py
+        self.irrigation_run = None
+
+        # aggregates of every reading fetched so far, so each cycle only has to fetch what is new
+        self.reading_rollups = ReadingRollups()
+        # running statistics of every sensor for the health checks
+        self.sensor_statistics = SensorStatistics()
+        # when each sensor last posted, for the missing sensor checks
+        self.heartbeat_index = HeartbeatIndex()
+        # ask the api for aggregates instead of every reading, unless it is known not to have the route
+        self.server_aggregates = self.config["rest"].get("aggregates", "server") == "server"
+        self.aggregate_unsupported_urls = set()
+        # readings further back than this are fetched as that long chunks at the same time, see chunked_fetch.py
+        self.chunk_seconds = float(self.config["rest"].get("chunk_hours", "6")) * 60 * 60
+        self.max_parallel_chunks = int(self.config["rest"].get("max_parallel_chunks",
+                                                               str(DEFAULT_MAX_PARALLEL_CHUNKS)))
+        self.chunk_retries = int(self.config["rest"].get("chunk_retries", str(DEFAULT_CHUNK_RETRIES)))
+        # base url -> whether the api honours end_time, chunking only pays off if it does
+        self.end_time_support = dict()
+        # the actuators as of the last fetch, shared by every automated thread
+        self.actuator_registry = ActuatorRegistry(self.actuator_device)
+
+        # optional stream of readings pushed by the pis as they arrive
+        self.reading_stream = None
+        self.streamed_types = set()
+        self.stream_backfill_seconds = DEFAULT_STREAM_BACKFILL_SECONDS
+        # sensor type -> time.time() of the last backfill of its streamed readings
+        self.last_backfill = dict()
+        if "stream" in self.config and self.config["stream"].getboolean("enabled", False):
+            stream_config = self.config["stream"]
+            if "allowed_ips" in stream_config:
+                allowed_ips = {ip.strip() for ip in stream_config["allowed_ips"].split(",")}
+            else:
+                allowed_ips = {ip for key, ip in self.config["pi"].items() if key.endswith("_ip")}
+
+            self.streamed_types = {sensor_type.strip() for sensor_type in
+                                   stream_config.get("hot_types", "temp,humid,fanspeed").split(",")}
+            self.reading_stream = ReadingStreamSubscriber(self, int(stream_config["port"]), allowed_ips,
+                                                          float(stream_config.get("max_silence_seconds", "30")))
+            self.stream_backfill_seconds = float(stream_config.get("backfill_seconds",
+                                                                   str(DEFAULT_STREAM_BACKFILL_SECONDS)))
+            self.reading_stream.start()
+
+        # optional tracemalloc profiling of long runs, switched on and off with SIGUSR1, see memory_profiler.py
+        self.memory_profiler = None
+        if "memory" in self.config:
+            memory_config = self.config["memory"]
+            self.memory_profiler = MemoryProfiler(memory_config.get("path", "memory_profile.log"),
+                                                  int(memory_config.get("interval_cycles", "60")),
+                                                  int(memory_config.get("top", "10")),
+                                                  int(memory_config.get("traceback_frames", "1")),
+                                                  int(memory_config.get("max_bytes", "1000000")),
+                                                  int(memory_config.get("backup_count", "3")))
+            self.memory_profiler.add_gauge("threads", threading.active_count)
+            self.memory_profiler.add_gauge("active_errors", lambda: sum(
+                len(stage) for stage in self.error_notifier.active_errors))
+            self.memory_profiler.add_gauge("buffered_errors", lambda: len(self.error_notifier.message_buffer))
+            self.memory_profiler.add_gauge("actuators", lambda: len(self.actuator_registry))
+            self.memory_profiler.add_gauge("circuit_breakers", lambda: len(self.circuit_breakers.breakers))
+            self.memory_profiler.install_signal_handler()
+
+            if memory_config.getboolean("enabled", False):
+                self.memory_profiler.start()
 
     def __timestring_list_to_datetime_list(self, timelist: list) -> list:
+        # schedules are only parsed once, keep dateutil out of start up
+        from dateutil import parser
+
         for i in range(len(timelist)):
             timelist[i] = parser.parse(timelist[i])
             if timelist[i] < self.get_current_time():
@@ -76,8 +206,10 @@ class GreenhouseServer:
         return timelist
 
     @staticmethod
-    def have_internet():
-        conn = httplib.HTTPConnection("www.google.com", timeout=1)
+    def have_internet(timeout: float = 1):
+        import http.client as httplib
+
+        conn = httplib.HTTPConnection("www.google.com", timeout=timeout)
         try:
             conn.request("HEAD", "/")
             conn.close()
@@ -95,73 +227,130 @@ class GreenhouseServer:
 
             while True:
                 try:
-                    if self.have_internet() or self.local_base_url is None:
-                        self.active_url = self.base_url
-                    else:
-                        self.active_url = self.local_base_url
-
-                    # greenhouse is up and running
-                    RestPost.send(self.active_url + "/greenhouse_server_state", None)
-
-                    settings_response = RestGet.send(self.active_url + "/settings", None)
-
-                    if self.is_error_response("fetch_settings", "Fetching settings failed", settings_response,
-                                              ErrorSeverity.HIGH):
-                        continue
-
-                    settings = json.loads(settings_response.text)
-
-                    # set watering and flush times if not already set
-                    if not self.watering_times:
-                        self.watering_times = self.__timestring_list_to_datetime_list(settings["watering_times"])
-
-                    if not self.error_flush_times:
-                        self.error_flush_times = self.__timestring_list_to_datetime_list(settings["error_flush_times"])
-
-                    self.email_addresses = settings["email_addresses"]
-
-                    if settings["is_manual_mode"]:
-                        print("going to manual mode")
-                        self.__perform_manual_mode()
-                    else:
-                        print("going to automated mode")
-                        self.__perform_automated_mode(settings)
-
-                    # flush errors
-                    for i in range(len(self.error_flush_times)):
-                        if self.get_current_time() >= self.error_flush_times[i]:
-                            self.error_flush_times[i] += timedelta(days=1)
-                            self.error_notifier.send_message(self.email_addresses, True)
-                            break
-
-                    self.error_notifier.remove_error(connection_error_key)
+                    if self.run_cycle():
+                        self.error_notifier.remove_error(connection_error_key)
+                    self.connection_backoff.reset()
                 except OSError as err:
                     error_message = \
                         "Connection refused error. Rest API server may be down. Exception message: " + str(err)
-                    print(error_message)
+                    LOG.error(error_message)
                     traceback.print_exc()
                     self.error_notifier.add_error(Error(ErrorSeverity.HIGH, error_message, connection_error_key))
                     self.error_notifier.send_message(
                         self.email_addresses if self.email_addresses else self.backup_emails)
+
+                    # don't hammer whatever is down
+                    time.sleep(self.connection_backoff.next_delay())
         except KeyboardInterrupt:
             print("Received keyboard interrupt. Stopping...")
         except Exception as err:
             error_message = "An error occurred and now the greenhouse server is dead. Error message: " + str(err) + \
                             ". See terminal output for traceback"
+            # what led up to it, the terminal output may be long gone by the time the email is read
+            recent_events = EVENT_LOG.recent_events(limit=RECENT_EVENTS_IN_CRASH_REPORT)
+            if recent_events:
+                error_message += "\n\nRecent events:\n" + "\n".join(recent_events)
             self.error_notifier.add_error(Error(ErrorSeverity.CRITICAL, error_message, "greenhouse_killer"))
-            print(error_message)
+            LOG.error(error_message)
             self.error_notifier.send_message(self.email_addresses if self.email_addresses else self.backup_emails)
 
             traceback.print_exc()
         finally:
+            if self.irrigation_run is not None and self.irrigation_run.is_alive():
+                LOG.info("waiting for the watering to finish before stopping")
+                self.irrigation_run.join()
+            if not self.actuator_state_writer.flush(ACTUATOR_STATE_FLUSH_SECONDS):
+                LOG.warning("actuator states not written", actuators=",".join(self.actuator_state_writer.pending))
             self.error_notifier.quit()
 
+    def run_cycle(self) -> bool:
+        """
+        Runs one cycle of the main program: fetches the settings and performs manual or automated mode
+        :return: True if the cycle got far enough to perform manual or automated mode
+        """
+        self.deadline = Deadline(self.cycle_budget_seconds)
+        try:
+            return self.__run_cycle()
+        finally:
+            self.report_overrun(self.deadline)
+            if self.memory_profiler is not None:
+                self.memory_profiler.on_cycle()
+
+    def __run_cycle(self) -> bool:
+        # only probe the internet connection when there is a local api to fall back to, and skip the remote api
+        # while its breaker is open
+        if self.local_base_url is None or (not self.circuit_breakers.is_open(self.base_url) and
+                                           self.have_internet(self.deadline.timeout("internet check", 1))):
+            self.active_url = self.base_url
+        else:
+            self.active_url = self.local_base_url
+
+        # greenhouse is up and running
+        RestPost.send(self.active_url + "/greenhouse_server_state", None,
+                      self.deadline.timeout("POST /greenhouse_server_state", DEFAULT_TIMEOUT_SECONDS),
+                      self.api_breaker())
+
+        settings_response = RestGet.send(self.active_url + "/settings", None,
+                                         self.deadline.timeout("GET /settings", DEFAULT_TIMEOUT_SECONDS),
+                                         self.api_breaker())
+
+        if self.is_error_response("fetch_settings", "Fetching settings failed", settings_response, ErrorSeverity.HIGH):
+            return False
+
+        settings = decode_response(settings_response)
+
+        # set watering and flush times if not already set
+        if not self.watering_times:
+            self.watering_times = self.__timestring_list_to_datetime_list(settings["watering_times"])
+
+        if not self.error_flush_times:
+            self.error_flush_times = self.__timestring_list_to_datetime_list(settings["error_flush_times"])
+
+        self.email_addresses = settings["email_addresses"]
+
+        if settings["is_manual_mode"]:
+            LOG.info("cycle", mode="manual")
+            self.__perform_manual_mode()
+        else:
+            LOG.info("cycle", mode="automated")
+            self.__perform_automated_mode(settings)
+
+        # flush errors
+        for i in range(len(self.error_flush_times)):
+            if self.get_current_time() >= self.error_flush_times[i]:
+                self.error_flush_times[i] += timedelta(days=1)
+                self.error_notifier.send_message(self.email_addresses, True)
+                break
+
+        return True
+
+    def api_breaker(self) -> CircuitBreaker:
+        """
+        :return: the circuit breaker of the REST API in use
+        """
+        return self.circuit_breakers.get(self.active_url)
+
+    def report_overrun(self, deadline: Deadline) -> None:
+        """
+        Reports a cycle that went over its budget, or clears the report once a cycle stays within it
+        :param deadline: the deadline of the cycle
+        :return: None
+        """
+        error_key = "cycle_overrun"
+        error_message = deadline.overrun_message()
+
+        if error_message is not None:
+            LOG.warning(error_message)
+            self.error_notifier.add_error(Error(ErrorSeverity.LOW, error_message, error_key))
+        else:
+            self.error_notifier.remove_error(error_key)
+
     @staticmethod
     def get_current_time():
         return datetime.now()
 
     @staticmethod
-    def create_error_message(message: str, response: Response) -> str:
+    def create_error_message(message: str, response: "Response") -> str:
         """
         Creates an error message for a response error
         :param message: The custom message before the details
@@ -169,79 +358,256 @@ class GreenhouseServer:
         :return: a formatted error message
         """
 
-        body = response.text if "text" in response else ""
-        return message + "\nStatus code: " + response.status_code + "\nResponse body: " + body + "\n"
+        return message + "\nStatus code: " + str(response.status_code) + "\nResponse body: " + response.text + "\n"
 
-    @staticmethod
-    def group_data_by_sensor(raw_data: dict) -> dict:
+    def readings_query(self, sensor_type: str, window_seconds: int) -> dict:
         """
-        Groups data by sensor
-        :param raw_data: the raw json data from the database
-        :return: a dict of sensor and its readings
+        Builds the url parameters to fetch the readings of a sensor type that have not been ingested yet
+        :param sensor_type: the type of the sensors
+        :param window_seconds: how many seconds back the caller needs readings for
+        :return: a dictionary of url parameters for /data_readings
         """
-        result = dict()
-        for reading in raw_data:
-            sensor = reading["sensor"]["name"]
-            if sensor not in result:
-                result[sensor] = list()
+        start_time = time.time() - window_seconds
 
-            if "health" in reading:
-                result[reading["sensor"]["name"]].append({"reading": reading["reading"], "health": reading["health"]})
-            else:
-                result[reading["sensor"]["name"]].append(reading["reading"])
+        newest_reading_time = self.reading_rollups.newest_reading_time(sensor_type)
+        if newest_reading_time is not None:
+            # overlap a little in case readings were committed out of order, the rollups skip the ones they already have
+            # by id, or by time and value, and add the late ones to their buckets
+            start_time = max(start_time, newest_reading_time - READING_FETCH_OVERLAP_SECONDS)
 
-        return result
+        return {"type": sensor_type, "start_time": int(start_time) * 1000}
 
-    @staticmethod
-    def group_actuators(actuators: list) -> dict:
+    def fetch_new_readings(self, sensor_type: str, window_seconds: int) -> "Response":
+        """
+        Fetches the readings of a sensor type that have not been ingested yet and adds them to the rollups
+        :param sensor_type: the type of the sensors
+        :param window_seconds: how many seconds back the caller needs readings for
+        :return: the response
+        """
+        query = self.readings_query(sensor_type, window_seconds)
+        now = time.time()
+
+        # a long window, e.g. the first 24 hours of soil moisture, is fetched in chunks at the same time so it takes
+        # as long as the slowest chunk and a chunk that fails is fetched again on its own
+        if now - query["start_time"] / 1000 > self.chunk_seconds:
+            response, readings = fetch_time_range(
+                self.active_url, sensor_type, query["start_time"] / 1000, now, self.chunk_seconds,
+                self.max_parallel_chunks,
+                lambda: self.deadline.timeout("GET /data_readings " + sensor_type + " chunk", DEFAULT_TIMEOUT_SECONDS),
+                self.api_breaker(), self.chunk_retries, self.end_time_support)
+
+            if response.ok:
+                self.ingest_readings(sensor_type, readings)
+
+            return response
+
+        response = RestGet.send(self.active_url + "/data_readings", query,
+                                self.deadline.timeout("GET /data_readings " + sensor_type, DEFAULT_TIMEOUT_SECONDS),
+                                self.api_breaker())
+
+        if response.ok:
+            self.ingest_readings(sensor_type, decode_response(response))
+
+        return response
+
+    def fetch_aggregates(self, sensor_type: str, window_seconds: int) -> tuple:
+        """
+        Gets the average, latest reading and count of every sensor of a type over a window. The REST API aggregates
+        them if it can, else the new readings are fetched and aggregated here. Readings that are being pushed to us
+        are aggregated here, only fetching what the stream may have lost every so often
+        :param sensor_type: the type of the sensors
+        :param window_seconds: how many seconds back to look
+        :return: a tuple of (the response, None if nothing was fetched; a dict of sensor name and aggregate, see
+        reading_aggregates.py)
+        """
+        if self.is_streaming(sensor_type):
+            self.backfill_streamed_readings(sensor_type, window_seconds)
+            return None, self.local_aggregates(sensor_type, window_seconds)
+
+        if self.server_aggregates and self.active_url not in self.aggregate_unsupported_urls:
+            response = RestGet.send(self.active_url + AGGREGATE_PATH,
+                                    {"type": sensor_type, "start_time": int(time.time() - window_seconds) * 1000},
+                                    self.deadline.timeout("GET " + AGGREGATE_PATH + " " + sensor_type,
+                                                          DEFAULT_TIMEOUT_SECONDS),
+                                    self.api_breaker())
+
+            if response.status_code not in AGGREGATE_UNSUPPORTED_STATUS_CODES:
+                if not response.ok:
+                    return response, dict()
+
+                rows = decode_response(response)
+                self.heartbeat_index.record(sensor_type, rows)
+                return response, aggregates_by_sensor(rows)
+
+            LOG.warning("aggregating readings here from now on, the api cannot", url=self.active_url)
+            self.aggregate_unsupported_urls.add(self.active_url)
+
+        response = self.fetch_new_readings(sensor_type, window_seconds)
+        if not response.ok:
+            return response, dict()
+
+        return response, self.local_aggregates(sensor_type, window_seconds)
+
+    def local_aggregates(self, sensor_type: str, window_seconds: int) -> dict:
+        """
+        Aggregates the readings of a sensor type that were ingested here. The sensor statistics answer in constant time
+        per sensor when they cover the window, the rollups answer for any other window
+        :param sensor_type: the type of the sensors
+        :param window_seconds: how many seconds back to look
+        :return: a dict of sensor name and aggregate, see reading_aggregates.py
+        """
+        if self.sensor_statistics.window_seconds(sensor_type) == window_seconds:
+            return self.sensor_statistics.aggregate_by_sensor(sensor_type)
+
+        return self.reading_rollups.aggregate_by_sensor(sensor_type, window_seconds)
+
+    def backfill_streamed_readings(self, sensor_type: str, window_seconds: int) -> None:
+        """
+        Every stream_backfill_seconds, fetches the readings of a streamed sensor type since the last time, so datagrams
+        the stream lost are still ingested. The readings the stream did deliver are matched and skipped by the rollups
+        :param sensor_type: the type of the sensors
+        :param window_seconds: how many seconds back the caller needs readings for
+        :return: None
+        """
+        now = time.time()
+        last_backfill = self.last_backfill.get(sensor_type)
+        if last_backfill is not None and now - last_backfill < self.stream_backfill_seconds:
+            return
+
+        start_time = now - window_seconds
+        if last_backfill is not None:
+            start_time = max(start_time, last_backfill - READING_FETCH_OVERLAP_SECONDS)
+
+        response = RestGet.send(self.active_url + "/data_readings",
+                                {"type": sensor_type, "start_time": int(start_time) * 1000},
+                                self.deadline.timeout("GET /data_readings " + sensor_type + " backfill",
+                                                      DEFAULT_TIMEOUT_SECONDS),
+                                self.api_breaker())
+
+        # the stream is live, so a failed backfill is tried again next cycle rather than reported
+        if not response.ok:
+            LOG.warning("backfilling streamed readings failed", type=sensor_type, status=response.status_code)
+            return
+
+        self.last_backfill[sensor_type] = now
+        self.ingest_readings(sensor_type, decode_response(response))
+
+    def ingest_readings(self, sensor_type: str, readings: list, pushed: bool = False) -> None:
+        """
+        Adds readings to the rollups, and the ones the rollups did not have yet to the sensor statistics and the
+        heartbeat index
+        :param sensor_type: the type of the sensors
+        :param readings: the raw json readings from the database
+        :param pushed: whether the readings were pushed to us rather than fetched from the REST API
+        :return: None
+        """
+        added = self.reading_rollups.ingest(sensor_type, readings, pushed)
+        self.sensor_statistics.ingest(sensor_type, added)
+        self.heartbeat_index.record(sensor_type, added)
+
+    def is_streaming(self, sensor_type: str) -> bool:
         """
-        Groups the actuators by type. Assumes the actuators are sorted by type.
-        :param actuators: a list of actuators sorted by type
-        :return: a dictionary of actuators with key = type, value = actuator
+        Whether the readings of a sensor type are being pushed to us, so they do not need to be fetched
+        :param sensor_type: the type of the sensors
+        :return: True if the type is one of the hot types and the stream has delivered one recently
         """
-        result = dict()
-        previous_type = None
-        for actuator in actuators:
-            if actuator["type"] != previous_type:
-                result[actuator["type"]] = list()
+        return self.reading_stream is not None and sensor_type in self.streamed_types and \
+            self.reading_stream.is_live(sensor_type)
 
-            result[actuator["type"]].append(actuator)
-            previous_type = actuator["type"]
+    def configured_sensors(self, sensor_config_name: str) -> Optional[list]:
+        """
+        Gets the names of the sensors of a kind from the optional [sensors] *_sensor_names config
+        :param sensor_config_name: the kind of sensor as used in the config, e.g. temperature
+        :return: a list of sensor names or None if they are not configured
+        """
+        key = sensor_config_name + "_sensor_names"
+        if key not in self.config["sensors"]:
+            return None
 
-        return result
+        return [name.strip() for name in self.config["sensors"][key].split(",") if name.strip()]
 
     @staticmethod
-    def find_actuator(actuators: list, name: str) -> dict:
+    def actuator_device(actuator: dict) -> Optional[str]:
         """
-        Returns actuator with name actuator from a list of actuators
-        :param actuators: the list of actuators
-        :param name: the name of the actuator to get
-        :return: a dict representing the actuator
+        Names the device that switches an actuator
+        :param actuator: the actuator
+        :return: smartplug_<actuator name> for the smartplugs, the [pi] ip key without _ip for the pis, e.g. fan_pi,
+        None if nothing switches it
         """
-        for actuator in actuators:
-            if actuator["name"] == name:
-                return actuator
+        if actuator["name"] in SMARTPLUG_ACTUATORS:
+            return "smartplug_" + actuator["name"]
+
+        if actuator["type"] in PI_IP_KEYS:
+            return PI_IP_KEYS[actuator["type"]][:-len("_ip")]
 
-    def set_actuator_state_and_update_db(self, actuator: dict) -> RestThread:
+        return None
+
+    def fetch_actuators(self) -> "Response":
+        """
+        Fetches the actuators and applies them to the actuator registry
+        :return: the response of /actuators
         """
-        Sets the actuator state and updates the database with the new state
+        actuators_response = RestGet.send(self.active_url + "/actuators", None,
+                                          self.deadline.timeout("GET /actuators", DEFAULT_TIMEOUT_SECONDS),
+                                          self.api_breaker())
+
+        if actuators_response.ok:
+            self.actuator_registry.update(decode_response(actuators_response))
+
+        return actuators_response
+
+    def set_actuator_state_and_update_db(self, actuator: dict, deadline: Optional[Deadline] = None) -> bool:
+        """
+        Sets the actuator state and queues the new state to be written to the database, see actuator_state_writer.py
         :param actuator: the actuator
-        :return: a RestThread
+        :param deadline: the deadline to take the timeouts from, the deadline of the current cycle if not given
+        :return: True if the actuator was switched, errors are added to the error notifier
+        """
+        self.actuator_state_writer.write(actuator["name"], actuator["state"])
+
+        return self.set_actuator_state(actuator, deadline)
+
+    def apply_actuator_states(self, actuators: ActuatorRegistry, deadline: Optional[Deadline] = None) -> dict:
         """
-        state = actuator["state"]
-        thread = RestPutThread(self.active_url + "/actuators/" + actuator["name"] + "/state") if state else \
-            RestDeleteThread(self.active_url + "/actuators/" + actuator["name"] + "/state")
-        thread.start()
-        self.set_actuator_state(actuator)
+        Switches every actuator to its state. The devices are switched in parallel, at most max_parallel_devices at
+        once, and the actuators of a device one after the other in the order the REST API returned them
+        :param actuators: the actuator registry
+        :param deadline: the deadline to take the timeouts from, the deadline of the current cycle if not given
+        :return: a dict of actuator name and whether it was switched, actuators without a device are left out
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        deadline = deadline or self.deadline
+        lanes = [actuators.on_device(device) for device in actuators.devices()]
+        results = dict()
+
+        def switch_lane(lane: list) -> None:
+            for actuator in lane:
+                error_key = "switch_actuator_" + actuator["name"]
+                try:
+                    results[actuator["name"]] = self.set_actuator_state(actuator, deadline)
+                    self.error_notifier.remove_error(error_key)
+                except Exception as err:
+                    error_message = "Switching " + actuator["name"] + " failed: " + str(err)
+                    LOG.error(error_message)
+                    self.error_notifier.add_error(Error(ErrorSeverity.MID, error_message, error_key))
+                    results[actuator["name"]] = False
+
+        if lanes:
+            with ThreadPoolExecutor(min(self.max_parallel_devices, len(lanes)), "actuator_lane") as executor:
+                for future in [executor.submit(switch_lane, lane) for lane in lanes]:
+                    future.result()
 
-        return thread
+        return results
 
-    def set_actuator_state(self, actuator: dict) -> None:
+    def set_actuator_state(self, actuator: dict, deadline: Optional[Deadline] = None) -> bool:
         """
         Turns on/off an actuator
         :param actuator: the actuator object
-        :return: None
+        :param deadline: the deadline to take the timeouts from, the deadline of the current cycle if not given
+        :return: True if the actuator was switched, errors are added to the error notifier
         """
+        deadline = deadline or self.deadline
 
         # actuators controlled by a smartplug
         smart_plug = None
@@ -254,18 +620,23 @@ class GreenhouseServer:
             connect_error_key = "smartplug_connection_" + actuator["name"]
             except_error_key = "smartplug_exception_" + actuator["name"]
             try:
-                smart_plug.set_state(actuator["state"])
+                self.circuit_breakers.get(self.actuator_device(actuator)).call(
+                    smart_plug.set_state, actuator["state"],
+                    deadline.timeout("smartplug " + actuator["name"], DEFAULT_TIMEOUT_SECONDS))
                 self.error_notifier.remove_error(connect_error_key)
                 self.error_notifier.remove_error(except_error_key)
             except OSError:
                 error_message = "Unable to connect to " + actuator["name"] + " TP-Link Smartplug"
-                print(error_message)
+                LOG.warning(error_message)
                 self.error_notifier.add_error(Error(ErrorSeverity.HIGH, error_message, connect_error_key))
-                return
+                return False
             except Exception as err:
                 error_message = str(err)
-                print(error_message)
+                LOG.warning(error_message)
                 self.error_notifier.add_error(Error(ErrorSeverity.MID, error_message, except_error_key))
+                return False
+
+            return True
         # actuators controlled by raspberry pis
         else:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -274,31 +645,46 @@ class GreenhouseServer:
             pi_ip = None
             pi_port = int(self.config["pi"]["socket_port"])
 
-            if actuator["type"] == "fan":
-                pi_ip = self.config["pi"]["fan_pi_ip"]
-            elif actuator["type"] == "lights":
-                pi_ip = self.config["pi"]["lights_pi_ip"]
-            elif actuator["type"] == "water":
-                pi_ip = self.config["pi"]["solenoid_pi_ip"]
+            if actuator["type"] in PI_IP_KEYS:
+                pi_ip = self.config["pi"][PI_IP_KEYS[actuator["type"]]]
 
             if pi_ip is not None:
-                error_code = sock.connect_ex((pi_ip, pi_port))
-
+                sock.settimeout(deadline.timeout(actuator["type"] + " pi " + actuator["name"], DEFAULT_TIMEOUT_SECONDS))
+                msg = ":".join((actuator["name"], actuator["type"], on_off_state))
                 error_key = actuator["type"] + "_pi_connection"
+                breaker = self.circuit_breakers.get("pi_" + pi_ip)
+                try:
+                    breaker.before_call()
+                    error_code = sock.connect_ex((pi_ip, pi_port))
+                    if error_code == 0:
+                        sock.send(msg.encode())
+                except CircuitOpenError:
+                    error_code = None
+                except OSError:
+                    error_code = -1
+                finally:
+                    sock.close()
+
+                # a fast failure says nothing new about the pi
+                if error_code == 0:
+                    breaker.record_success()
+                elif error_code is not None:
+                    breaker.record_failure()
+
                 if error_code != 0:
                     error_message = "Unable to connect to " + actuator["type"] + " pi"
-                    print(error_message)
+                    LOG.warning(error_message)
                     self.error_notifier.add_error(Error(ErrorSeverity.HIGH, error_message, error_key))
-                    return
+                    return False
                 else:
                     self.error_notifier.remove_error(error_key)
 
-                msg = ":".join((actuator["name"], actuator["type"], on_off_state))
-                sock.send(msg.encode())
-                print("SENDING: " + msg)
-                sock.close()
+                LOG.info("SENDING", message=msg, pi=pi_ip)
+                return True
+
+        return False
 
-    def is_error_response(self, error_key: str, error_message: str, response: Response,
+    def is_error_response(self, error_key: str, error_message: str, response: "Response",
                           severity: ErrorSeverity = ErrorSeverity.MID) -> bool:
         """
         Checks if a response came back with an error code
@@ -310,54 +696,78 @@ class GreenhouseServer:
         """
         if not response.ok:
             error_message = self.create_error_message(error_message, response)
-            print(error_message)
+            LOG.warning(error_message)
             self.error_notifier.add_error(Error(severity, error_message, error_key))
             return True
         else:
             self.error_notifier.remove_error(error_key)
             return False
 
-    def detect_missing_sensors(self, severity: ErrorSeverity, error_key: str, error_message: str,
-                               sensor_data_by_sensor: dict, num_expected_sensors: int) -> None:
+    def detect_missing_sensors(self, severity: ErrorSeverity, error_key: str, error_message: str, sensor_type: str,
+                               max_silence_seconds: int, num_expected_sensors: int,
+                               expected_sensors: Optional[list] = None) -> None:
         """
-        Detects whether any sensors failed to post data
+        Detects whether any sensors failed to post data, using when each sensor last posted
         :param severity: the severity of the error for the error notifier
         :param error_key: the error key for the error notifier
         :param error_message: the message for the error notifier
-        :param sensor_data_by_sensor: the data readings grouped by sensor
+        :param sensor_type: the type of the sensors
+        :param max_silence_seconds: how long a sensor can go without posting before it is missing
         :param num_expected_sensors: how many sensors did we expect to get data from?
+        :param expected_sensors: the names of the sensors we expect to get data from, if they are known
         :return: None
         """
-        if len(sensor_data_by_sensor) < num_expected_sensors:
-            error_message += "\n\tReceived data from: " + ",".join(sensor_data_by_sensor.keys())
-            print(error_message)
+        silent_sensors = self.heartbeat_index.silent_sensors(sensor_type, max_silence_seconds, expected_sensors)
+
+        if expected_sensors is None:
+            # we only know how many sensors there should be, so some missing sensors may never have been seen
+            num_live_sensors = len(self.heartbeat_index.live_sensors(sensor_type, max_silence_seconds))
+            num_never_seen = num_expected_sensors - num_live_sensors - len(silent_sensors)
+            is_missing = num_live_sensors < num_expected_sensors
+        else:
+            num_never_seen = 0
+            is_missing = len(silent_sensors) > 0
+
+        if is_missing:
+            for sensor in sorted(silent_sensors):
+                silence = silent_sensors[sensor]
+                error_message += "\n\t" + sensor + (" has never posted" if silence is None else
+                                                    " silent for " + format_duration(silence))
+
+            if num_never_seen > 0:
+                error_message += "\n\t" + str(num_never_seen) + " unknown sensor(s) have never posted"
+
+            LOG.warning(error_message)
             self.error_notifier.add_error(Error(severity, error_message, error_key))
         else:
             self.error_notifier.remove_error(error_key)
 
-    def check_if_actuator_state_is_correct(self, actuator_data_by_sensor: dict, actuators: list, on_threshold: float,
-                                           off_threshold: float) -> None:
+    def check_if_actuator_state_is_correct(self, latest_by_sensor: dict, actuators: ActuatorRegistry,
+                                           on_threshold: float, off_threshold: float) -> None:
         """
         Checks if an actuator's state is consistent with data readings
-        :param actuator_data_by_sensor: the data readings that can determine if an actuator is on or not
-        :param actuators: the list of actuators
+        :param latest_by_sensor: the latest reading of each sensor that can determine if an actuator is on or not
+        :param actuators: the actuator registry
         :param on_threshold: the minimum threshold for being on
         :param off_threshold: the maximum threshold for being off
         :return: None
         """
-        for actuator_name in actuator_data_by_sensor:
+        for actuator_name, reading in latest_by_sensor.items():
             error_key = "state_" + actuator_name
             error_message = None
-            actuator = self.find_actuator(actuators, actuator_name)
-            if actuator["state"] and actuator_data_by_sensor[actuator_name][0] < on_threshold:
+            actuator = actuators.get(actuator_name)
+            if actuator is None:
+                # a sensor that does not watch an actuator we know of
+                continue
+            elif actuator["state"] and reading < on_threshold:
                 error_message = "Actuator " + actuator_name + " is supposed to be on, but is off."
-            elif not actuator["state"] and actuator_data_by_sensor[actuator_name][0] > off_threshold:
+            elif not actuator["state"] and reading > off_threshold:
                 error_message = "Actuator " + actuator_name + " is supposed to be off, but is on."
             else:
                 self.error_notifier.remove_error(error_key)
 
             if error_message:
-                print(error_message)
+                LOG.warning(error_message)
                 self.error_notifier.add_error(Error(ErrorSeverity.MID, error_message, error_key))
 
     def turn_on_actuator_and_update_db_for_time(self, actuator: dict, num_seconds: int) -> None:
@@ -368,23 +778,22 @@ class GreenhouseServer:
         :param num_seconds: how many seconds for which the actuator should be on
         :return: None
         """
+        # this outlives the cycle that started it, so each switch gets a budget of its own
         actuator["state"] = True
-        db_thread = self.set_actuator_state_and_update_db(actuator)
-        db_thread.join()
-
-        time.sleep(num_seconds)
+        self.set_actuator_state_and_update_db(actuator, Deadline(self.cycle_budget_seconds))
 
-        db_thread.join()
-
-        actuator["state"] = False
-        db_thread = self.set_actuator_state_and_update_db(actuator)
-        db_thread.join()
+        try:
+            time.sleep(num_seconds)
+        finally:
+            # whatever happens while it waters, the zone is not left open
+            actuator["state"] = False
+            self.set_actuator_state_and_update_db(actuator, Deadline(self.cycle_budget_seconds))
 
-    def check_margin_and_range(self, data_by_sensor: dict, sensor_type: str, min_expected: float, max_expected: float,
-                               difference_margin: Optional[float], **kwargs) -> None:
+    def check_margin_and_range(self, averages_by_sensor: dict, sensor_type: str, min_expected: float,
+                               max_expected: float, difference_margin: Optional[float], **kwargs) -> None:
         """
         Checks whether the data is within a specified margin and a specified range
-        :param data_by_sensor: the data grouped by sensor
+        :param averages_by_sensor: the average reading of each sensor
         :param sensor_type: the type of the sensors
         :param min_expected: the minimum expected value
         :param max_expected: the maximum expected value
@@ -404,8 +813,7 @@ class GreenhouseServer:
         if "sensor_display_unit" in kwargs:
             sensor_display_unit = kwargs["sensor_display_unit"]
 
-        for sensor in data_by_sensor:
-            avg_reading = mean(data_by_sensor[sensor])
+        for sensor, avg_reading in averages_by_sensor.items():
             if min_avg is None or avg_reading < min_avg["reading"]:
                 min_avg = {"sensor": sensor, "reading": avg_reading}
 
@@ -418,7 +826,7 @@ class GreenhouseServer:
             if not min_expected <= avg_reading <= max_expected:
                 error_message = "Sensor " + sensor + " reading outside of expected range\n" + \
                                 "\tReading: " + "{0:.2f}".format(avg_reading)
-                print(error_message)
+                LOG.warning(error_message)
                 self.error_notifier.add_error(Error(ErrorSeverity.LOW, error_message, error_key))
             else:
                 self.error_notifier.remove_error(error_key)
@@ -431,38 +839,38 @@ class GreenhouseServer:
                     sensor_display_unit + " \n" + \
                     "\tMax Sensor: " + max_avg["sensor"] + ", Reading: " + "{0:.2f}".format(max_avg["reading"]) + \
                     "\n\tMin Sensor: " + min_avg["sensor"] + ", Reading: " + "{0:.2f}".format(min_avg["reading"])
-                print(error_message)
+                LOG.warning(error_message)
                 self.error_notifier.add_error(Error(ErrorSeverity.LOW, error_message, error_key))
             else:
                 self.error_notifier.remove_error(error_key)
 
-    def check_fans(self, actuators: list, initial_delay: Optional[int]) -> None:
+    def check_fans(self, actuators: ActuatorRegistry, initial_delay: Optional[int]) -> None:
         """
         Checks if the fans are doing what they are supposed to be doing
-        :param actuators: the list of actuators
+        :param actuators: the actuator registry
         :param initial_delay: if you want to delay the check first to allow time for the sensors to post data
         :return: None
         """
         if initial_delay:
             time.sleep(initial_delay)
 
-        one_minute_ago = int(time.time() - 1 * 60) * 1000
-        fanspeed_response = RestGet.send(self.active_url + "/data_readings",
-                                         {"type": "fanspeed", "start_time": one_minute_ago})
+        fanspeed_response, fanspeed_aggregates = self.fetch_aggregates("fanspeed", 60)
 
         # check for bad request
-        if self.is_error_response("fetch_fanspeed", "Fetching fan speed data failed", fanspeed_response):
+        if fanspeed_response is not None and \
+                self.is_error_response("fetch_fanspeed", "Fetching fan speed data failed", fanspeed_response):
             return
-        fanspeed_data_by_sensor = self.group_data_by_sensor(json.loads(fanspeed_response.text))
+
+        latest_fanspeed_by_sensor = {sensor: aggregate["latest"] for sensor, aggregate in fanspeed_aggregates.items()}
 
         # check for missing sensors
         num_fanspeed_sensors = int(self.config["sensors"]["number_fanspeed_sensors"])
         self.detect_missing_sensors(ErrorSeverity.LOW, "missing_sensors_fanspeed",
                                     "Not all fan speed sensors submitted data in the last minute",
-                                    fanspeed_data_by_sensor, num_fanspeed_sensors)
+                                    "fanspeed", 60, num_fanspeed_sensors, self.configured_sensors("fanspeed"))
 
         # perform fan check
-        self.check_if_actuator_state_is_correct(fanspeed_data_by_sensor, actuators,
+        self.check_if_actuator_state_is_correct(latest_fanspeed_by_sensor, actuators,
                                                 int(self.config["ranges"]["min_on_fanspeed"]),
                                                 int(self.config["ranges"]["max_off_fanspeed"]))
 
@@ -472,14 +880,20 @@ class GreenhouseServer:
         :return: None
         """
         # grab actuators
-        actuators_response = RestGet.send(self.active_url + "/actuators", None)
-        actuators = json.loads(actuators_response.text)
+        actuators_response = self.fetch_actuators()
+
+        if self.is_error_response("fetch_actuators", "Fetching actuators data failed", actuators_response):
+            return
+
+        actuators = self.actuator_registry
 
-        # turn on/off actuators
-        for actuator in actuators:
-            self.set_actuator_state(actuator)
+        # turn on/off actuators, one device does not wait for another
+        results = self.apply_actuator_states(actuators)
+        failed = [name for name, switched in results.items() if not switched]
+        if failed:
+            LOG.warning("could not switch", actuators=",".join(sorted(failed)))
 
-        check_fans_thread = threading.Thread(target=self.check_fans(actuators, 1))
+        check_fans_thread = threading.Thread(target=self.check_fans, args=(actuators, 1))
         check_fans_thread.start()
 
         time.sleep(1)
@@ -495,12 +909,12 @@ class GreenhouseServer:
         """
 
         # get actuators
-        actuators_response = RestGet.send(self.active_url + "/actuators", None)
+        actuators_response = self.fetch_actuators()
 
         if self.is_error_response("fetch_actuators", "Fetching actuators data failed", actuators_response):
             return
 
-        actuators = json.loads(actuators_response.text)
+        actuators = self.actuator_registry
 
         # local import because else there'd be a circular dependency
         from sgreen2_greenhouse.automated_actuators import AutomatedSolenoids, AutomatedFans, AutomatedLights, \
@@ -0,0 +1,104 @@
+import threading
+import time
+from typing import Optional
+
+from sgreen2_greenhouse.reading_rollups import get_reading_time
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Formats a number of seconds for an error message
+    :param seconds: the number of seconds
+    :return: something like "3 minutes" or "2.5 hours"
+    """
+    if seconds < 2 * 60:
+        return "{0:.0f} seconds".format(seconds)
+    if seconds < 2 * 60 * 60:
+        return "{0:.0f} minutes".format(seconds / 60)
+    if seconds < 2 * 24 * 60 * 60:
+        return "{0:.1f} hours".format(seconds / (60 * 60))
+
+    return "{0:.1f} days".format(seconds / (24 * 60 * 60))
+
+
+class HeartbeatIndex:
+    """
+    Remembers when each sensor last posted a reading, independently of which readings are still being kept around,
+    so liveness can be checked without fetching a window of readings
+    """
+
+    def __init__(self):
+        """
+        The constructor
+        """
+
+        """
+        last_seen = {
+            sensor_type: {
+                sensor_name: seconds since the epoch,
+                ...
+            },
+            ...
+        }
+        """
+        self.last_seen = dict()
+        self.__lock = threading.Lock()
+
+    def record(self, sensor_type: str, readings: list) -> None:
+        """
+        Updates the index with readings from the REST API
+        :param sensor_type: the type of the sensors
+        :param readings: the raw json readings from the database
+        :return: None
+        """
+        now = time.time()
+
+        with self.__lock:
+            sensors = self.last_seen.setdefault(sensor_type, dict())
+            for reading in readings:
+                sensor = reading["sensor"]["name"]
+                reading_time = get_reading_time(reading, now)
+                if sensor not in sensors or reading_time > sensors[sensor]:
+                    sensors[sensor] = reading_time
+
+    def silent_sensors(self, sensor_type: str, max_silence_seconds: float, expected_sensors: Optional[list] = None,
+                       now: Optional[float] = None) -> dict:
+        """
+        Finds the sensors that have not posted a reading recently
+        :param sensor_type: the type of the sensors
+        :param max_silence_seconds: how long a sensor can go without posting before it is silent
+        :param expected_sensors: the names of the sensors that should be posting. Defaults to every sensor that has
+        ever posted
+        :param now: the current time in seconds since the epoch (defaults to now)
+        :return: a dict of silent sensor name and how many seconds it has been silent (None if it was never seen)
+        """
+        now = time.time() if now is None else now
+
+        with self.__lock:
+            sensors = dict(self.last_seen.get(sensor_type, dict()))
+
+        if expected_sensors is None:
+            expected_sensors = sensors.keys()
+
+        result = dict()
+        for sensor in expected_sensors:
+            if sensor not in sensors:
+                result[sensor] = None
+            elif now - sensors[sensor] > max_silence_seconds:
+                result[sensor] = now - sensors[sensor]
+
+        return result
+
+    def live_sensors(self, sensor_type: str, max_silence_seconds: float, now: Optional[float] = None) -> list:
+        """
+        Finds the sensors that have posted a reading recently
+        :param sensor_type: the type of the sensors
+        :param max_silence_seconds: how long a sensor can go without posting before it is silent
+        :param now: the current time in seconds since the epoch (defaults to now)
+        :return: a list of sensor names
+        """
+        now = time.time() if now is None else now
+
+        with self.__lock:
+            return [sensor for sensor, last_seen in self.last_seen.get(sensor_type, dict()).items()
+                    if now - last_seen <= max_silence_seconds]
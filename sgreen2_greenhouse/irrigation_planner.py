@@ -0,0 +1,127 @@
+import threading
+from typing import Optional
+
+# above this many zones the exact search is skipped and the longest-first schedule is used as is
+MAX_ZONES_FOR_EXACT_PLAN = 12
+
+
+class IrrigationPlanner:
+    """
+    Plans solenoid runs when only a limited number of zones can be watered at the same time, because all the zones
+    share the master solenoid and the supply pressure
+    """
+
+    @staticmethod
+    def plan(zone_seconds: dict, max_concurrent_zones: Optional[int]) -> list:
+        """
+        Builds a schedule that waters every zone and finishes as early as possible without running more than
+        max_concurrent_zones at once. The zones are split into that many lanes that each water one zone after the
+        other. The lanes start from the longest-processing-time-first split and, for a handful of zones, an exact
+        branch and bound search improves on it
+        :param zone_seconds: a dict of solenoid name and how many seconds to water it
+        :param max_concurrent_zones: how many zones can be watered at the same time, None for no limit
+        :return: a list of lanes, each a list of (solenoid name, start offset in seconds, seconds)
+        """
+        if not zone_seconds:
+            return list()
+
+        zones = sorted(zone_seconds.items(), key=lambda zone: (-zone[1], zone[0]))
+        num_lanes = len(zones) if max_concurrent_zones is None else max(1, min(max_concurrent_zones, len(zones)))
+
+        # longest processing time first: give each zone to the lane that frees up first
+        assignment = list()
+        lane_totals = [0] * num_lanes
+        for _, seconds in zones:
+            lane = lane_totals.index(min(lane_totals))
+            assignment.append(lane)
+            lane_totals[lane] += seconds
+
+        if len(zones) <= MAX_ZONES_FOR_EXACT_PLAN:
+            assignment = IrrigationPlanner.__improve(zones, num_lanes, assignment, max(lane_totals))
+
+        lanes = [list() for _ in range(num_lanes)]
+        lane_offsets = [0] * num_lanes
+        for (name, seconds), lane in zip(zones, assignment):
+            lanes[lane].append((name, lane_offsets[lane], seconds))
+            lane_offsets[lane] += seconds
+
+        return [lane for lane in lanes if lane]
+
+    @staticmethod
+    def __improve(zones: list, num_lanes: int, best_assignment: list, best_makespan: int) -> list:
+        """
+        Searches every split of the zones into lanes for one that finishes earlier
+        :param zones: the (name, seconds) zones, longest first
+        :param num_lanes: how many lanes there are
+        :param best_assignment: the lane of each zone in the best split so far
+        :param best_makespan: when the best split so far finishes
+        :return: the lane of each zone in the best split
+        """
+        # no split can finish before the longest zone or before the work is evenly spread
+        lower_bound = max(zones[0][1], -(-sum(seconds for _, seconds in zones) // num_lanes))
+        best = {"makespan": best_makespan, "assignment": list(best_assignment)}
+        lane_totals = [0] * num_lanes
+        assignment = [0] * len(zones)
+
+        def search(i: int) -> bool:
+            if best["makespan"] <= lower_bound:
+                return True
+
+            if i == len(zones):
+                makespan = max(lane_totals)
+                if makespan < best["makespan"]:
+                    best["makespan"] = makespan
+                    best["assignment"] = list(assignment)
+                return False
+
+            seen_totals = set()
+            for lane in range(num_lanes):
+                # lanes with the same total are interchangeable
+                if lane_totals[lane] in seen_totals or lane_totals[lane] + zones[i][1] >= best["makespan"]:
+                    continue
+                seen_totals.add(lane_totals[lane])
+
+                lane_totals[lane] += zones[i][1]
+                assignment[i] = lane
+                done = search(i + 1)
+                lane_totals[lane] -= zones[i][1]
+
+                if done:
+                    return True
+
+            return False
+
+        search(0)
+        return best["assignment"]
+
+
+class IrrigationRun(threading.Thread):
+    """
+    Runs an irrigation schedule in the background so the rest of the control work does not wait for it. It is not a
+    daemon thread, so the program does not exit with a zone left open
+    """
+
+    def __init__(self, greenhouse_server, schedule: list, solenoids: dict):
+        """
+        The constructor
+        :param greenhouse_server: the GreenhouseServer to switch the solenoids with
+        :param schedule: the lanes from IrrigationPlanner.plan
+        :param solenoids: a dict of solenoid name and a copy of its actuator, the registry's may be replaced meanwhile
+        """
+        threading.Thread.__init__(self, name="irrigation_run")
+        self.gs = greenhouse_server
+        self.schedule = schedule
+        self.solenoids = solenoids
+
+    def run(self):
+        lane_threads = [threading.Thread(target=self.__run_lane, args=(lane,)) for lane in self.schedule]
+
+        for thread in lane_threads:
+            thread.start()
+
+        for thread in lane_threads:
+            thread.join()
+
+    def __run_lane(self, lane: list) -> None:
+        for name, _, seconds in lane:
+            self.gs.turn_on_actuator_and_update_db_for_time(self.solenoids[name], seconds)
@@ -0,0 +1,196 @@
+import signal
+import threading
+import tracemalloc
+from typing import Callable, Optional
+
+from sgreen2_greenhouse.event_log import get_logger
+
+LOG = get_logger("memory_profiler")
+
+# allocations made by the profiler itself are not leaks
+IGNORED_FILES = (tracemalloc.__file__, "<unknown>")
+# neither are modules imported lazily, as far as the kept frames can tell
+IMPORT_FILES = ("<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>")
+
+
+class MemoryProfiler:
+    """
+    Opt in tracemalloc profiler for a server that runs for months. Every interval_cycles cycles it takes a snapshot and
+    writes the allocation sites that grew the most since the baseline, the ones that grew since the last snapshot and
+    any gauges (e.g. how many errors the notifier holds) to a rotating file. It can be switched on and off without a
+    restart by sending the process SIGUSR1; the baseline is retaken every time it is switched on
+    """
+
+    def __init__(self, path: str, interval_cycles: int = 60, top: int = 10, traceback_frames: int = 1,
+                 max_bytes: int = 1000000, backup_count: int = 3):
+        """
+        The constructor. Does not start tracing
+        :param path: the file to write the reports to
+        :param interval_cycles: how many cycles from one snapshot to the next
+        :param top: how many allocation sites to report
+        :param traceback_frames: how many frames to keep per allocation, more is slower but shows who called
+        :param max_bytes: how big the file gets before it is rotated
+        :param backup_count: how many rotated files to keep
+        """
+        self.path = path
+        self.interval_cycles = interval_cycles
+        self.top = top
+        self.traceback_frames = traceback_frames
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        # name -> a function giving a number to report with every snapshot
+        self.gauges = dict()
+
+        self.baseline = None
+        self.previous = None
+        self.cycles = 0
+        self.snapshots = 0
+        # set from the signal handler, applied at the end of the next cycle
+        self.toggle_requested = False
+
+        self.__logger = None
+        self.__lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.baseline is not None
+
+    def add_gauge(self, name: str, gauge: Callable[[], float]) -> None:
+        """
+        Adds a number to report with every snapshot
+        :param name: the name of the number
+        :param gauge: gives the number
+        :return: None
+        """
+        self.gauges[name] = gauge
+
+    def install_signal_handler(self, signal_number: Optional[int] = getattr(signal, "SIGUSR1", None)) -> bool:
+        """
+        Lets a signal switch the profiler on and off. Only works from the main thread
+        :param signal_number: the signal, SIGUSR1 by default
+        :return: whether the handler was installed
+        """
+        if signal_number is None or threading.current_thread() is not threading.main_thread():
+            return False
+
+        signal.signal(signal_number, lambda signum, frame: self.request_toggle())
+        return True
+
+    def request_toggle(self) -> None:
+        # tracing is not started or stopped in the middle of a cycle
+        self.toggle_requested = True
+
+    def start(self) -> None:
+        """
+        Starts tracing and takes the baseline
+        :return: None
+        """
+        with self.__lock:
+            # open the file before the baseline so that it does not show up as growth
+            self.__write("memory profiling starting")
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.traceback_frames)
+
+            self.baseline = self.__snapshot()
+            self.previous = self.baseline
+            self.cycles = 0
+            self.__write("memory profiling started, traced {0:.1f} KiB".format(
+                tracemalloc.get_traced_memory()[0] / 1024))
+
+    def stop(self) -> None:
+        with self.__lock:
+            if self.baseline is None:
+                return
+
+            self.__write("memory profiling stopped after {0} snapshots".format(self.snapshots))
+            self.baseline = None
+            self.previous = None
+            tracemalloc.stop()
+
+    def on_cycle(self) -> Optional[str]:
+        """
+        Called at the end of every cycle of the server. Applies a requested toggle and takes a snapshot when it is due
+        :return: the report if a snapshot was taken, else None
+        """
+        if self.toggle_requested:
+            self.toggle_requested = False
+            if self.enabled:
+                self.stop()
+            else:
+                self.start()
+            return None
+
+        if not self.enabled:
+            return None
+
+        self.cycles += 1
+        if self.cycles < self.interval_cycles:
+            return None
+
+        self.cycles = 0
+        return self.report()
+
+    def report(self) -> str:
+        """
+        Takes a snapshot and writes how it differs from the baseline and from the last snapshot
+        :return: the report
+        """
+        with self.__lock:
+            snapshot = self.__snapshot()
+            since_baseline = snapshot.compare_to(self.baseline, "traceback" if self.traceback_frames > 1 else "lineno")
+            since_previous = snapshot.compare_to(self.previous, "lineno")
+            self.previous = snapshot
+            self.snapshots += 1
+
+            current, peak = tracemalloc.get_traced_memory()
+            lines = ["memory snapshot {0}: traced {1:.1f} KiB, peak {2:.1f} KiB, {3:+.1f} KiB since the "
+                     "baseline".format(self.snapshots, current / 1024, peak / 1024,
+                                       sum(stat.size_diff for stat in since_baseline) / 1024)]
+
+            for name, gauge in self.gauges.items():
+                try:
+                    lines.append("\t{0} = {1}".format(name, gauge()))
+                except Exception as err:
+                    lines.append("\t{0} failed: {1}".format(name, err))
+
+            lines.append("\ttop growth since the baseline:")
+            lines.extend(self.__format(since_baseline))
+            lines.append("\ttop growth since the last snapshot:")
+            lines.extend(self.__format(since_previous))
+
+            report = "\n".join(lines)
+            self.__write(report)
+            return report
+
+    def __snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, filename) for filename in IGNORED_FILES] +
+            [tracemalloc.Filter(False, filename, all_frames=True) for filename in IMPORT_FILES])
+
+    def __format(self, stats: list) -> list:
+        lines = list()
+        for stat in [stat for stat in stats if stat.size_diff > 0][:self.top]:
+            # the traceback goes from the oldest frame to the allocation, show the allocation first
+            frames = " <- ".join(frame.filename + ":" + str(frame.lineno) for frame in reversed(stat.traceback))
+            lines.append("\t\t{0:+.1f} KiB ({1:+d} blocks) {2}".format(stat.size_diff / 1024, stat.count_diff,
+                                                                      frames))
+
+        return lines
+
+    def __write(self, message: str) -> None:
+        if self.__logger is None:
+            # only pay for logging once the profiler is actually used
+            import logging
+            import logging.handlers
+
+            handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=self.max_bytes,
+                                                           backupCount=self.backup_count)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.__logger = logging.getLogger("sgreen2_greenhouse.memory_profiler")
+            self.__logger.setLevel(logging.INFO)
+            self.__logger.propagate = False
+            self.__logger.addHandler(handler)
+
+        LOG.info("memory snapshot", summary=message.split("\n")[0])
+        self.__logger.info(message)
@@ -0,0 +1,237 @@
+import threading
+import time
+from collections import deque
+from math import sqrt
+from typing import Optional
+
+from sgreen2_greenhouse.reading_rollups import get_reading_time
+
+# how many seconds of readings the health checks look at for each sensor type
+DEFAULT_WINDOWS = {
+    "temp": 5 * 60,
+    "humid": 5 * 60,
+    "fanspeed": 60,
+    "soil": 24 * 60 * 60,
+    "batt": 24 * 60 * 60
+}
+
+
+class OnlineStatistics:
+    """
+    Running statistics of one sensor over a sliding time window. The mean and variance are kept with Welford's
+    algorithm and the min/max with monotonic queues, so adding a reading and reading any statistic are both
+    amortized constant time
+    """
+
+    def __init__(self, window_seconds: int):
+        """
+        The constructor
+        :param window_seconds: how many seconds of readings the statistics cover
+        """
+        self.window_seconds = window_seconds
+
+        # (time, value) of every reading inside the window, oldest first
+        self.__readings = deque()
+        # candidates for the min/max of the window, (time, value) with increasing/decreasing values
+        self.__minimums = deque()
+        self.__maximums = deque()
+
+        self.count = 0
+        self.mean = 0.0
+        self.__sum_squared_deviations = 0.0
+
+        self.last = None
+        self.last_health = None
+        self.last_seen = None
+
+    def add(self, value: float, reading_time: float, health: Optional[str] = None) -> None:
+        """
+        Adds a reading. Readings are expected in time order
+        :param value: the reading
+        :param reading_time: when the reading was recorded in seconds since the epoch
+        :param health: the health reported with the reading, if any
+        :return: None
+        """
+        self.__readings.append((reading_time, value))
+
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.__sum_squared_deviations += delta * (value - self.mean)
+
+        while self.__minimums and self.__minimums[-1][1] >= value:
+            self.__minimums.pop()
+        self.__minimums.append((reading_time, value))
+
+        while self.__maximums and self.__maximums[-1][1] <= value:
+            self.__maximums.pop()
+        self.__maximums.append((reading_time, value))
+
+        self.last = value
+        self.last_health = health
+        self.last_seen = reading_time
+
+        self.expire(reading_time)
+
+    def expire(self, now: float) -> None:
+        """
+        Drops the readings that have fallen out of the window
+        :param now: the current time in seconds since the epoch
+        :return: None
+        """
+        window_start = now - self.window_seconds
+
+        while self.__readings and self.__readings[0][0] < window_start:
+            _, value = self.__readings.popleft()
+
+            if self.count == 1:
+                self.count = 0
+                self.mean = 0.0
+                self.__sum_squared_deviations = 0.0
+            else:
+                # Welford's update run backwards
+                old_mean = self.mean
+                self.count -= 1
+                self.mean -= (value - self.mean) / self.count
+                self.__sum_squared_deviations = max(0.0, self.__sum_squared_deviations -
+                                                    (value - old_mean) * (value - self.mean))
+
+        while self.__minimums and self.__minimums[0][0] < window_start:
+            self.__minimums.popleft()
+
+        while self.__maximums and self.__maximums[0][0] < window_start:
+            self.__maximums.popleft()
+
+    @property
+    def variance(self) -> Optional[float]:
+        """
+        The sample variance of the readings in the window
+        :return: the variance or None if there are fewer than two readings
+        """
+        return self.__sum_squared_deviations / (self.count - 1) if self.count > 1 else None
+
+    @property
+    def standard_deviation(self) -> Optional[float]:
+        """
+        The sample standard deviation of the readings in the window
+        :return: the standard deviation or None if there are fewer than two readings
+        """
+        variance = self.variance
+        return sqrt(variance) if variance is not None else None
+
+    @property
+    def minimum(self) -> Optional[float]:
+        """
+        The smallest reading in the window
+        :return: the minimum or None if the window is empty
+        """
+        return self.__minimums[0][1] if self.__minimums else None
+
+    @property
+    def maximum(self) -> Optional[float]:
+        """
+        The largest reading in the window
+        :return: the maximum or None if the window is empty
+        """
+        return self.__maximums[0][1] if self.__maximums else None
+
+
+class SensorStatistics:
+    """
+    OnlineStatistics for every sensor, updated per reading as readings are ingested
+    """
+
+    def __init__(self, windows: Optional[dict] = None, default_window: int = 5 * 60):
+        """
+        The constructor
+        :param windows: a dict of sensor type and how many seconds of readings to keep statistics for
+        :param default_window: the window for sensor types that are not in windows
+        """
+        self.windows = windows if windows is not None else DEFAULT_WINDOWS
+        self.default_window = default_window
+
+        """
+        statistics = {
+            sensor_type: {
+                sensor_name: OnlineStatistics,
+                ...
+            },
+            ...
+        }
+        """
+        self.statistics = dict()
+        self.__lock = threading.Lock()
+
+    def ingest(self, sensor_type: str, readings: list) -> int:
+        """
+        Adds readings from the REST API. Readings that are not newer than the last reading of their sensor are skipped
+        :param sensor_type: the type of the sensors
+        :param readings: the raw json readings from the database
+        :return: how many readings were added
+        """
+        now = time.time()
+        rows = sorted(((get_reading_time(reading, now), reading) for reading in readings), key=lambda row: row[0])
+        window_seconds = self.window_seconds(sensor_type)
+
+        added = 0
+        with self.__lock:
+            sensors = self.statistics.setdefault(sensor_type, dict())
+            for reading_time, reading in rows:
+                sensor = reading["sensor"]["name"]
+                if sensor not in sensors:
+                    sensors[sensor] = OnlineStatistics(window_seconds)
+
+                statistics = sensors[sensor]
+                if statistics.last_seen is not None and reading_time <= statistics.last_seen:
+                    continue
+
+                statistics.add(float(reading["reading"]), reading_time, reading.get("health"))
+                added += 1
+
+        return added
+
+    def by_sensor(self, sensor_type: str, now: Optional[float] = None) -> dict:
+        """
+        Gets the statistics of the sensors of a type that have readings inside their window
+        :param sensor_type: the type of the sensors
+        :param now: the current time in seconds since the epoch (defaults to now)
+        :return: a dict of sensor name and OnlineStatistics
+        """
+        now = time.time() if now is None else now
+
+        result = dict()
+        with self.__lock:
+            for sensor, statistics in self.statistics.get(sensor_type, dict()).items():
+                statistics.expire(now)
+                if statistics.count > 0:
+                    result[sensor] = statistics
+
+        return result
+
+    def window_seconds(self, sensor_type: str) -> int:
+        """
+        How many seconds of readings the statistics of a sensor type cover
+        :param sensor_type: the type of the sensors
+        :return: the window in seconds
+        """
+        return self.windows.get(sensor_type, self.default_window)
+
+    def aggregate_by_sensor(self, sensor_type: str, now: Optional[float] = None) -> dict:
+        """
+        Aggregates every sensor of a type over its window the same way the REST API does, see reading_aggregates.py.
+        Constant time per sensor however many readings are in the window
+        :param sensor_type: the type of the sensors
+        :param now: the current time in seconds since the epoch (defaults to now)
+        :return: a dict of sensor name and {"avg", "count", "latest", "health", "time"}
+        """
+        now = time.time() if now is None else now
+
+        result = dict()
+        with self.__lock:
+            for sensor, statistics in self.statistics.get(sensor_type, dict()).items():
+                statistics.expire(now)
+                if statistics.count > 0:
+                    result[sensor] = {"avg": statistics.mean, "count": statistics.count, "latest": statistics.last,
+                                      "health": statistics.last_health, "time": statistics.last_seen}
+
+        return result
@@ -0,0 +1,166 @@
+import functools
+import json
+import threading
+from typing import Optional, TYPE_CHECKING
+from urllib.parse import urlsplit
+
+from sgreen2_greenhouse.event_log import get_logger
+
+if TYPE_CHECKING:
+    from requests import Response
+
+LOG = get_logger("payload_codec")
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+MSGPACK_CONTENT_TYPES = (MSGPACK_CONTENT_TYPE, "application/x-msgpack")
+
+# bodies smaller than this are sent as they are, gzip only makes a single reading bigger
+DEFAULT_GZIP_MIN_BYTES = 1024
+
+# what an api that does not understand a content type or encoding answers with, besides a 5xx
+UNSUPPORTED_STATUS_CODES = (400, 406, 415)
+
+
+@functools.lru_cache(maxsize=None)
+def load_msgpack():
+    """
+    Imports msgpack the first time it is needed. It is optional, without it everything is sent as JSON
+    :return: the msgpack module, None if it is not installed
+    """
+    try:
+        import msgpack
+    except ImportError:
+        return None
+
+    return msgpack
+
+
+def decode_response(response: "Response"):
+    """
+    Decodes the body of a response from the REST API, whichever content type the api picked. A gzip content encoding
+    is already undone by requests
+    :param response: the response
+    :return: the decoded body
+    """
+    content_type = response.headers.get("content-type", JSON_CONTENT_TYPE).split(";")[0].strip().lower()
+    if content_type in MSGPACK_CONTENT_TYPES and load_msgpack() is not None:
+        return load_msgpack().unpackb(response.content, raw=False)
+
+    return json.loads(response.content)
+
+
+class PayloadNegotiator:
+    """
+    Picks how bodies go over the wire per endpoint of the REST API: MessagePack instead of JSON if it is asked for and
+    msgpack is installed, and gzip for bodies that are big enough. Responses are asked for in the same formats. Until
+    an endpoint has accepted a body in an encoding, an answer of 400, 406, 415 or any 5xx to a request using it switches
+    the endpoint back, gzip first and then JSON, and the request is sent again, so an api that only speaks plain JSON
+    costs one extra request per endpoint. Once the endpoint has accepted the encoding, errors are taken to be about the
+    request and never switch it back
+    """
+
+    def __init__(self, payload_format: str = "json", gzip: bool = True,
+                 gzip_min_bytes: int = DEFAULT_GZIP_MIN_BYTES):
+        """
+        The constructor
+        :param payload_format: msgpack to use MessagePack where the api accepts it, json to always use JSON
+        :param gzip: whether to gzip request bodies and ask for gzipped responses
+        :param gzip_min_bytes: the smallest request body that is gzipped
+        """
+        if payload_format not in ("json", "msgpack"):
+            raise ValueError("payload_format must be json or msgpack, not " + payload_format)
+
+        self.payload_format = payload_format
+        self.gzip = gzip
+        self.gzip_min_bytes = gzip_min_bytes
+
+        # scheme://host/path -> {"msgpack": MessagePack bodies, "gzip": gzipped request bodies, "msgpack_accepted" and
+        # "gzip_accepted": whether the endpoint has accepted a body in the encoding}
+        self.endpoints = dict()
+        self.__lock = threading.Lock()
+
+    def endpoint(self, url: str) -> dict:
+        """
+        :param url: the url of a request
+        :return: what the endpoint of the url is known to accept
+        """
+        parts = urlsplit(url)
+        key = parts.scheme + "://" + parts.netloc + parts.path
+
+        with self.__lock:
+            if key not in self.endpoints:
+                self.endpoints[key] = {"msgpack": self.payload_format == "msgpack" and load_msgpack() is not None,
+                                       "gzip": self.gzip, "msgpack_accepted": False, "gzip_accepted": False}
+
+            return self.endpoints[key]
+
+    def prepare(self, url: str, data, headers: Optional[dict], parsed=None) -> tuple:
+        """
+        Encodes a request for an endpoint
+        :param url: the url of the request
+        :param data: the JSON body as a string or bytes, None if there is no body
+        :param headers: the headers of the request
+        :param parsed: the body already parsed, saves parsing the JSON again for MessagePack
+        :return: a tuple of (body, headers) to send
+        """
+        endpoint = self.endpoint(url)
+        headers = dict(headers) if headers else dict()
+
+        if endpoint["msgpack"]:
+            headers["accept"] = MSGPACK_CONTENT_TYPE + ", " + JSON_CONTENT_TYPE + ";q=0.9"
+        if not self.gzip:
+            headers["accept-encoding"] = "identity"
+
+        if data is None:
+            return None, headers
+
+        if endpoint["msgpack"]:
+            body = load_msgpack().packb(json.loads(data) if parsed is None else parsed)
+            headers["content-type"] = MSGPACK_CONTENT_TYPE
+        else:
+            body = data.encode() if isinstance(data, str) else data
+
+        if endpoint["gzip"] and len(body) >= self.gzip_min_bytes:
+            import gzip
+
+            body = gzip.compress(body, compresslevel=6)
+            headers["content-encoding"] = "gzip"
+
+        return body, headers
+
+    def downgrade(self, url: str, response: "Response", sent_headers: dict) -> bool:
+        """
+        Switches an endpoint back to plainer payloads if it did not understand a request
+        :param url: the url of the request
+        :param response: the response to the request
+        :param sent_headers: the headers the request was sent with
+        :return: True if the endpoint was switched and the request should be sent again
+        """
+        status_code = response.status_code
+        sent_gzip = sent_headers.get("content-encoding") == "gzip"
+        sent_msgpack = sent_headers.get("content-type") == MSGPACK_CONTENT_TYPE
+        asked_msgpack = MSGPACK_CONTENT_TYPE in sent_headers.get("accept", "")
+
+        endpoint = self.endpoint(url)
+        with self.__lock:
+            if status_code < 400:
+                # the body was understood, later errors are about what is in it
+                endpoint["gzip_accepted"] = endpoint["gzip_accepted"] or sent_gzip
+                endpoint["msgpack_accepted"] = endpoint["msgpack_accepted"] or sent_msgpack
+                return False
+
+            if status_code not in UNSUPPORTED_STATUS_CODES and status_code < 500:
+                return False
+
+            if sent_gzip and endpoint["gzip"] and not endpoint["gzip_accepted"]:
+                endpoint["gzip"] = False
+                fallback = "uncompressed bodies"
+            elif (sent_msgpack or asked_msgpack) and endpoint["msgpack"] and not endpoint["msgpack_accepted"]:
+                endpoint["msgpack"] = False
+                fallback = "JSON"
+            else:
+                return False
+
+        LOG.warning("falling back", url=url, status=response.status_code, to=fallback)
+        return True
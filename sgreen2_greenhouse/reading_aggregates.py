@@ -0,0 +1,73 @@
+from typing import Optional
+
+from sgreen2_greenhouse.reading_rollups import get_reading_time
+
+# the REST API route that aggregates readings server side, takes the same type and start_time as /data_readings
+AGGREGATE_PATH = "/data_readings/aggregate"
+
+# what an api without the aggregate route answers with
+AGGREGATE_UNSUPPORTED_STATUS_CODES = (404, 405, 501)
+
+# The aggregates of a sensor type are a dict of sensor name and
+# {
+#     "avg": the mean reading over the window,
+#     "count": how many readings are in the window,
+#     "latest": the newest reading,
+#     "health": the health reported with the newest reading, None if there is none,
+#     "time": when the newest reading was recorded in seconds since the epoch
+# }
+# Over the wire each sensor is a row like the ones /data_readings returns, with the time of the newest reading as
+# created_at, so the rows can be fed to anything that takes readings, e.g. the heartbeat index
+
+
+def aggregate_readings(readings: list) -> list:
+    """
+    The reference implementation of the aggregate route: aggregates raw readings per sensor
+    :param readings: the raw json readings from the database
+    :return: a list of aggregate rows, one per sensor
+    """
+    rows = dict()
+    for reading in readings:
+        sensor = reading["sensor"]["name"]
+        reading_time = get_reading_time(reading, 0)
+
+        row = rows.get(sensor)
+        if row is None:
+            row = rows[sensor] = {"sensor": reading["sensor"], "avg": 0.0, "count": 0, "latest": None,
+                                  "health": None, "created_at": None}
+
+        row["count"] += 1
+        # running mean, the readings of a window can be many
+        row["avg"] += (float(reading["reading"]) - row["avg"]) / row["count"]
+
+        if row["created_at"] is None or reading_time * 1000 >= row["created_at"]:
+            row["latest"] = float(reading["reading"])
+            row["health"] = reading.get("health")
+            row["created_at"] = int(reading_time * 1000)
+
+    return list(rows.values())
+
+
+def aggregates_by_sensor(rows: list) -> dict:
+    """
+    Turns the aggregate rows of the REST API into aggregates
+    :param rows: the rows
+    :return: a dict of sensor name and aggregate
+    """
+    return {row["sensor"]["name"]: {"avg": float(row["avg"]), "count": int(row["count"]),
+                                    "latest": float(row["latest"]), "health": row.get("health"),
+                                    "time": get_reading_time(row, 0)}
+            for row in rows if row["count"]}
+
+
+def pooled_mean(aggregates: dict) -> Optional[float]:
+    """
+    The mean of every reading of every sensor
+    :param aggregates: the aggregates of a sensor type
+    :return: the mean or None if there are no readings
+    """
+    count = sum(aggregate["count"] for aggregate in aggregates.values())
+    if count == 0:
+        return None
+
+    return sum(aggregate["avg"] * aggregate["count"] for aggregate in aggregates.values()) / count
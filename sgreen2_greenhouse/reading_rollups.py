@@ -0,0 +1,370 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+# the key holding the time a reading was recorded in the rows returned by /data_readings
+READING_TIME_KEY = "created_at"
+
+# bucket width in seconds -> how many buckets of that width to keep
+DEFAULT_RESOLUTIONS = {
+    60: 60,  # 1 minute buckets for the last hour
+    5 * 60: 24 * 12,  # 5 minute buckets for the last day
+    60 * 60: 7 * 24  # 1 hour buckets for the last week
+}
+
+# how many seconds before a sensor's newest reading the readings it was sent are remembered, so the same reading
+# fetched again is skipped. Well over the overlap of the incremental fetches, which is all that is ever fetched again
+DEDUPLICATION_SECONDS = 5 * 60
+# a pushed reading is stamped when it arrives and its copy in the REST API when it is inserted, a fetched reading of the
+# same sensor and value at most this many seconds from a pushed one is taken to be the same reading
+READING_MATCH_SECONDS = 2 * 60
+
+
+def get_reading_time(reading: dict, default: Optional[float] = None) -> float:
+    """
+    Gets the time a reading was recorded as seconds since the epoch
+    :param reading: a reading row from the REST API
+    :param default: the time to use if the reading has no usable time (defaults to now)
+    :return: the reading time in seconds since the epoch
+    """
+    raw_time = reading.get(READING_TIME_KEY)
+
+    if isinstance(raw_time, (int, float)):
+        # the REST API speaks in milliseconds
+        return raw_time / 1000
+
+    if isinstance(raw_time, str):
+        try:
+            return datetime.fromisoformat(raw_time.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+
+    return time.time() if default is None else default
+
+
+def get_reading_key(reading: dict) -> tuple:
+    """
+    Gets what tells a reading apart from the other readings of its sensor, so one that is fetched again is known
+    :param reading: a reading row from the REST API
+    :return: its id, or else its raw time and its value. Readings without a time are only the same if their values are
+    """
+    if "id" in reading:
+        return "id", reading["id"]
+
+    return "at", reading.get(READING_TIME_KEY), float(reading["reading"])
+
+
+class RollupBucket:
+    """
+    The aggregate of all the readings of one sensor that fell into one time bucket
+    """
+    __slots__ = ("start", "count", "total", "minimum", "maximum", "last")
+
+    def __init__(self, start: float):
+        """
+        The constructor
+        :param start: the start of the bucket in seconds since the epoch
+        """
+        self.start = start
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.last = None
+
+    def add(self, value: float) -> None:
+        """
+        Adds a reading to the bucket
+        :param value: the reading
+        :return: None
+        """
+        self.count += 1
+        self.total += value
+        self.last = value
+
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+
+class SensorRollup:
+    """
+    The rollups of a single sensor at every resolution
+    """
+
+    def __init__(self, resolutions: dict):
+        """
+        The constructor
+        :param resolutions: a dict of bucket width in seconds and how many buckets to keep
+        """
+        self.buckets = dict()
+        for width, retention in resolutions.items():
+            self.buckets[width] = deque(maxlen=retention)
+
+        # the most recent reading: {"reading": value, "health": health, "time": seconds since the epoch}
+        self.latest = None
+
+        # the keys of the readings added in the last DEDUPLICATION_SECONDS, and (time, key) of them oldest first
+        self.__recent_keys = set()
+        self.__recent = deque()
+        # pushed -> value -> times of the readings of that source that were not matched with the other source yet,
+        # and (time, pushed, value) of them in the order they came in
+        self.__unmatched = {True: dict(), False: dict()}
+        self.__unmatched_order = deque()
+
+    def is_new(self, key, reading_time: float, value: float, pushed: bool = False) -> bool:
+        """
+        Checks a reading has not been added yet and remembers it. A reading that was pushed and one that was fetched
+        are the same if their values are and they are at most READING_MATCH_SECONDS apart, each pushed reading stands
+        for at most one fetched reading and the other way round
+        :param key: what identifies the reading within its source, see get_reading_key
+        :param reading_time: when the reading was recorded in seconds since the epoch
+        :param value: the reading
+        :param pushed: whether the reading was pushed to us rather than fetched from the REST API
+        :return: False if the reading was already added
+        """
+        if key in self.__recent_keys:
+            return False
+
+        self.__recent_keys.add(key)
+        self.__recent.append((reading_time, key))
+
+        newest = max(reading_time, self.latest["time"]) if self.latest is not None else reading_time
+        while self.__recent and self.__recent[0][0] < newest - DEDUPLICATION_SECONDS:
+            self.__recent_keys.discard(self.__recent.popleft()[1])
+
+        while self.__unmatched_order and self.__unmatched_order[0][0] < newest - DEDUPLICATION_SECONDS:
+            self.__forget_unmatched(*self.__unmatched_order.popleft())
+
+        # the copy of this reading from the other source may already be in
+        others = self.__unmatched[not pushed].get(value)
+        if others is not None:
+            for other_time in others:
+                if abs(other_time - reading_time) <= READING_MATCH_SECONDS:
+                    self.__forget_unmatched(other_time, not pushed, value)
+                    return False
+
+        self.__unmatched[pushed].setdefault(value, deque()).append(reading_time)
+        self.__unmatched_order.append((reading_time, pushed, value))
+        return True
+
+    def __forget_unmatched(self, reading_time: float, pushed: bool, value: float) -> None:
+        times = self.__unmatched[pushed].get(value)
+        if times is None:
+            return
+
+        try:
+            times.remove(reading_time)
+        except ValueError:
+            # it was matched already
+            pass
+
+        if not times:
+            del self.__unmatched[pushed][value]
+
+    def add(self, value: float, health: Optional[str], reading_time: float) -> None:
+        """
+        Adds a reading to every resolution
+        :param value: the reading
+        :param health: the health reported with the reading, if any
+        :param reading_time: when the reading was recorded in seconds since the epoch
+        :return: None
+        """
+        for width, buckets in self.buckets.items():
+            start = reading_time - reading_time % width
+
+            if not buckets or buckets[-1].start < start:
+                buckets.append(RollupBucket(start))
+                buckets[-1].add(value)
+                continue
+
+            # late reading, find the bucket it belongs to if we still have it
+            for bucket in reversed(buckets):
+                if bucket.start == start:
+                    bucket.add(value)
+                    break
+                if bucket.start < start:
+                    break
+
+        if self.latest is None or reading_time >= self.latest["time"]:
+            self.latest = {"reading": value, "health": health, "time": reading_time}
+
+    def summarize(self, window_seconds: int, now: float) -> Optional[RollupBucket]:
+        """
+        Combines the buckets that fall inside a window. Uses the coarsest resolution that still splits the window into
+        a handful of buckets and keeps enough of them to cover it
+        :param window_seconds: how many seconds back to look
+        :param now: the current time in seconds since the epoch
+        :return: a RollupBucket of the whole window or None if there are no readings in it
+        """
+        window_start = now - window_seconds
+
+        fitting_widths = [width for width, buckets in self.buckets.items()
+                          if width * 5 <= window_seconds and width * buckets.maxlen >= window_seconds]
+        width = max(fitting_widths) if fitting_widths else min(self.buckets)
+
+        summary = RollupBucket(window_start)
+        for bucket in reversed(self.buckets[width]):
+            if bucket.start + width <= window_start:
+                break
+
+            summary.count += bucket.count
+            summary.total += bucket.total
+
+            if summary.minimum is None or bucket.minimum < summary.minimum:
+                summary.minimum = bucket.minimum
+
+            if summary.maximum is None or bucket.maximum > summary.maximum:
+                summary.maximum = bucket.maximum
+
+            if summary.last is None:
+                summary.last = bucket.last
+
+        return summary if summary.count > 0 else None
+
+
+class ReadingRollups:
+    """
+    Incrementally maintained per sensor rollups (count/sum/min/max/last) that are updated as readings are ingested,
+    so that aggregate queries only have to look at buckets instead of raw readings
+    """
+
+    def __init__(self, resolutions: Optional[dict] = None):
+        """
+        The constructor
+        :param resolutions: a dict of bucket width in seconds and how many buckets to keep
+        """
+        self.resolutions = resolutions if resolutions is not None else DEFAULT_RESOLUTIONS
+
+        """
+        rollups = {
+            sensor_type: {
+                sensor_name: SensorRollup,
+                ...
+            },
+            ...
+        }
+        """
+        self.rollups = dict()
+        self.__lock = threading.Lock()
+
+    def ingest(self, sensor_type: str, readings: list, pushed: bool = False) -> list:
+        """
+        Adds readings from the REST API, or pushed to us, to the rollups. A reading that was already added, by its id
+        or else by its time and value, is skipped so overlapping fetches are not counted twice, and so is one that came
+        in from the other source already, see SensorRollup.is_new. One that arrives late, older than the latest reading
+        of its sensor, still goes into its bucket
+        :param sensor_type: the type of the sensors
+        :param readings: the raw json readings from the database
+        :param pushed: whether the readings were pushed to us rather than fetched from the REST API
+        :return: the readings that were added, oldest first
+        """
+        now = time.time()
+        rows = sorted(((get_reading_time(reading, now), reading) for reading in readings), key=lambda row: row[0])
+
+        added = list()
+        with self.__lock:
+            sensors = self.rollups.setdefault(sensor_type, dict())
+            for reading_time, reading in rows:
+                sensor = reading["sensor"]["name"]
+                if sensor not in sensors:
+                    sensors[sensor] = SensorRollup(self.resolutions)
+
+                rollup = sensors[sensor]
+                value = float(reading["reading"])
+                if not rollup.is_new(get_reading_key(reading), reading_time, value, pushed):
+                    continue
+
+                rollup.add(value, reading.get("health"), reading_time)
+                added.append(reading)
+
+        return added
+
+    def newest_reading_time(self, sensor_type: str) -> Optional[float]:
+        """
+        Gets the time of the newest reading ingested for a sensor type
+        :param sensor_type: the type of the sensors
+        :return: seconds since the epoch or None if nothing has been ingested
+        """
+        with self.__lock:
+            times = [rollup.latest["time"] for rollup in self.rollups.get(sensor_type, dict()).values()]
+
+        return max(times) if times else None
+
+    def summarize_by_sensor(self, sensor_type: str, window_seconds: int, now: Optional[float] = None) -> dict:
+        """
+        Summarizes every sensor of a type over a window
+        :param sensor_type: the type of the sensors
+        :param window_seconds: how many seconds back to look
+        :param now: the current time in seconds since the epoch (defaults to now)
+        :return: a dict of sensor name and RollupBucket for the sensors that have readings in the window
+        """
+        now = time.time() if now is None else now
+
+        result = dict()
+        with self.__lock:
+            for sensor, rollup in self.rollups.get(sensor_type, dict()).items():
+                summary = rollup.summarize(window_seconds, now)
+                if summary is not None:
+                    result[sensor] = summary
+
+        return result
+
+    def mean(self, sensor_type: str, window_seconds: int, now: Optional[float] = None) -> Optional[float]:
+        """
+        Gets the mean of all the readings of a sensor type over a window
+        :param sensor_type: the type of the sensors
+        :param window_seconds: how many seconds back to look
+        :param now: the current time in seconds since the epoch (defaults to now)
+        :return: the mean or None if there are no readings in the window
+        """
+        summaries = self.summarize_by_sensor(sensor_type, window_seconds, now).values()
+        count = sum(summary.count for summary in summaries)
+
+        return sum(summary.total for summary in summaries) / count if count > 0 else None
+
+    def means_by_sensor(self, sensor_type: str, window_seconds: int, now: Optional[float] = None) -> dict:
+        """
+        Gets the mean of the readings of each sensor over a window
+        :param sensor_type: the type of the sensors
+        :param window_seconds: how many seconds back to look
+        :param now: the current time in seconds since the epoch (defaults to now)
+        :return: a dict of sensor name and mean reading
+        """
+        return {sensor: summary.total / summary.count
+                for sensor, summary in self.summarize_by_sensor(sensor_type, window_seconds, now).items()}
+
+    def aggregate_by_sensor(self, sensor_type: str, window_seconds: int, now: Optional[float] = None) -> dict:
+        """
+        Aggregates every sensor of a type over a window the same way the REST API does, see reading_aggregates.py
+        :param sensor_type: the type of the sensors
+        :param window_seconds: how many seconds back to look
+        :param now: the current time in seconds since the epoch (defaults to now)
+        :return: a dict of sensor name and {"avg", "count", "latest", "health", "time"}
+        """
+        now = time.time() if now is None else now
+        latest_by_sensor = self.latest_by_sensor(sensor_type, window_seconds, now)
+
+        return {sensor: {"avg": summary.total / summary.count, "count": summary.count,
+                         "latest": latest_by_sensor[sensor]["reading"], "health": latest_by_sensor[sensor]["health"],
+                         "time": latest_by_sensor[sensor]["time"]}
+                for sensor, summary in self.summarize_by_sensor(sensor_type, window_seconds, now).items()
+                if sensor in latest_by_sensor}
+
+    def latest_by_sensor(self, sensor_type: str, window_seconds: int, now: Optional[float] = None) -> dict:
+        """
+        Gets the latest reading of each sensor that posted data within a window
+        :param sensor_type: the type of the sensors
+        :param window_seconds: how many seconds back to look
+        :param now: the current time in seconds since the epoch (defaults to now)
+        :return: a dict of sensor name and {"reading": value, "health": health, "time": seconds since the epoch}
+        """
+        window_start = (time.time() if now is None else now) - window_seconds
+
+        with self.__lock:
+            return {sensor: dict(rollup.latest) for sensor, rollup in self.rollups.get(sensor_type, dict()).items()
+                    if rollup.latest["time"] >= window_start}
@@ -0,0 +1,76 @@
+import json
+import socket
+import threading
+import time
+
+from sgreen2_greenhouse.event_log import get_logger
+
+LOG = get_logger("reading_stream")
+
+
+class ReadingStreamSubscriber(threading.Thread):
+    """
+    Receives the readings the data reading listeners push over UDP and ingests them into the greenhouse server as they
+    arrive. While a sensor type is being pushed, the greenhouse server only polls /data_readings for it now and then to
+    backfill lost datagrams
+    """
+
+    def __init__(self, greenhouse_server, port: int, allowed_ips: set, max_silence_seconds: float):
+        """
+        The constructor. Binds the UDP socket
+        :param greenhouse_server: the GreenhouseServer to ingest the readings into
+        :param port: the UDP port to listen on
+        :param allowed_ips: the ips readings are accepted from
+        :param max_silence_seconds: how long a sensor type can go without a pushed reading before it is polled again
+        """
+        threading.Thread.__init__(self, name="reading_stream", daemon=True)
+        self.gs = greenhouse_server
+        self.allowed_ips = allowed_ips
+        self.max_silence_seconds = max_silence_seconds
+
+        # sensor type -> time.monotonic() of the last pushed reading
+        self.last_received = dict()
+        self.received = 0
+        self.rejected = 0
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("", port))
+
+    def is_live(self, sensor_type: str) -> bool:
+        """
+        Whether readings of a sensor type are currently being pushed
+        :param sensor_type: the type of the sensors
+        :return: True if a reading of the type was pushed within max_silence_seconds
+        """
+        last_received = self.last_received.get(sensor_type)
+        return last_received is not None and time.monotonic() - last_received <= self.max_silence_seconds
+
+    def run(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except OSError:
+                # the socket was closed
+                return
+
+            if address[0] not in self.allowed_ips:
+                self.rejected += 1
+                continue
+
+            try:
+                reading = json.loads(data)
+                sensor_type = reading["sensor"]["type"]
+                # the REST API stamps readings when they are inserted, do the same for pushed ones
+                reading.setdefault("created_at", int(time.time() * 1000))
+
+                self.gs.ingest_readings(sensor_type, [reading], pushed=True)
+            except (ValueError, KeyError, TypeError) as err:
+                self.rejected += 1
+                LOG.warning("datagram rejected", address=address[0], error=repr(err))
+                continue
+
+            self.received += 1
+            self.last_received[sensor_type] = time.monotonic()
+
+    def close(self) -> None:
+        self.sock.close()
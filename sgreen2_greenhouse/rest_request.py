@@ -1,9 +1,15 @@
 import json
 import threading
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 
-import requests
-from requests import Response
+from sgreen2_greenhouse.circuit_breaker import CircuitBreaker, CircuitOpenError
+from sgreen2_greenhouse.payload_codec import PayloadNegotiator
+
+if TYPE_CHECKING:
+    from requests import Response
+
+# the timeout of a request when the caller does not give one
+DEFAULT_TIMEOUT_SECONDS = 2
 
 
 class RestThread(threading.Thread):
@@ -12,7 +18,8 @@ class RestThread(threading.Thread):
     the response can be read with the response property.
     """
 
-    def __init__(self, url: str, method: str, params: Optional[dict], data: Optional[str], headers: Optional[dict]):
+    def __init__(self, url: str, method: str, params: Optional[dict], data: Optional[str], headers: Optional[dict],
+                 timeout: float = DEFAULT_TIMEOUT_SECONDS, breaker: Optional[CircuitBreaker] = None):
         """
         The generic constructor for any REST method
         :param url: the url for the request
@@ -20,6 +27,8 @@ class RestThread(threading.Thread):
         :param params: the url parameters to send
         :param data: the json stringified data to send in the body
         :param headers: any headers for the request
+        :param timeout: the timeout of the request in seconds
+        :param breaker: the circuit breaker of the REST API, if any
         """
         threading.Thread.__init__(self)
         self.url = url
@@ -27,6 +36,8 @@ class RestThread(threading.Thread):
         self.params = params
         self.data = data
         self.headers = headers
+        self.timeout = timeout
+        self.breaker = breaker
         self.response = {}
 
     def run(self):
@@ -34,14 +45,83 @@ class RestThread(threading.Thread):
         Makes the REST API call
         :return: None
         """
-        self.response = RestRequest.send(url=self.url, method=self.method, params=self.params, data=self.data,
-                                         headers=self.headers)
+        import requests
+
+        try:
+            self.response = RestRequest.send(url=self.url, method=self.method, params=self.params, data=self.data,
+                                             headers=self.headers, timeout=self.timeout, breaker=self.breaker)
+        except (requests.RequestException, CircuitOpenError) as err:
+            # nobody can catch an exception raised in the thread, hand the failure over as a response instead
+            self.response = RestRequest.failed_response(self.url, err)
 
 
 class RestRequest:
+    # how bodies are encoded for each endpoint, replaced by the greenhouse server with one from its config
+    negotiator = PayloadNegotiator()
+
+    @staticmethod
+    def send(url: str, method: str, params: Optional[dict], data: Optional[str], headers: Optional[dict],
+             timeout: float = DEFAULT_TIMEOUT_SECONDS, breaker: Optional[CircuitBreaker] = None) -> "Response":
+        # requests takes a while to import, only pay for it once the first request goes out
+        import requests
+
+        if breaker is None:
+            return RestRequest.negotiated_request(method, url, params, data, headers, timeout)
+
+        breaker.before_call()
+        failed = True
+        try:
+            response = RestRequest.negotiated_request(method, url, params, data, headers, timeout)
+            # a 4xx means the api is up and did not like the request
+            failed = response.status_code >= 500
+            return response
+        except requests.RequestException:
+            raise
+        except Exception:
+            # like CircuitBreaker.call, only not reaching the api counts against it
+            failed = False
+            raise
+        finally:
+            # whatever happened, a half open breaker is waiting for the outcome of its probe
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+    @staticmethod
+    def negotiated_request(method: str, url: str, params: Optional[dict], data: Optional[str],
+                           headers: Optional[dict], timeout: float) -> "Response":
+        """
+        Sends a request with its body encoded the way the endpoint accepts, see payload_codec.py. Decode the response
+        with decode_response
+        :return: the response
+        """
+        import requests
+
+        while True:
+            body, sent_headers = RestRequest.negotiator.prepare(url, data, headers)
+            response = requests.request(method, url, params=params, data=body, headers=sent_headers, timeout=timeout)
+
+            # the endpoint did not understand the encoding, send it again plainer
+            if not RestRequest.negotiator.downgrade(url, response, sent_headers):
+                return response
+
     @staticmethod
-    def send(url: str, method: str, params: Optional[dict], data: Optional[str], headers: Optional[dict]) -> Response:
-        return requests.request(method, url, params=params, data=data, headers=headers, timeout=2)
+    def failed_response(url: str, err: Exception) -> "Response":
+        """
+        Makes a response for a request that never got one
+        :param url: the url of the request
+        :param err: why the request failed, a requests exception or a CircuitOpenError
+        :return: a 504 response if the request timed out, else a 503 response, with the error as the body
+        """
+        import requests
+
+        response = requests.Response()
+        response.url = url
+        response.status_code = 504 if isinstance(err, requests.Timeout) else 503
+        response.reason = type(err).__name__
+        response._content = str(err).encode()
+        return response
 
 
 class RestGetThread(RestThread):
@@ -49,21 +129,25 @@ class RestGetThread(RestThread):
     For GET requests
     """
 
-    def __init__(self, url: str, params: Optional[dict]):
+    def __init__(self, url: str, params: Optional[dict], timeout: float = DEFAULT_TIMEOUT_SECONDS,
+                 breaker: Optional[CircuitBreaker] = None):
         """
         Constructs a RestThread with a GET method
         :param url: the url of the request
         :param params: a dictionary of url parameters
+        :param timeout: the timeout of the request in seconds
+        :param breaker: the circuit breaker of the REST API, if any
         """
         RestThread.__init__(self, url=url, method="get", params=params, data=None,
-                            headers={"content-type": "application/json"})
+                            headers={"content-type": "application/json"}, timeout=timeout, breaker=breaker)
 
 
 class RestGet:
     @staticmethod
-    def send(url: str, params: Optional[dict]) -> Response:
+    def send(url: str, params: Optional[dict], timeout: float = DEFAULT_TIMEOUT_SECONDS,
+             breaker: Optional[CircuitBreaker] = None) -> "Response":
         return RestRequest.send(url=url, method="get", params=params, data=None,
-                                headers={"content-type": "application/json"})
+                                headers={"content-type": "application/json"}, timeout=timeout, breaker=breaker)
 
 
 class RestPostThread(RestThread):
@@ -71,21 +155,25 @@ class RestPostThread(RestThread):
     For POST requests
     """
 
-    def __init__(self, url: str, data: Optional[dict]):
+    def __init__(self, url: str, data: Optional[dict], timeout: float = DEFAULT_TIMEOUT_SECONDS,
+                 breaker: Optional[CircuitBreaker] = None):
         """
         Constructs a RestThread with a POST method
         :param url: the url of the request
         :param data: a dictionary of data to send in the body
+        :param timeout: the timeout of the request in seconds
+        :param breaker: the circuit breaker of the REST API, if any
         """
         RestThread.__init__(self, url=url, method="post", params=None, data=json.dumps(data),
-                            headers={"content-type": "application/json"})
+                            headers={"content-type": "application/json"}, timeout=timeout, breaker=breaker)
 
 
 class RestPost:
     @staticmethod
-    def send(url: str, data: Optional[dict]) -> Response:
+    def send(url: str, data: Optional[dict], timeout: float = DEFAULT_TIMEOUT_SECONDS,
+             breaker: Optional[CircuitBreaker] = None) -> "Response":
         return RestRequest.send(url=url, method="post", params=None, data=json.dumps(data),
-                                headers={"content-type": "application/json"})
+                                headers={"content-type": "application/json"}, timeout=timeout, breaker=breaker)
 
 
 class RestPutThread(RestThread):
@@ -93,20 +181,26 @@ class RestPutThread(RestThread):
     For PUT requests
     """
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, timeout: float = DEFAULT_TIMEOUT_SECONDS,
+                 breaker: Optional[CircuitBreaker] = None):
         """
         Constructs a RestThread with a PUT method
         :param url: the url of the request
+        :param timeout: the timeout of the request in seconds
+        :param breaker: the circuit breaker of the REST API, if any
         """
         RestThread.__init__(self, url=url, method="put", params=None, data=None,
-                            headers={"content-type": "application/json", "content-length": "0"})
+                            headers={"content-type": "application/json", "content-length": "0"}, timeout=timeout,
+                            breaker=breaker)
 
 
 class RestPut:
     @staticmethod
-    def send(url: str) -> Response:
+    def send(url: str, timeout: float = DEFAULT_TIMEOUT_SECONDS,
+             breaker: Optional[CircuitBreaker] = None) -> "Response":
         return RestRequest.send(url=url, method="put", params=None, data=None,
-                                headers={"content-type": "application/json", "content-length": "0"})
+                                headers={"content-type": "application/json", "content-length": "0"},
+                                timeout=timeout, breaker=breaker)
 
 
 class RestDeleteThread(RestThread):
@@ -114,17 +208,21 @@ class RestDeleteThread(RestThread):
     For DELETE requests
     """
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, timeout: float = DEFAULT_TIMEOUT_SECONDS,
+                 breaker: Optional[CircuitBreaker] = None):
         """
         Constructs a RestThread with a DELETE method
         :param url: the url of the request
+        :param timeout: the timeout of the request in seconds
+        :param breaker: the circuit breaker of the REST API, if any
         """
         RestThread.__init__(self, url=url, method="delete", params=None, data=None,
-                            headers={"content-type": "application/json"})
+                            headers={"content-type": "application/json"}, timeout=timeout, breaker=breaker)
 
 
 class RestDelete:
     @staticmethod
-    def send(url: str) -> Response:
+    def send(url: str, timeout: float = DEFAULT_TIMEOUT_SECONDS,
+             breaker: Optional[CircuitBreaker] = None) -> "Response":
         return RestRequest.send(url=url, method="delete", params=None, data=None,
-                                headers={"content-type": "application/json"})
+                                headers={"content-type": "application/json"}, timeout=timeout, breaker=breaker)
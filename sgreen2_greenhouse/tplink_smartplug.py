@@ -1,5 +1,6 @@
 import json
 import socket
+from typing import Optional
 
 
 class TpLinkSmartplug:
@@ -59,20 +60,23 @@ class TpLinkSmartplug:
             result += chr(a)
         return result
 
-    def perform_command(self, cmd: str) -> dict:
+    def perform_command(self, cmd: str, timeout: Optional[float] = None) -> dict:
         """
         Performs any TP-Link smartplug supported command. See the commands
         dictionary
         :param cmd: a json formatted command
+        :param timeout: the timeout in seconds of connecting, sending and receiving, None to wait forever
         :return: a dictionary response
         """
         sock_tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock_tcp.connect((self.ip, self.port))
-        sock_tcp.send(self.__encrypt(cmd))
+        sock_tcp.settimeout(timeout)
+        try:
+            sock_tcp.connect((self.ip, self.port))
+            sock_tcp.send(self.__encrypt(cmd))
 
-        data = sock_tcp.recv(2048)
-
-        sock_tcp.close()
+            data = sock_tcp.recv(2048)
+        finally:
+            sock_tcp.close()
 
         data = self.__decrypt(data[4:])
 
@@ -81,13 +85,14 @@ class TpLinkSmartplug:
 
         return json.loads(data)
 
-    def set_state(self, is_on: bool) -> None:
+    def set_state(self, is_on: bool, timeout: Optional[float] = None) -> None:
         """
         Turns the TP-Link smartplug on or off depending on the state
         :param is_on: whether the smartplug should be on or off
+        :param timeout: the timeout in seconds, None to wait forever
         :return: None
         """
-        json_data = self.perform_command(self.commands["on"] if is_on else self.commands["off"])
+        json_data = self.perform_command(self.commands["on"] if is_on else self.commands["off"], timeout)
 
         if json_data["system"]["set_relay_state"]["err_code"] != 0:
             raise Exception("Error: Error from the smartplug: " + json.dumps(json_data))
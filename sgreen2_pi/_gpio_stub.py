@@ -0,0 +1,43 @@
+"""
+A stand-in for RPi.GPIO with the parts the relay controllers use, for running them off the Pis in tests and
+benchmarks. Pass the module as the gpio backend of a relay controller; every write is recorded in writes.
+"""
+BOARD = 10
+BCM = 11
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+
+mode = None
+# pin number -> level
+levels = dict()
+# (pin number, level) in the order they were written
+writes = list()
+
+
+def setmode(new_mode) -> None:
+    global mode
+    mode = new_mode
+
+
+def setwarnings(flag: bool) -> None:
+    pass
+
+
+def setup(channel: int, direction: int, initial: int = None) -> None:
+    if initial is not None:
+        levels[channel] = initial
+
+
+def output(channel: int, level: int) -> None:
+    levels[channel] = level
+    writes.append((channel, level))
+
+
+def input(channel: int) -> int:
+    return levels.get(channel, HIGH)
+
+
+def cleanup() -> None:
+    levels.clear()
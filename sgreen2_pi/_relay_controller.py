@@ -1,26 +1,82 @@
-import RPi.GPIO as GPIO
+import threading
+
+
+def load_gpio():
+    """
+    Imports the Raspberry Pi GPIO module. It is only imported when a relay controller is created without a backend so
+    the controllers can be used with sgreen2_pi/_gpio_stub.py off the Pis
+    :return: the RPi.GPIO module
+    """
+    import RPi.GPIO as GPIO
+    return GPIO
 
 
 class RelayController(object):
     """
-    A base class for relay controllers
+    A base class for relay controllers. The relays are active low, so a pin is written LOW to turn its actuator on and
+    HIGH to turn it off. Each pin's level is read back before it is written and the write is skipped if the pin is
+    already at the requested level. It is read back rather than remembered because another process, e.g. the edge fan
+    controller of the data reading listener, may drive the same pins
     """
 
-    def __init__(self, pi_pins: dict, *args, **kwargs):
+    def __init__(self, pi_pins: dict, *args, gpio=None, owns_pins: bool = True, **kwargs):
         """
         Constructor. Sets up the specified pins as output pins and turns them
         off
         :param pi_pins: the dictionary of actuator name and pin numbers
+        :param gpio: the GPIO backend, RPi.GPIO if not given
+        :param owns_pins: whether the pins are turned off when the controller is created and deleted. False for a
+        controller that shares the pins with the actuator state listener, so it does not undo what that one set
         :param kwargs: additional arguments if overriding the constructor
         """
+        self.gpio = gpio if gpio is not None else load_gpio()
         self.pi_pins = pi_pins
+        self.owns_pins = owns_pins
+        self.pin_lock = threading.Lock()
+        self.pin_writes = 0
+        self.skipped_pin_writes = 0
+
         for name, channel in self.pi_pins.items():
-            GPIO.setup(channel, GPIO.OUT)
-            self.turn_off(name)
+            self.gpio.setup(channel, self.gpio.OUT)
+        if self.owns_pins:
+            self.apply({name: False for name in self.pi_pins})
 
     def __del__(self, *args, **kwargs):  # real signature unknown
-        for name, channel in self.pi_pins.items():
-            self.turn_off(name)
+        if self.owns_pins:
+            self.apply({name: False for name in self.pi_pins})
+
+    def is_on(self, name: str) -> bool:
+        """
+        Reads back the state of an actuator
+        :param name: the name of the actuator
+        :return: whether the actuator is on
+        """
+        return name in self.pi_pins and self.gpio.input(self.pi_pins[name]) == self.gpio.LOW
+
+    def order_changes(self, changes: dict) -> list:
+        """
+        Decides the pin changes for a set of actuator changes and the order to write them in. Subclasses override this
+        for actuators that depend on each other
+        :param changes: a dictionary of actuator name and whether it should be on
+        :return: a list of (pin number, level) to write in order
+        """
+        return [(self.pi_pins[name], self.gpio.LOW if on else self.gpio.HIGH)
+                for name, on in changes.items() if name in self.pi_pins]
+
+    def apply(self, changes: dict) -> None:
+        """
+        Applies a whole set of actuator changes in one call, skipping pins that are already at the requested level
+        :param changes: a dictionary of actuator name and whether it should be on
+        :return: None
+        """
+        with self.pin_lock:
+            for channel, level in self.order_changes(changes):
+                if self.gpio.input(channel) == level:
+                    self.skipped_pin_writes += 1
+                    continue
+
+                self.gpio.output(channel, level)
+                self.pin_writes += 1
 
     def turn_on(self, name: str) -> None:
         """
@@ -28,7 +84,7 @@ class RelayController(object):
         :param name: the name of the actuator to turn on
         :return: None
         """
-        pass
+        self.apply({name: True})
 
     def turn_off(self, name: str) -> None:
         """
@@ -36,4 +92,4 @@ class RelayController(object):
         :param name: the name of the actuator to turn on
         :return: None
         """
-        pass
+        self.apply({name: False})
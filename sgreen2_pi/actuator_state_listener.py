@@ -2,12 +2,14 @@ import configparser
 import socket
 import threading
 
-import RPi.GPIO as GPIO
-
+from sgreen2_greenhouse.event_log import EVENT_LOG, get_logger
+from sgreen2_pi._relay_controller import load_gpio
 from sgreen2_pi.fan_relay_controller import FanRelayController
 from sgreen2_pi.light_relay_controller import LightsRelayController
 from sgreen2_pi.solenoid_relay_controller import SolenoidRelayController
 
+LOG = get_logger("actuator_state_listener")
+
 
 class RelayListener:
     """
@@ -15,17 +17,23 @@ class RelayListener:
     by creating a server socket and accepting connections from the greenhouse.
     """
 
-    def __init__(self, configfile: str):
+    def __init__(self, configfile: str, gpio=None):
         """
         The constructor. It sets up the server socket and initializes a FanRelayController
         :param configfile: the file used to be read for configuration
+        :param gpio: the GPIO backend, RPi.GPIO if not given
         """
-        GPIO.setmode(GPIO.BOARD)
-        GPIO.setwarnings(False)
+        self.gpio = gpio if gpio is not None else load_gpio()
+        self.gpio.setmode(self.gpio.BOARD)
+        self.gpio.setwarnings(False)
 
         self.config = configparser.ConfigParser()
         self.config.read(configfile)
 
+        # levels, file and ring of recent events of the event log, see event_log.py
+        if "log" in self.config:
+            EVENT_LOG.configure(self.config["log"])
+
         socket_port = int(self.config["pi"]["socket_port"])
 
         self.greenhouse_ip = self.config["greenhouse"]["greenhouse_ip"]
@@ -38,7 +46,7 @@ class RelayListener:
                            fan03=int(self.config["fan"]["fan03_pin"]),
                            fan04=int(self.config["fan"]["fan04_pin"]))
 
-        self.fan_relay_controller = FanRelayController(fan_pi_pins)
+        self.fan_relay_controller = FanRelayController(fan_pi_pins, gpio=self.gpio)
 
         solenoid_pi_pins = dict(master=int(self.config["solenoid"]["master_solenoid_pin"]),
                                 solenoid01=int(self.config["solenoid"]["solenoid01_pin"]),
@@ -49,12 +57,12 @@ class RelayListener:
                                 solenoid06=int(self.config["solenoid"]["solenoid06_pin"]),
                                 solenoid07=int(self.config["solenoid"]["solenoid07_pin"]))
 
-        self.solenoid_relay_controller = SolenoidRelayController(solenoid_pi_pins)
+        self.solenoid_relay_controller = SolenoidRelayController(solenoid_pi_pins, gpio=self.gpio)
 
         lights_pi_pins = dict(lights01=int(self.config["lights"]["lights01_pin"]),
                               lights02=int(self.config["lights"]["lights02_pin"]))
 
-        self.lights_relay_controller = LightsRelayController(lights_pi_pins)
+        self.lights_relay_controller = LightsRelayController(lights_pi_pins, gpio=self.gpio)
 
     def __del__(self):
         """
@@ -66,7 +74,7 @@ class RelayListener:
         del self.solenoid_relay_controller
         del self.lights_relay_controller
         self.server_socket.close()
-        GPIO.cleanup()
+        self.gpio.cleanup()
 
     def run(self):
         """
@@ -109,30 +117,45 @@ class _ClientThread(threading.Thread):
         """
         Runs the client thread. Accepts a message from the client socket and
         determines what action to take. Messages received will be in this
-        format:
+        format, with one command per line:
 
-        ACTUATOR_NAME:[on|off]
+        ACTUATOR_NAME:ACTUATOR_TYPE:[on|off]
+
+        The commands for each relay controller are applied in one call so they
+        are written in the controller's order, e.g. the master solenoid before
+        the zones
         :return: None
         """
         message = self.client_socket.recv(2048).decode()
-        print("RECEIVED: " + message)
-        name, actuator_type, state = message.split(":")
+        LOG.info("RECEIVED", message=message)
+
+        relay_controllers = dict(fan=self.relay_listener.fan_relay_controller,
+                                 water=self.relay_listener.solenoid_relay_controller,
+                                 lights=self.relay_listener.lights_relay_controller)
 
-        relay_controller = None
+        for actuator_type, changes in parse_commands(message).items():
+            if actuator_type in relay_controllers:
+                relay_controllers[actuator_type].apply(changes)
+
+
+def parse_commands(message: str) -> dict:
+    """
+    Parses the commands of a message, skipping lines that are not commands
+    :param message: the message, one ACTUATOR_NAME:ACTUATOR_TYPE:[on|off] command per line
+    :return: a dictionary of actuator type and a dictionary of actuator name and whether it should be on. A later
+    command for the same actuator replaces an earlier one
+    """
+    commands = dict()
 
-        if actuator_type == "fan":
-            relay_controller = self.relay_listener.fan_relay_controller
-        elif actuator_type == "water":
-            relay_controller = self.relay_listener.solenoid_relay_controller
-        elif actuator_type == "lights":
-            relay_controller = self.relay_listener.lights_relay_controller
+    for line in message.splitlines():
+        parts = line.strip().split(":")
+        if len(parts) != 3 or parts[2].lower() not in ("on", "off"):
+            continue
 
-        if relay_controller is not None:
-            if state.lower() == "on":
-                relay_controller.turn_on(name)
-            elif state.lower() == "off":
-                relay_controller.turn_off(name)
+        name, actuator_type, state = parts
+        commands.setdefault(actuator_type, dict())[name] = state.lower() == "on"
 
+    return commands
 
 if __name__ == "__main__":
     import sys
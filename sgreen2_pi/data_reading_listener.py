@@ -1,15 +1,102 @@
 import json
+import selectors
+import time
+from typing import Optional
 
-import datetime
-import requests
 import serial
 import configparser
 
+from sgreen2_greenhouse.event_log import EVENT_LOG, get_logger
+from sgreen2_greenhouse.payload_codec import PayloadNegotiator, DEFAULT_GZIP_MIN_BYTES
+from sgreen2_pi import serial_framing
+from sgreen2_pi.reading_publisher import ReadingPublisher
+from sgreen2_pi.upload_lane import UploadLane
+
+LOG = get_logger("data_reading_listener")
+
+DEFAULT_SERIAL_PORT = "/dev/ttyUSB0"
+
+# how often to try to reopen a serial port that could not be opened or went away
+REOPEN_SECONDS = 5
+
+# a JSON reading is well under this, more without a newline is noise, e.g. from a wrong baud rate
+MAX_LINE_BYTES = 4096
+
+
+def parse_reading(line: bytes) -> Optional[dict]:
+    """
+    Parses a line the arduino printed and checks it looks like a reading, so garbage on the serial line is not uploaded
+    :param line: the line without the newline
+    :return: the reading or None if the line is not one
+    """
+    try:
+        reading = json.loads(line)
+        sensor = reading["sensor"]
+        if isinstance(sensor["type"], str) and isinstance(sensor["name"], str):
+            float(reading["reading"])
+            return reading
+    except (ValueError, TypeError, KeyError):
+        pass
+
+    return None
+
+
+def create_edge_fan_controller(config: configparser.ConfigParser):
+    """
+    Sets up the GPIO pins of the fans on this Pi and creates an EdgeFanController for them
+    :param config: the configuration
+    :return: an EdgeFanController
+    """
+    # only the fan Pi needs these, so only import them when edge control is enabled
+    from sgreen2_pi._relay_controller import load_gpio
+    from sgreen2_pi.edge_fan_controller import EdgeFanController
+    from sgreen2_pi.fan_relay_controller import FanRelayController
+
+    gpio = load_gpio()
+    gpio.setmode(gpio.BOARD)
+    gpio.setwarnings(False)
+
+    fan_pi_pins = dict()
+    for key, pin in config["fan"].items():
+        if key.endswith("_pin"):
+            fan_pi_pins[key[:-len("_pin")]] = int(pin)
+
+    # the actuator state listener drives the same pins, leave the fans as they are when starting and stopping
+    return EdgeFanController(config, FanRelayController(fan_pi_pins, gpio=gpio, owns_pins=False))
+
+
+def create_upload_lane(config: configparser.ConfigParser, name: str, base_url: str) -> UploadLane:
+    """
+    Creates an UploadLane from the optional [upload] config. Every setting can be given for all lanes, e.g.
+    timeout_seconds, or for one lane, e.g. local_timeout_seconds
+    :param config: the configuration
+    :param name: the name of the lane, remote or local
+    :param base_url: the base url of the REST API the lane uploads to
+    :return: an UploadLane
+    """
+    upload_config = config["upload"] if "upload" in config else dict()
+
+    def setting(key: str, default: str) -> str:
+        return upload_config.get(name + "_" + key, upload_config.get(key, default))
+
+    return UploadLane(name, base_url,
+                      timeout=float(setting("timeout_seconds", "1")),
+                      max_retries=int(setting("max_retries", "3")),
+                      retry_backoff=float(setting("retry_backoff_seconds", ".5")),
+                      max_queue=int(setting("max_queue", "1000")),
+                      negotiator=PayloadNegotiator(setting("payload_format", "json"),
+                                                   setting("gzip", "true").lower() in ("1", "yes", "true", "on"),
+                                                   int(setting("gzip_min_bytes", str(DEFAULT_GZIP_MIN_BYTES)))))
+
 
 def main(configfile: str) -> None:
     config = configparser.ConfigParser()
     config.read(configfile)
 
+    # levels, file and ring of recent events of the event log, see event_log.py
+    if "log" in config:
+        EVENT_LOG.configure(config["log"])
+
     base_url = config["rest"]["base_url"]
     local_base_url = None
 
@@ -18,27 +105,186 @@ def main(configfile: str) -> None:
 
     arduino_baud_rate = int(config["arduino"]["arduino_baud_rate"])
 
-    arduino_serial_path = "/dev/ttyUSB0"
+    # every destination gets its own queue so a slow one never holds up reading or the other one
+    upload_lanes = [create_upload_lane(config, "remote", base_url)]
+    if local_base_url:
+        upload_lanes.append(create_upload_lane(config, "local", local_base_url))
+
+    for lane in upload_lanes:
+        lane.start()
+
+    # optionally push every reading straight to the greenhouse server too
+    reading_publisher = None
+    if "stream" in config and config["stream"].getboolean("enabled", False):
+        reading_publisher = ReadingPublisher(config["greenhouse"]["greenhouse_ip"], int(config["stream"]["port"]))
+
+    arduino_serial_paths = [path.strip() for path in
+                            config["arduino"].get("serial_ports", DEFAULT_SERIAL_PORT).split(",") if path.strip()]
+
+    edge_fan_controller = None
+    if "edge" in config and config["edge"].getboolean("enabled", False):
+        edge_fan_controller = create_edge_fan_controller(config)
+        edge_fan_controller.start()
+
+    # json: the arduino prints one JSON reading per line, binary: see sgreen2_pi/serial_framing.py
+    serial_format = config["arduino"].get("serial_format", "json")
+
+    readers = [SerialPortReader(path, arduino_baud_rate, serial_format) for path in arduino_serial_paths]
+    selector = selectors.DefaultSelector()
 
-    with serial.Serial(arduino_serial_path, arduino_baud_rate, timeout=.1) as arduino:
+    try:
         while True:
-            try:
-                arduino_data = arduino.readline().strip()
-                if arduino_data:
-                    print(str(datetime.datetime.now()) + " " + str(arduino_data))
-                    json_data = json.loads(arduino_data)
-
-                    if local_base_url:
-                        local_post_request = requests.post(local_base_url + "/data_readings",
-                                                           data=json.dumps(json_data),
-                                                           headers={"content-type": "application/json"})
-                        local_post_request.raise_for_status()
-
-                    post_request = requests.post(base_url + "/data_readings", data=json.dumps(json_data),
-                                                 headers={"content-type": "application/json"}, timeout=1)
-                    post_request.raise_for_status()
-            except Exception as e:
-                print(str(e))
+            # (re)open the ports that are down, the selector wakes up for the next retry while any of them is down
+            timeout = None
+            for reader in readers:
+                if reader.port is None:
+                    wait = reader.next_open_time - time.monotonic()
+                    if wait <= 0 and reader.open():
+                        selector.register(reader.port, selectors.EVENT_READ, reader)
+                        continue
+
+                    wait = max(0.0, reader.next_open_time - time.monotonic())
+                    timeout = wait if timeout is None else min(timeout, wait)
+
+            events = selector.select(timeout)
+
+            for key, _ in events:
+                reader = key.data
+                try:
+                    entries = reader.read_readings()
+                except (serial.SerialException, OSError) as e:
+                    LOG.warning("serial port failed", port=reader.path, error=str(e))
+                    selector.unregister(reader.port)
+                    reader.close()
+                    continue
+
+                for body, reading in entries:
+                    try:
+                        # every line the arduinos send, only written out at the debug level
+                        LOG.debug("reading", body=body)
+
+                        if reading_publisher is not None:
+                            reading_publisher.publish(body)
+
+                        for lane in upload_lanes:
+                            lane.put(body, reading)
+                    except Exception as e:
+                        LOG.error("handling a reading failed", error=str(e))
+
+                    # queueing the uploads does not block, so acting on the reading locally is barely held up by it,
+                    # and a reading the edge controller cannot handle is still uploaded
+                    if edge_fan_controller is not None:
+                        try:
+                            edge_fan_controller.on_reading(reading)
+                        except Exception as e:
+                            LOG.error("edge fan control failed", error=str(e))
+    finally:
+        for reader in readers:
+            reader.close()
+        selector.close()
+
+        if edge_fan_controller is not None:
+            edge_fan_controller.close()
+
+
+class SerialPortReader:
+    """
+    Reads whatever an arduino has sent on a serial port without blocking and splits it into readings
+    """
+
+    def __init__(self, path: str, baud_rate: int, serial_format: str):
+        """
+        The constructor
+        :param path: the path of the serial port, e.g. /dev/ttyUSB0
+        :param baud_rate: the baud rate of the arduino
+        :param serial_format: json or binary
+        """
+        self.path = path
+        self.baud_rate = baud_rate
+        self.serial_format = serial_format
+        self.port = None
+        self.buffer = bytearray()
+        # whether the line being read was already dropped for being too long, so it is only logged once
+        self.__dropping_line = False
+        # when to try opening the port again, in time.monotonic() seconds
+        self.next_open_time = 0.0
+
+    def open(self) -> bool:
+        """
+        Opens the serial port in non-blocking mode
+        :return: True if the port was opened
+        """
+        try:
+            self.port = serial.Serial(self.path, self.baud_rate, timeout=0)
+            self.buffer.clear()
+            return True
+        except (serial.SerialException, OSError) as e:
+            LOG.warning("serial port failed to open", port=self.path, error=str(e))
+            self.port = None
+            self.next_open_time = time.monotonic() + REOPEN_SECONDS
+            return False
+
+    def close(self) -> None:
+        """
+        Closes the serial port. It will be reopened after REOPEN_SECONDS
+        :return: None
+        """
+        if self.port is not None:
+            self.port.close()
+            self.port = None
+            self.next_open_time = time.monotonic() + REOPEN_SECONDS
+
+    def read_readings(self) -> list:
+        """
+        Reads everything waiting on the port and splits off the complete readings. Partial lines or frames are kept
+        for the next read, a partial line only up to MAX_LINE_BYTES
+        :return: a list of (JSON body, parsed reading) tuples
+        """
+        self.buffer += self.port.read(self.port.in_waiting or 1)
+
+        if self.serial_format == "binary":
+            readings, consumed = serial_framing.decode_records(self.buffer)
+            del self.buffer[:consumed]
+            return [(json.dumps(reading), reading) for reading in readings]
+
+        end = self.buffer.rfind(b"\n")
+        if end < 0:
+            self.__drop_long_line()
+            return list()
+
+        lines = bytes(self.buffer[:end]).split(b"\n")
+        del self.buffer[:end + 1]
+        self.__dropping_line = False
+        self.__drop_long_line()
+
+        entries = list()
+        for line in (line.strip() for line in lines):
+            if not line:
+                continue
+
+            reading = parse_reading(line)
+            if reading is None:
+                LOG.warning("not a reading", port=self.path, line=line)
+                continue
+
+            entries.append((line, reading))
+
+        return entries
+
+    def __drop_long_line(self) -> None:
+        """
+        Drops the partial line kept for the next read if it is longer than any reading, so noise without newlines does
+        not grow the buffer forever. Reading picks up again after the next newline
+        :return: None
+        """
+        if len(self.buffer) <= MAX_LINE_BYTES:
+            return
+
+        if not self.__dropping_line:
+            LOG.warning("dropping a line too long to be a reading", port=self.path, bytes=len(self.buffer))
+            self.__dropping_line = True
+
+        self.buffer.clear()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,195 @@
+import threading
+import time
+from typing import Optional
+
+from sgreen2_greenhouse.event_log import get_logger
+from sgreen2_greenhouse.payload_codec import decode_response
+from sgreen2_greenhouse.rest_request import RestDelete, RestGet, RestPut
+from sgreen2_pi.fan_relay_controller import FanRelayController
+
+LOG = get_logger("edge_fan_controller")
+
+# temperature readings older than this are not used to make decisions
+TEMPERATURE_MAX_AGE_SECONDS = 5 * 60
+
+
+class EdgeFanController:
+    """
+    A fast path for the fans that runs next to the data reading listener on the fan Pi. It keeps a cached copy of the
+    temperature thresholds from /settings, evaluates every incoming temperature reading against them and drives the
+    FanRelayController directly, then reports the new fan state upstream.
+
+    The greenhouse server stays authoritative while the REST API is reachable: the edge controller only acts when the
+    temperature crosses a threshold, so if the server overrides it on its next cycle the edge controller leaves the
+    fans alone until the next crossing. If the REST API cannot be reached the edge controller keeps enforcing the
+    cached thresholds on every reading, the ones from [edge] until the REST API first answers.
+    """
+
+    def __init__(self, config, fan_relay_controller: FanRelayController):
+        """
+        The constructor
+        :param config: the ConfigParser of the data reading listener
+        :param fan_relay_controller: the controller for the fans on this Pi
+        """
+        self.fan_relay_controller = fan_relay_controller
+
+        self.urls = [config["rest"]["base_url"]]
+        if "local_base_url" in config["rest"]:
+            self.urls.append(config["rest"]["local_base_url"])
+
+        self.refresh_seconds = int(config["edge"].get("settings_refresh_seconds", "60"))
+
+        # until the first refresh comes back, nothing is switched without them
+        self.min_temperature = float(config["edge"]["min_temperature"]) if "min_temperature" in config["edge"] else None
+        self.max_temperature = float(config["edge"]["max_temperature"]) if "max_temperature" in config["edge"] else None
+        self.api_reachable = False
+
+        # sensor name -> (time received, reading)
+        self.latest_temperatures = dict()
+        # the last known state of the fans, either commanded here or read from /actuators
+        self.fans_on = None
+        # whether the last evaluated temperature was above the max, to detect crossings
+        self.__was_above_max = None
+
+        self.__lock = threading.Lock()
+        # held while the pins are driven, so catching up with the server never undoes a newer switch
+        self.__drive_lock = threading.Lock()
+        self.__refresh_thread = threading.Thread(target=self.__refresh_loop, name="edge_refresh", daemon=True)
+
+        from concurrent.futures import ThreadPoolExecutor
+        # one report at a time, in the order the fans were switched
+        self.__reporter = ThreadPoolExecutor(1, "edge_report")
+
+    def start(self) -> None:
+        """
+        Fetches the thresholds and fan states in the background and keeps them fresh, so a slow or unreachable REST
+        API never holds up reading the arduinos
+        :return: None
+        """
+        self.__refresh_thread.start()
+
+    def close(self) -> None:
+        """
+        Stops reporting, the report being sent is finished and the ones still waiting are dropped
+        :return: None
+        """
+        self.__reporter.shutdown(wait=True, cancel_futures=True)
+
+    def refresh(self) -> bool:
+        """
+        Refreshes the cached temperature thresholds and the fan states from the REST API
+        :return: True if the REST API was reachable
+        """
+        for url in self.urls:
+            try:
+                settings_response = RestGet.send(url + "/settings", None)
+                actuators_response = RestGet.send(url + "/actuators", None)
+            except OSError:
+                continue
+
+            if not settings_response.ok or not actuators_response.ok:
+                continue
+
+            settings = decode_response(settings_response)
+            fan_states = [actuator["state"] for actuator in decode_response(actuators_response)
+                          if actuator["name"] in self.fan_relay_controller.pi_pins]
+
+            with self.__lock:
+                self.min_temperature = float(settings["temperature"]["min"])
+                self.max_temperature = float(settings["temperature"]["max"])
+                if fan_states:
+                    self.fans_on = any(fan_states)
+                self.api_reachable = True
+
+            return True
+
+        with self.__lock:
+            self.api_reachable = False
+
+        return False
+
+    def __refresh_loop(self) -> None:
+        if self.refresh():
+            # catch up with what the server last asked for, in case the fans were switched while this was down
+            with self.__drive_lock:
+                with self.__lock:
+                    fans_on = self.fans_on
+
+                if fans_on is not None:
+                    self.__drive_fans(fans_on)
+
+        while True:
+            time.sleep(self.refresh_seconds)
+            self.refresh()
+
+    def on_reading(self, reading: dict) -> Optional[bool]:
+        """
+        Evaluates a reading from the arduino and turns the fans on or off if needed
+        :param reading: the json reading from the arduino
+        :return: the new fan state if the fans were switched, else None
+        """
+        if reading.get("sensor", dict()).get("type") != "temp":
+            return None
+
+        now = time.time()
+
+        with self.__lock:
+            if self.max_temperature is None:
+                return None
+
+            self.latest_temperatures[reading["sensor"]["name"]] = (now, float(reading["reading"]))
+
+            recent = [value for received, value in self.latest_temperatures.values()
+                      if now - received <= TEMPERATURE_MAX_AGE_SECONDS]
+            avg_temperature = sum(recent) / len(recent)
+
+            is_above_max = avg_temperature > self.max_temperature
+            crossed = self.__was_above_max is not None and is_above_max != self.__was_above_max
+            self.__was_above_max = is_above_max
+
+            if is_above_max == self.fans_on:
+                return None
+
+            # the server is in charge while it can be reached, only react to threshold crossings between its cycles
+            if self.api_reachable and not crossed:
+                return None
+
+            self.fans_on = is_above_max
+
+        with self.__drive_lock:
+            self.__drive_fans(is_above_max)
+        self.__report(is_above_max)
+
+        return is_above_max
+
+    def __drive_fans(self, is_on: bool) -> None:
+        for name in self.fan_relay_controller.pi_pins:
+            if is_on:
+                self.fan_relay_controller.turn_on(name)
+            else:
+                self.fan_relay_controller.turn_off(name)
+
+    def __report(self, is_on: bool) -> None:
+        """
+        Reports the new fan states upstream without waiting for the requests to finish
+        :param is_on: whether the fans were turned on
+        :return: None
+        """
+        try:
+            self.__reporter.submit(self.__send_report, is_on)
+        except RuntimeError:
+            # closed
+            pass
+
+    def __send_report(self, is_on: bool) -> None:
+        for url in self.urls:
+            for name in self.fan_relay_controller.pi_pins:
+                state_url = url + "/actuators/" + name + "/state"
+                try:
+                    response = RestPut.send(state_url) if is_on else RestDelete.send(state_url)
+                except OSError as e:
+                    LOG.warning("reporting the fan state failed", url=state_url, error=str(e))
+                    continue
+
+                if not response.ok:
+                    LOG.warning("reporting the fan state failed", url=state_url, status=response.status_code)
@@ -1,5 +1,3 @@
-import RPi.GPIO as GPIO
-
 from sgreen2_pi import _relay_controller
 
 
@@ -8,27 +6,11 @@ class FanRelayController(_relay_controller.RelayController):
     A class for controlling the small fans in the greenhouse
     """
 
-    def __init__(self, pi_pins: dict):
+    def __init__(self, pi_pins: dict, gpio=None, owns_pins: bool = True):
         """
         The constructor
         :param pi_pins: a dictionary of (fan names: pin number)
+        :param gpio: the GPIO backend, RPi.GPIO if not given
+        :param owns_pins: whether the fans are turned off when the controller is created and deleted
         """
-        _relay_controller.RelayController.__init__(self, pi_pins)
-
-    def turn_on(self, name: str) -> None:
-        """
-        Turns on a fan
-        :param name: the name of the fan
-        :return: None
-        """
-        if name in self.pi_pins:
-            GPIO.output(self.pi_pins[name], GPIO.LOW)
-
-    def turn_off(self, name: str) -> None:
-        """
-        Turns off a fan
-        :param name: the name of the fan
-        :return: None
-        """
-        if name in self.pi_pins:
-            GPIO.output(self.pi_pins[name], GPIO.HIGH)
+        _relay_controller.RelayController.__init__(self, pi_pins, gpio=gpio, owns_pins=owns_pins)
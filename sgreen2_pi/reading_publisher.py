@@ -0,0 +1,36 @@
+import socket
+
+
+class ReadingPublisher:
+    """
+    Pushes every reading to the greenhouse server over UDP as soon as it is read, see
+    sgreen2_greenhouse/reading_stream.py. Sending never blocks and lost datagrams are not sent again, the greenhouse
+    server fetches them from the REST API every few minutes and falls back to polling it when a sensor type goes quiet
+    """
+
+    def __init__(self, greenhouse_ip: str, port: int):
+        """
+        The constructor
+        :param greenhouse_ip: the ip of the greenhouse server
+        :param port: the UDP port the greenhouse server listens on
+        """
+        self.address = (greenhouse_ip, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sent = 0
+        self.failed = 0
+
+    def publish(self, body) -> None:
+        """
+        Pushes a reading
+        :param body: the JSON reading as a string or bytes
+        :return: None
+        """
+        try:
+            self.sock.sendto(body.encode() if isinstance(body, str) else body, self.address)
+            self.sent += 1
+        except OSError:
+            self.failed += 1
+
+    def close(self) -> None:
+        self.sock.close()
@@ -0,0 +1,95 @@
+"""
+Compact binary records sent by the arduinos when they are built with USE_BINARY_FRAMING.
+
+Every record is a frame of 11 bytes:
+
+    0xA5 | length (7) | type code | sensor number | reading (float32, little endian) | health code | crc16 (big endian)
+
+The crc is CRC-16/XMODEM over the length byte and the payload, the same as avr-libc's _crc_xmodem_update and
+binascii.crc_hqx. A JSON line for the same reading is around 80 bytes.
+"""
+import struct
+from binascii import crc_hqx
+
+FRAME_SYNC = 0xA5
+
+PAYLOAD_FORMAT = struct.Struct("<BBfB")
+PAYLOAD_LENGTH = PAYLOAD_FORMAT.size
+FRAME_LENGTH = 2 + PAYLOAD_LENGTH + 2
+
+# type code -> (sensor type, sensor name prefix, unit)
+SENSOR_TYPES = {
+    1: ("temp", "temp", "temp_f"),
+    2: ("humid", "humid", "humid_percent"),
+    3: ("fanspeed", "fan", "fanspeed_rpm"),
+    4: ("soil", "soil", "soil_raw"),
+    5: ("batt", "batt", "batt_volts")
+}
+
+SENSOR_TYPE_CODES = {sensor_type: code for code, (sensor_type, _, _) in SENSOR_TYPES.items()}
+
+# health code -> health, 0 means the arduino did not report a health
+HEALTH_CODES = {
+    1: "ok",
+    2: "low",
+    3: "critical"
+}
+
+
+def encode_record(sensor_type: str, sensor_number: int, reading: float, health_code: int = 0) -> bytes:
+    """
+    Encodes a reading the same way the arduinos do
+    :param sensor_type: the type of the sensor, e.g. temp
+    :param sensor_number: the number of the sensor, e.g. 1 for temp01
+    :param reading: the reading
+    :param health_code: the health code, 0 for none
+    :return: the frame
+    """
+    body = bytes((PAYLOAD_LENGTH,)) + PAYLOAD_FORMAT.pack(SENSOR_TYPE_CODES[sensor_type], sensor_number, reading,
+                                                          health_code)
+    return bytes((FRAME_SYNC,)) + body + crc_hqx(body, 0).to_bytes(2, "big")
+
+
+def decode_records(buffer: bytes) -> tuple:
+    """
+    Decodes every complete record in a buffer. Corrupted or unknown frames are skipped by resynchronizing on the next
+    sync byte
+    :param buffer: the bytes read from the serial port
+    :return: a tuple of (a list of readings shaped like the JSON the arduinos print, how many bytes were consumed).
+    The bytes after the consumed ones are an incomplete frame that should be kept for the next call
+    """
+    readings = list()
+    view = memoryview(buffer)
+    end = len(buffer)
+    position = 0
+
+    while True:
+        position = buffer.find(FRAME_SYNC, position)
+        if position < 0:
+            return readings, end
+
+        if end - position < FRAME_LENGTH:
+            return readings, position
+
+        body = view[position + 1:position + FRAME_LENGTH - 2]
+        if buffer[position + 1] != PAYLOAD_LENGTH or \
+                crc_hqx(body, 0) != int.from_bytes(view[position + FRAME_LENGTH - 2:position + FRAME_LENGTH], "big"):
+            position += 1
+            continue
+
+        type_code, sensor_number, value, health_code = PAYLOAD_FORMAT.unpack_from(buffer, position + 2)
+        position += FRAME_LENGTH
+
+        if type_code not in SENSOR_TYPES:
+            continue
+
+        sensor_type, name_prefix, unit = SENSOR_TYPES[type_code]
+        reading = {"sensor": {"type": sensor_type, "name": name_prefix + "{0:02d}".format(sensor_number)},
+                   # the arduinos print readings with two decimals
+                   "reading": round(value, 2),
+                   "unit": unit}
+
+        if health_code in HEALTH_CODES:
+            reading["health"] = HEALTH_CODES[health_code]
+
+        readings.append(reading)
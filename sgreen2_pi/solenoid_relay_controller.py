@@ -1,5 +1,3 @@
-import RPi.GPIO as GPIO
-
 from sgreen2_pi import _relay_controller
 
 
@@ -8,54 +6,43 @@ class SolenoidRelayController(_relay_controller.RelayController):
     A class for controlling the solenoids in the greenhouse
     """
 
-    def __init__(self, pi_pins: dict):
+    def __init__(self, pi_pins: dict, gpio=None):
         """
         The constructor
         :param pi_pins: a dictionary of (solenoid names: pin number)
+        :param gpio: the GPIO backend, RPi.GPIO if not given
         """
-        self.solenoid_state = dict()
-        for solenoid in pi_pins:
-            self.solenoid_state[solenoid] = False
-
-        # keep the state of the solenoids so that we can turn the master off if all the others are off
+        # the master is opened while any other solenoid is open
         if "master" not in pi_pins:
             raise Exception("Master solenoid required for solenoid relay controller")
 
-        _relay_controller.RelayController.__init__(self, pi_pins)
+        _relay_controller.RelayController.__init__(self, pi_pins, gpio=gpio)
 
     def all_solenoids_off(self) -> bool:
         """
         Checks if all the non-master solenoids are off
         :return: whether all the non-master solenoids are off
         """
-        for solenoid in self.solenoid_state:
-            if solenoid != "master" and self.solenoid_state[solenoid]:
+        for solenoid in self.pi_pins:
+            if solenoid != "master" and self.is_on(solenoid):
                 return False
 
         return True
 
-    def turn_on(self, name: str) -> None:
+    def order_changes(self, changes: dict) -> list:
         """
-        Turns on a solenoid
-        :param name: the name of the solenoid
-        :return: None
+        Opens the master before any solenoid is opened and closes it after every solenoid is closed. Solenoids that
+        close are closed before the others open so no more zones than asked for share the water at once
+        :param changes: a dictionary of solenoid name and whether it should be on
+        :return: a list of (pin number, level) to write in order
         """
-        if name in self.pi_pins:
-            GPIO.output(self.pi_pins["master"], GPIO.LOW)
-            GPIO.output(self.pi_pins[name], GPIO.LOW)
-            self.solenoid_state["master"] = True
-            self.solenoid_state[name] = True
+        zone_changes = {name: on for name, on in changes.items() if name in self.pi_pins and name != "master"}
+        any_zone_on = any(zone_changes.get(name, self.is_on(name)) for name in self.pi_pins if name != "master")
 
-    def turn_off(self, name: str) -> None:
-        """
-        Turns off a solenoid
-        :param name: the name of the solenoid
-        :return: None
-        """
-        if name in self.pi_pins:
-            GPIO.output(self.pi_pins[name], GPIO.HIGH)
-            self.solenoid_state[name] = False
+        closing = [(self.pi_pins[name], self.gpio.HIGH) for name, on in zone_changes.items() if not on]
+        opening = [(self.pi_pins[name], self.gpio.LOW) for name, on in zone_changes.items() if on]
+
+        if any_zone_on:
+            return [(self.pi_pins["master"], self.gpio.LOW)] + closing + opening
 
-        if self.all_solenoids_off():
-            GPIO.output(self.pi_pins["master"], GPIO.HIGH)
-            self.solenoid_state["master"] = False
+        return closing + opening + [(self.pi_pins["master"], self.gpio.HIGH)]
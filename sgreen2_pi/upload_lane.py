@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import deque
+from typing import Optional, TYPE_CHECKING
+
+from sgreen2_greenhouse.event_log import get_logger
+from sgreen2_greenhouse.payload_codec import PayloadNegotiator
+
+if TYPE_CHECKING:
+    from requests import Response
+
+LOG = get_logger("upload_lane")
+
+# how often a lane with a backlog logs its status
+STATUS_SECONDS = 60
+
+
+class UploadLane(threading.Thread):
+    """
+    Uploads readings to one REST API from its own queue, with its own timeout and retry policy, so a slow or
+    unreachable destination never holds up reading the arduinos or uploading to the other destinations. If the queue
+    fills up the oldest readings are dropped
+    """
+
+    def __init__(self, name: str, base_url: str, timeout: float = 1, max_retries: int = 3,
+                 retry_backoff: float = .5, max_queue: int = 1000, negotiator: Optional[PayloadNegotiator] = None):
+        """
+        The constructor
+        :param name: the name of the lane for status messages, e.g. remote
+        :param base_url: the base url of the REST API to upload to
+        :param timeout: the timeout of each upload in seconds
+        :param max_retries: how many times to retry an upload that failed before dropping it
+        :param retry_backoff: how many seconds to wait before the first retry, doubled for every retry after that
+        :param max_queue: how many readings can wait in the queue before the oldest are dropped
+        :param negotiator: how the readings are encoded for the REST API, MessagePack and gzip where it accepts them
+        if not given
+        """
+        threading.Thread.__init__(self, name="upload_" + name, daemon=True)
+        self.lane_name = name
+        self.url = base_url + "/data_readings"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.negotiator = negotiator if negotiator is not None else PayloadNegotiator()
+
+        # (time queued, JSON body, parsed reading or None)
+        self.queue = deque(maxlen=max_queue)
+        self.__condition = threading.Condition()
+        # made by the lane's own thread, so importing requests does not hold up reading the arduinos at start up
+        self.__session = None
+
+        self.uploaded = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_error = None
+        self.__last_status_time = time.monotonic()
+
+    def put(self, body, reading: Optional[dict] = None) -> None:
+        """
+        Queues a reading for upload without blocking
+        :param body: the JSON reading as a string or bytes
+        :param reading: the reading already parsed, if it was
+        :return: None
+        """
+        with self.__condition:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append((time.monotonic(), body, reading))
+            self.__condition.notify()
+
+    def lag_seconds(self) -> float:
+        """
+        How long the oldest queued reading has been waiting
+        :return: the lag in seconds, 0 if the queue is empty
+        """
+        with self.__condition:
+            return time.monotonic() - self.queue[0][0] if self.queue else 0.0
+
+    def status(self) -> dict:
+        """
+        The state of the lane
+        :return: a dict of the queue depth, lag and counters
+        """
+        return {"lane": self.lane_name, "queued": len(self.queue), "lag_seconds": self.lag_seconds(),
+                "uploaded": self.uploaded, "failed": self.failed, "dropped": self.dropped,
+                "last_error": self.last_error}
+
+    def run(self):
+        import requests
+        self.__session = requests.Session()
+
+        while True:
+            with self.__condition:
+                while not self.queue:
+                    self.__condition.wait()
+                entry = self.queue[0]
+            _, body, reading = entry
+
+            error = self.__upload_with_retries(body, reading)
+
+            with self.__condition:
+                # the reading may have been pushed out while we were uploading it
+                if self.queue and self.queue[0] is entry:
+                    self.queue.popleft()
+
+            if error is None:
+                self.uploaded += 1
+            else:
+                self.failed += 1
+                self.last_error = error
+                LOG.warning("upload failed", lane=self.lane_name, error=error)
+
+            if self.queue and time.monotonic() - self.__last_status_time >= STATUS_SECONDS:
+                self.__last_status_time = time.monotonic()
+                LOG.info("upload lane status", **self.status())
+
+    def __upload_with_retries(self, body, reading: Optional[dict]) -> Optional[str]:
+        """
+        Uploads a reading, retrying with an exponential backoff on connection errors and server errors. Any other error
+        drops the reading
+        :param body: the JSON reading
+        :param reading: the reading already parsed, or None
+        :return: None if the upload succeeded, else the last error
+        """
+        import requests
+
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+            try:
+                response = self.__post(body, reading)
+            except requests.RequestException as e:
+                error = str(e)
+                continue
+            except Exception as e:
+                # e.g. a body that cannot be encoded, sending it again would fail the same way and the lane must not die
+                return repr(e)
+
+            if response.ok:
+                return None
+
+            error = "status code " + str(response.status_code) + ": " + response.text
+            # the server will not accept this reading no matter how many times we send it
+            if response.status_code < 500:
+                return error
+
+        return error
+
+    def __post(self, body, reading: Optional[dict]) -> "Response":
+        while True:
+            data, headers = self.negotiator.prepare(self.url, body, {"content-type": "application/json"}, reading)
+            response = self.__session.post(self.url, data=data, headers=headers, timeout=self.timeout)
+
+            # the api did not understand the encoding, which is not a failed attempt
+            if not self.negotiator.downgrade(self.url, response, headers):
+                return response
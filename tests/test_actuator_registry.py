@@ -0,0 +1,85 @@
+from sgreen2_greenhouse.actuator_registry import ActuatorRegistry
+
+ACTUATORS = [
+    {"name": "fan01", "type": "fan", "state": False},
+    {"name": "bigfan", "type": "fan", "state": False},
+    {"name": "solenoid01", "type": "solenoid", "state": False}
+]
+
+
+def device_of(actuator: dict):
+    if actuator["name"] == "bigfan":
+        return "smartplug_bigfan"
+    return "pi_" + actuator["type"]
+
+
+def copy_rows(rows: list) -> list:
+    return [dict(row) for row in rows]
+
+
+def test_first_fetch_adds_everything():
+    registry = ActuatorRegistry(device_of)
+
+    diff = registry.update(copy_rows(ACTUATORS))
+
+    assert diff == {"added": ["fan01", "bigfan", "solenoid01"], "removed": [], "changed": []}
+    assert [actuator["name"] for actuator in registry.of_type("fan")] == ["fan01", "bigfan"]
+    assert [actuator["name"] for actuator in registry.on_device("pi_solenoid")] == ["solenoid01"]
+    assert sorted(registry.devices()) == ["pi_fan", "pi_solenoid", "smartplug_bigfan"]
+    assert len(registry) == 3
+
+
+def test_unchanged_fetch_keeps_the_dicts():
+    registry = ActuatorRegistry(device_of)
+    registry.update(copy_rows(ACTUATORS))
+    fan = registry.get("fan01")
+    version = registry.version
+
+    diff = registry.update(copy_rows(ACTUATORS))
+
+    assert diff == {"added": [], "removed": [], "changed": []}
+    assert registry.get("fan01") is fan
+    assert registry.version == version
+
+
+def test_changed_actuator_gets_a_new_dict():
+    registry = ActuatorRegistry(device_of)
+    registry.update(copy_rows(ACTUATORS))
+    held = registry.get("fan01")
+
+    rows = copy_rows(ACTUATORS)
+    rows[0]["state"] = True
+    diff = registry.update(rows)
+
+    assert diff["changed"] == ["fan01"]
+    assert registry.get("fan01")["state"] is True
+    # whoever still holds the old one sees it as it was
+    assert held == ACTUATORS[0]
+    assert registry.get("fan01") in registry.of_type("fan")
+    assert held not in registry.of_type("fan")
+
+
+def test_moved_actuator_is_reindexed():
+    registry = ActuatorRegistry(device_of)
+    registry.update(copy_rows(ACTUATORS))
+
+    rows = copy_rows(ACTUATORS)
+    rows[2]["type"] = "lights"
+    registry.update(rows)
+
+    assert registry.of_type("solenoid") == list()
+    assert [actuator["name"] for actuator in registry.on_device("pi_lights")] == ["solenoid01"]
+    assert "pi_solenoid" not in registry.devices()
+
+
+def test_removed_actuator_is_dropped_everywhere():
+    registry = ActuatorRegistry(device_of)
+    registry.update(copy_rows(ACTUATORS))
+    version = registry.version
+
+    diff = registry.update(copy_rows(ACTUATORS[:2]))
+
+    assert diff["removed"] == ["solenoid01"]
+    assert registry.get("solenoid01") is None
+    assert registry.on_device("pi_solenoid") == list()
+    assert registry.version == version + 1
@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+from sgreen2_pi import _gpio_stub
+from sgreen2_pi.actuator_state_listener import _ClientThread, parse_commands
+from sgreen2_pi.fan_relay_controller import FanRelayController
+from sgreen2_pi.light_relay_controller import LightsRelayController
+from sgreen2_pi.solenoid_relay_controller import SolenoidRelayController
+
+MASTER, SOLENOID01, SOLENOID02 = 3, 5, 7
+
+
+class FakeSocket:
+    """
+    Hands out one message, like a client socket of the greenhouse
+    """
+
+    def __init__(self, message: str):
+        self.message = message.encode()
+
+    def recv(self, size: int) -> bytes:
+        return self.message
+
+
+def relay_listener() -> SimpleNamespace:
+    _gpio_stub.levels.clear()
+    listener = SimpleNamespace(
+        fan_relay_controller=FanRelayController({"fan01": 11}, gpio=_gpio_stub),
+        solenoid_relay_controller=SolenoidRelayController(
+            {"master": MASTER, "solenoid01": SOLENOID01, "solenoid02": SOLENOID02}, gpio=_gpio_stub),
+        lights_relay_controller=LightsRelayController({"lights01": 13}, gpio=_gpio_stub))
+    _gpio_stub.writes.clear()
+    return listener
+
+
+def receive(listener: SimpleNamespace, message: str) -> None:
+    _ClientThread(FakeSocket(message), listener).run()
+
+
+def test_parse_commands_groups_by_type_and_skips_bad_lines():
+    message = "fan01:fan:on\nsolenoid01:water:ON\nnonsense\nlights01:lights:dim\nsolenoid01:water:off\n"
+
+    assert parse_commands(message) == {"fan": {"fan01": True}, "water": {"solenoid01": False}}
+
+
+def test_one_command_per_message_still_switches_the_actuator():
+    listener = relay_listener()
+
+    receive(listener, "fan01:fan:on")
+
+    assert listener.fan_relay_controller.is_on("fan01")
+    assert _gpio_stub.writes == [(11, _gpio_stub.LOW)]
+
+
+def test_the_solenoids_of_a_message_are_applied_together_master_first():
+    listener = relay_listener()
+
+    receive(listener, "solenoid01:water:on\nsolenoid02:water:on")
+
+    assert _gpio_stub.writes == [(MASTER, _gpio_stub.LOW), (SOLENOID01, _gpio_stub.LOW), (SOLENOID02, _gpio_stub.LOW)]
+
+    _gpio_stub.writes.clear()
+    receive(listener, "solenoid01:water:off\nsolenoid02:water:off")
+
+    assert _gpio_stub.writes == [(SOLENOID01, _gpio_stub.HIGH), (SOLENOID02, _gpio_stub.HIGH),
+                                 (MASTER, _gpio_stub.HIGH)]
@@ -0,0 +1,100 @@
+import threading
+from datetime import datetime, timedelta
+
+from benchmarks.fakes import NullEmailClient
+from sgreen2_greenhouse.actuator_registry import ActuatorRegistry
+from sgreen2_greenhouse.automated_actuators import AutomatedSolenoids
+from sgreen2_greenhouse.error_notifier import ErrorNotifier
+
+NOW = datetime(2020, 6, 1, 8, 0)
+SETTINGS = {"soil_moisture": {"min": 30, "max": 90}}
+
+
+class StubGreenhouseServer:
+    """
+    Just enough of a GreenhouseServer for AutomatedSolenoids, with a dry soil moisture sensor and watering runs that
+    last until they are let go
+    """
+
+    def __init__(self):
+        self.config = {"sensors": {"number_soil_sensors": "1"},
+                       "ranges": {"min_soil_moisture": "0", "max_soil_moisture": "100"},
+                       "soil_moisture": {"soil01_solenoid": "solenoid01"},
+                       "solenoid": {"solenoid01_seconds": "10"}}
+        self.error_notifier = ErrorNotifier(NullEmailClient(), 1)
+        self.watering_times = [NOW - timedelta(minutes=1)]
+        self.irrigation_run = None
+        self.watered = list()
+        self.watering_done = threading.Event()
+
+    @staticmethod
+    def get_current_time():
+        return NOW
+
+    @staticmethod
+    def fetch_aggregates(sensor_type: str, window_seconds: int) -> tuple:
+        return None, {"soil01": {"avg": 20.0, "count": 1, "latest": 20.0, "health": None, "time": 0}}
+
+    @staticmethod
+    def configured_sensors(sensor_config_name: str):
+        return None
+
+    def detect_missing_sensors(self, *args, **kwargs) -> None:
+        pass
+
+    def check_margin_and_range(self, *args, **kwargs) -> None:
+        pass
+
+    def turn_on_actuator_and_update_db_for_time(self, actuator: dict, num_seconds: int) -> None:
+        self.watered.append(actuator["name"])
+        self.watering_done.wait(5)
+
+
+def actuators() -> ActuatorRegistry:
+    registry = ActuatorRegistry()
+    registry.update([{"name": "solenoid01", "type": "solenoid", "state": False}])
+    return registry
+
+
+def run_cycle(gs: StubGreenhouseServer) -> None:
+    thread = AutomatedSolenoids(gs, actuators(), SETTINGS)
+    thread.start()
+    thread.join()
+
+
+def test_a_due_watering_time_starts_a_run_and_moves_to_the_next_day():
+    gs = StubGreenhouseServer()
+    try:
+        run_cycle(gs)
+
+        assert gs.irrigation_run is not None
+        assert gs.watering_times == [NOW - timedelta(minutes=1) + timedelta(days=1)]
+    finally:
+        gs.watering_done.set()
+        gs.irrigation_run.join()
+
+    assert gs.watered == ["solenoid01"]
+
+
+def test_a_watering_time_due_during_a_run_waits_for_it():
+    gs = StubGreenhouseServer()
+    try:
+        run_cycle(gs)
+        first_run = gs.irrigation_run
+
+        # the next watering time comes up while the first run is still going
+        gs.watering_times = [NOW - timedelta(seconds=1)]
+        run_cycle(gs)
+
+        assert gs.irrigation_run is first_run
+        assert gs.watering_times == [NOW - timedelta(seconds=1)]
+    finally:
+        gs.watering_done.set()
+        gs.irrigation_run.join()
+
+    run_cycle(gs)
+    gs.irrigation_run.join()
+
+    assert gs.irrigation_run is not first_run
+    assert gs.watered == ["solenoid01", "solenoid01"]
+    assert gs.watering_times == [NOW - timedelta(seconds=1) + timedelta(days=1)]
@@ -0,0 +1,72 @@
+import pytest
+
+from benchmarks.fakes import FakeRestApi
+from sgreen2_greenhouse.chunked_fetch import chunk_readings, fetch_time_range, split_time_range
+
+NOW = 1700000000.0
+HOUR = 60 * 60
+
+
+@pytest.fixture(params=[True, False], ids=["honours_end_time", "ignores_end_time"])
+def api(request):
+    api = FakeRestApi(clock=lambda: NOW, sensors={"temp": ["temp01"]}, reading_intervals={"temp": 60},
+                      honour_end_time=request.param)
+
+    # the stats are only counted after the response went out, so the requests are counted here
+    api.requests = list()
+    readings = api.readings
+    api.readings = lambda *args: api.requests.append(args) or readings(*args)
+
+    api.start()
+    yield api
+    api.stop()
+
+
+def test_split_time_range():
+    assert split_time_range(0, 10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert split_time_range(10, 10, 4) == list()
+
+
+def test_chunk_readings_keeps_its_range_and_timeless_readings_in_the_last_chunk():
+    readings = [{"reading": 1, "created_at": 5000}, {"reading": 2, "created_at": 1000}, {"reading": 3}]
+
+    assert chunk_readings(readings, (0, 4)) == [readings[1]]
+    assert chunk_readings(readings, (4, 8), last=True) == [readings[0], readings[2]]
+
+
+def test_every_reading_once_whatever_the_api_does_with_end_time(api):
+    expected = api.readings("temp", int((NOW - 24 * HOUR) * 1000), int(NOW * 1000))
+    api.requests.clear()
+    end_time_support = dict()
+
+    response, readings = fetch_time_range(api.url, "temp", NOW - 24 * HOUR, NOW, 6 * HOUR,
+                                          end_time_support=end_time_support)
+
+    assert response.ok
+    assert sorted(reading["created_at"] for reading in readings) == \
+        sorted(reading["created_at"] for reading in expected)
+    assert end_time_support[api.url] is api.honour_end_time
+
+    # an api that ignores end_time sent the whole range in answer to the first chunk
+    assert len(api.requests) == (4 if api.honour_end_time else 1)
+
+
+def test_an_api_known_to_ignore_end_time_gets_one_request(api):
+    api.honour_end_time = False
+
+    response, readings = fetch_time_range(api.url, "temp", NOW - 24 * HOUR, NOW, 6 * HOUR,
+                                          end_time_support={api.url: False})
+
+    assert response.ok
+    assert len(readings) == 24 * 60
+    assert len(api.requests) == 1
+
+
+def test_a_failed_range_gives_no_readings():
+    api = FakeRestApi(clock=lambda: NOW)
+    api.server.server_close()
+
+    response, readings = fetch_time_range(api.url, "temp", NOW - 24 * HOUR, NOW, 6 * HOUR, retries=0)
+
+    assert not response.ok
+    assert readings == list()
@@ -0,0 +1,114 @@
+from unittest import mock
+
+import pytest
+
+from sgreen2_greenhouse import circuit_breaker
+from sgreen2_greenhouse.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_opens_after_threshold_failures(clock):
+    breaker = CircuitBreaker("api", failure_threshold=3, base_backoff_seconds=10)
+
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.fast_failures == 1
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker("api", failure_threshold=2)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == CLOSED
+
+
+def test_probe_success_closes(clock):
+    breaker = CircuitBreaker("api", failure_threshold=1, base_backoff_seconds=10)
+    open_breaker(breaker)
+
+    clock.now += 10
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+
+    # only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+
+
+def test_probe_failure_opens_for_longer(clock):
+    breaker = CircuitBreaker("api", failure_threshold=1, base_backoff_seconds=10, max_backoff_seconds=100)
+    breaker.backoff.jitter = 0
+    open_breaker(breaker)
+    assert breaker.retry_time == clock.now + 10
+
+    clock.now += 10
+    breaker.before_call()
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    assert breaker.retry_time == clock.now + 20
+
+
+def test_call_counts_only_failure_types(clock):
+    breaker = CircuitBreaker("pi", failure_threshold=1)
+
+    with pytest.raises(ValueError):
+        breaker.call(mock.Mock(side_effect=ValueError))
+    assert breaker.state == CLOSED
+
+    with pytest.raises(OSError):
+        breaker.call(mock.Mock(side_effect=OSError))
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpenError):
+        breaker.call(mock.Mock())
+
+
+def test_rest_request_records_probe_outcome_on_any_exception(clock):
+    from sgreen2_greenhouse.rest_request import RestRequest
+
+    breaker = CircuitBreaker("api", failure_threshold=1, base_backoff_seconds=10)
+    open_breaker(breaker)
+    clock.now += 10
+
+    with mock.patch.object(RestRequest, "negotiated_request", side_effect=ValueError("not encodable")):
+        with pytest.raises(ValueError):
+            RestRequest.send("http://api/settings", "get", None, None, None, breaker=breaker)
+
+    assert breaker.state != HALF_OPEN
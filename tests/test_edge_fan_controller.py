@@ -0,0 +1,57 @@
+import configparser
+import time
+
+from benchmarks.fakes import FakeRestApi
+from sgreen2_pi import _gpio_stub
+from sgreen2_pi.edge_fan_controller import EdgeFanController
+from sgreen2_pi.fan_relay_controller import FanRelayController
+
+
+def temperature(value: float) -> dict:
+    return {"sensor": {"type": "temp", "name": "temp01"}, "reading": value}
+
+
+def create_controller(base_url: str) -> EdgeFanController:
+    _gpio_stub.levels.clear()
+    config = configparser.ConfigParser()
+    config.read_dict({"rest": {"base_url": base_url},
+                      "edge": {"settings_refresh_seconds": "60", "min_temperature": "50", "max_temperature": "90"}})
+
+    return EdgeFanController(config, FanRelayController({"fan01": 11}, gpio=_gpio_stub, owns_pins=False))
+
+
+def test_start_does_not_wait_for_the_rest_api():
+    api = FakeRestApi(latency=2).start()
+    try:
+        controller = create_controller(api.url)
+
+        started = time.monotonic()
+        controller.start()
+        assert time.monotonic() - started < 1
+
+        # the thresholds of [edge] are used until the api answers
+        assert controller.on_reading(temperature(95)) is True
+        assert controller.fan_relay_controller.is_on("fan01")
+        controller.close()
+    finally:
+        api.stop()
+
+
+def test_switches_are_reported_in_order():
+    api = FakeRestApi().start()
+    try:
+        controller = create_controller(api.url)
+        controller.refresh()
+
+        # the server is in charge, only crossings of the max temperature switch the fans
+        assert controller.on_reading(temperature(70)) is None
+        assert controller.on_reading(temperature(95)) is True
+        assert controller.on_reading(temperature(70)) is False
+        assert controller.on_reading(temperature(95)) is True
+        controller.close()
+
+        states = {actuator["name"]: actuator["state"] for actuator in api.actuators}
+        assert states["fan01"] is True
+        assert controller.fan_relay_controller.is_on("fan01")
+    finally:
+        api.stop()
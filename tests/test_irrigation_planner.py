@@ -0,0 +1,72 @@
+from sgreen2_greenhouse.irrigation_planner import IrrigationPlanner, MAX_ZONES_FOR_EXACT_PLAN
+
+
+def makespan(schedule: list) -> int:
+    return max(start + seconds for lane in schedule for _, start, seconds in lane)
+
+
+def assert_valid(schedule: list, zone_seconds: dict, max_concurrent_zones) -> None:
+    planned = sorted((name, seconds) for lane in schedule for name, _, seconds in lane)
+    assert planned == sorted(zone_seconds.items())
+
+    if max_concurrent_zones is not None:
+        assert len(schedule) <= max_concurrent_zones
+
+    # each lane waters one zone after the other without gaps
+    for lane in schedule:
+        offset = 0
+        for _, start, seconds in lane:
+            assert start == offset
+            offset += seconds
+
+
+def test_no_zones():
+    assert IrrigationPlanner.plan(dict(), 2) == list()
+
+
+def test_no_limit_waters_every_zone_at_once():
+    zone_seconds = {"solenoid01": 10, "solenoid02": 5, "solenoid03": 1}
+
+    schedule = IrrigationPlanner.plan(zone_seconds, None)
+
+    assert_valid(schedule, zone_seconds, None)
+    assert len(schedule) == 3
+    assert makespan(schedule) == 10
+
+
+def test_one_zone_at_a_time():
+    zone_seconds = {"solenoid01": 10, "solenoid02": 5, "solenoid03": 1}
+
+    schedule = IrrigationPlanner.plan(zone_seconds, 1)
+
+    assert_valid(schedule, zone_seconds, 1)
+    assert makespan(schedule) == 16
+
+
+def test_exact_search_beats_longest_first():
+    # longest first puts 3 and 2 + 2 on one lane and 3 and 2 on the other, finishing at 7 instead of 6
+    zone_seconds = {"a": 3, "b": 3, "c": 2, "d": 2, "e": 2}
+
+    schedule = IrrigationPlanner.plan(zone_seconds, 2)
+
+    assert_valid(schedule, zone_seconds, 2)
+    assert makespan(schedule) == 6
+
+
+def test_many_zones_fall_back_to_longest_first():
+    zone_seconds = {"solenoid{0:02d}".format(i): 5 + i % 7 for i in range(MAX_ZONES_FOR_EXACT_PLAN + 8)}
+
+    schedule = IrrigationPlanner.plan(zone_seconds, 3)
+
+    assert_valid(schedule, zone_seconds, 3)
+    # longest first is within 4/3 of the even split
+    assert makespan(schedule) <= sum(zone_seconds.values()) / 3 * 4 / 3
+
+
+def test_limit_above_the_number_of_zones():
+    zone_seconds = {"solenoid01": 4, "solenoid02": 4}
+
+    schedule = IrrigationPlanner.plan(zone_seconds, 5)
+
+    assert_valid(schedule, zone_seconds, 5)
+    assert makespan(schedule) == 4
@@ -0,0 +1,80 @@
+import statistics
+
+from sgreen2_greenhouse.online_statistics import OnlineStatistics, SensorStatistics
+
+NOW = 1700000000.0
+
+
+def reading(sensor: str, seconds_ago: float, value: float, health: str = None) -> dict:
+    row = {"sensor": {"type": "temp", "name": sensor}, "reading": value, "created_at": int((NOW - seconds_ago) * 1000)}
+    if health is not None:
+        row["health"] = health
+    return row
+
+
+def test_mean_and_variance_match_the_batch_formulas():
+    values = [70.5, 72.0, 68.25, 75.0, 71.5]
+    online = OnlineStatistics(60)
+    for i, value in enumerate(values):
+        online.add(value, NOW + i)
+
+    assert online.count == len(values)
+    assert abs(online.mean - statistics.mean(values)) < 1e-9
+    assert abs(online.variance - statistics.variance(values)) < 1e-9
+    assert abs(online.standard_deviation - statistics.stdev(values)) < 1e-9
+    assert online.minimum == 68.25
+    assert online.maximum == 75.0
+
+
+def test_readings_leave_the_window():
+    online = OnlineStatistics(60)
+    online.add(90, NOW)
+    online.add(10, NOW + 30)
+    online.add(50, NOW + 50)
+
+    online.expire(NOW + 80)
+
+    # only the reading at +30 and +50 are inside the last 60 seconds
+    assert online.count == 2
+    assert abs(online.mean - 30) < 1e-9
+    assert abs(online.variance - statistics.variance([10, 50])) < 1e-9
+    assert online.minimum == 10
+    assert online.maximum == 50
+
+    online.expire(NOW + 200)
+    assert online.count == 0
+    assert online.variance is None
+    assert online.minimum is None and online.maximum is None
+    # the last reading is remembered after it left the window
+    assert online.last == 50 and online.last_seen == NOW + 50
+
+
+def test_sliding_min_and_max_follow_the_window():
+    online = OnlineStatistics(10)
+    for i, value in enumerate([5, 1, 4, 2, 3]):
+        online.add(value, NOW + i * 5)
+
+    # inside the window at +20 are the readings at +10, +15 and +20
+    assert (online.minimum, online.maximum) == (2, 4)
+
+
+def test_ingest_skips_readings_it_already_has():
+    sensor_statistics = SensorStatistics({"temp": 5 * 60})
+    assert sensor_statistics.ingest("temp", [reading("temp01", 30, 70), reading("temp01", 20, 72)]) == 2
+
+    assert sensor_statistics.ingest("temp", [reading("temp01", 20, 72), reading("temp01", 10, 74)]) == 1
+
+
+def test_aggregates_per_sensor():
+    sensor_statistics = SensorStatistics({"temp": 5 * 60})
+    sensor_statistics.ingest("temp", [reading("temp01", 30, 70), reading("temp01", 10, 74, "ok"),
+                                      reading("temp02", 20, 60), reading("temp03", 10 * 60, 50)])
+
+    aggregates = sensor_statistics.aggregate_by_sensor("temp", NOW)
+
+    assert aggregates["temp01"] == {"avg": 72, "count": 2, "latest": 74, "health": "ok", "time": NOW - 10}
+    assert aggregates["temp02"]["count"] == 1
+    # posted before the window
+    assert "temp03" not in aggregates
+    assert sensor_statistics.window_seconds("temp") == 5 * 60
+    assert sensor_statistics.window_seconds("lux") == sensor_statistics.default_window
@@ -0,0 +1,121 @@
+from sgreen2_greenhouse.reading_rollups import ReadingRollups, get_reading_time
+
+# on a bucket boundary of every resolution, so the tests know which bucket a reading falls into
+NOW = 1700000000.0 - 1700000000.0 % 3600 + 3000
+
+
+def reading(sensor: str, seconds_ago: float, value: float, health: str = None, reading_id: int = None) -> dict:
+    row = {"sensor": {"type": "temp", "name": sensor}, "reading": value, "created_at": int((NOW - seconds_ago) * 1000)}
+    if health is not None:
+        row["health"] = health
+    if reading_id is not None:
+        row["id"] = reading_id
+    return row
+
+
+def test_get_reading_time():
+    assert get_reading_time({"created_at": 1500}) == 1.5
+    assert get_reading_time({"created_at": "2020-03-01T00:00:00Z"}) == 1583020800
+    assert get_reading_time({"created_at": "yesterday"}, 7) == 7
+    assert get_reading_time(dict(), 7) == 7
+
+
+def test_aggregates_per_sensor():
+    rollups = ReadingRollups()
+    rollups.ingest("temp", [reading("temp01", 30, 70), reading("temp01", 10, 74, "ok"), reading("temp02", 20, 60)])
+
+    aggregates = rollups.aggregate_by_sensor("temp", 5 * 60, NOW)
+
+    assert aggregates["temp01"] == {"avg": 72, "count": 2, "latest": 74, "health": "ok", "time": NOW - 10}
+    assert aggregates["temp02"]["count"] == 1
+    assert rollups.newest_reading_time("temp") == NOW - 10
+
+
+def test_overlapping_fetches_are_not_counted_twice():
+    rollups = ReadingRollups()
+    assert len(rollups.ingest("temp", [reading("temp01", 30, 70), reading("temp01", 20, 72)])) == 2
+
+    assert len(rollups.ingest("temp", [reading("temp01", 20, 72), reading("temp01", 10, 74)])) == 1
+    assert rollups.aggregate_by_sensor("temp", 5 * 60, NOW)["temp01"]["count"] == 3
+
+
+def test_readings_with_ids_are_told_apart_by_id():
+    rollups = ReadingRollups()
+    rollups.ingest("temp", [reading("temp01", 20, 70, reading_id=1)])
+
+    # two readings recorded in the same millisecond
+    added = rollups.ingest("temp", [reading("temp01", 20, 70, reading_id=1), reading("temp01", 20, 71, reading_id=2)])
+
+    assert len(added) == 1
+
+
+def test_late_reading_goes_into_its_bucket():
+    rollups = ReadingRollups()
+    rollups.ingest("temp", [reading("temp01", 10, 74)])
+
+    assert len(rollups.ingest("temp", [reading("temp01", 40, 70)])) == 1
+
+    aggregates = rollups.aggregate_by_sensor("temp", 5 * 60, NOW)
+    assert aggregates["temp01"]["count"] == 2
+    # the late reading is not the latest
+    assert aggregates["temp01"]["latest"] == 74
+
+
+def test_window_leaves_out_old_readings():
+    rollups = ReadingRollups()
+    rollups.ingest("temp", [reading("temp01", 2 * 60 * 60, 50), reading("temp01", 60, 70)])
+
+    assert rollups.aggregate_by_sensor("temp", 10 * 60, NOW)["temp01"]["count"] == 1
+    assert rollups.aggregate_by_sensor("temp", 24 * 60 * 60, NOW)["temp01"]["avg"] == 60
+
+
+def test_silent_sensors_are_left_out():
+    rollups = ReadingRollups()
+    rollups.ingest("temp", [reading("temp01", 60, 70), reading("temp02", 20 * 60, 70)])
+
+    assert set(rollups.latest_by_sensor("temp", 5 * 60, NOW)) == {"temp01"}
+    assert set(rollups.aggregate_by_sensor("temp", 5 * 60, NOW)) == {"temp01"}
+    assert rollups.aggregate_by_sensor("humid", 5 * 60, NOW) == dict()
+
+
+def test_readings_without_an_id_or_a_time_are_all_kept():
+    rollups = ReadingRollups()
+    timeless = [{"sensor": {"type": "temp", "name": sensor}, "reading": value}
+                for sensor, value in (("temp01", 70), ("temp02", 60), ("temp01", 72))]
+
+    assert len(rollups.ingest("temp", timeless)) == 3
+
+    aggregates = rollups.aggregate_by_sensor("temp", 5 * 60)
+    assert aggregates["temp01"]["count"] == 2
+    assert aggregates["temp02"]["count"] == 1
+
+
+def test_readings_without_an_id_are_told_apart_by_value():
+    rollups = ReadingRollups()
+
+    # recorded in the same millisecond
+    assert len(rollups.ingest("temp", [reading("temp01", 20, 70), reading("temp01", 20, 71)])) == 2
+    assert len(rollups.ingest("temp", [reading("temp01", 20, 71)])) == 0
+
+
+def test_a_pushed_reading_and_its_fetched_copy_are_counted_once():
+    rollups = ReadingRollups()
+    # stamped when the datagram arrived
+    assert len(rollups.ingest("temp", [reading("temp01", 60, 70), reading("temp01", 30, 70)], pushed=True)) == 2
+
+    # inserted a little later by the api, with the id it gave them, and one the stream lost
+    fetched = [reading("temp01", 58, 70, reading_id=1), reading("temp01", 45, 71, reading_id=2),
+               reading("temp01", 28, 70, reading_id=3)]
+    added = rollups.ingest("temp", fetched)
+
+    assert [row["id"] for row in added] == [2]
+    assert rollups.aggregate_by_sensor("temp", 5 * 60, NOW)["temp01"]["count"] == 3
+
+
+def test_a_fetched_reading_is_matched_with_one_pushed_reading_at_most():
+    rollups = ReadingRollups()
+    rollups.ingest("fanspeed", [reading("fan01", 20, 0)], pushed=True)
+
+    added = rollups.ingest("fanspeed", [reading("fan01", 19, 0, reading_id=1), reading("fan01", 18, 0, reading_id=2)])
+
+    assert len(added) == 1
@@ -0,0 +1,64 @@
+from binascii import crc_hqx
+
+from sgreen2_pi.serial_framing import FRAME_LENGTH, FRAME_SYNC, decode_records, encode_record
+
+
+def test_crc_is_xmodem():
+    # the check value of CRC-16/XMODEM
+    assert crc_hqx(b"123456789", 0) == 0x31C3
+
+
+def test_round_trip():
+    frame = encode_record("temp", 3, 72.456, 1)
+
+    readings, consumed = decode_records(frame)
+
+    assert len(frame) == FRAME_LENGTH
+    assert consumed == FRAME_LENGTH
+    assert readings == [{"sensor": {"type": "temp", "name": "temp03"}, "reading": 72.46, "unit": "temp_f",
+                         "health": "ok"}]
+
+
+def test_no_health_code():
+    readings, _ = decode_records(encode_record("batt", 1, 3.7))
+
+    assert "health" not in readings[0]
+
+
+def test_partial_frame_is_kept():
+    frame = encode_record("humid", 1, 40.0)
+    buffer = frame + frame[:5]
+
+    readings, consumed = decode_records(buffer)
+
+    assert len(readings) == 1
+    assert consumed == FRAME_LENGTH
+    assert decode_records(buffer[consumed:] + frame[5:])[0] == readings
+
+
+def test_corrupted_frame_is_skipped():
+    corrupted = bytearray(encode_record("soil", 2, 512.0))
+    corrupted[5] ^= 0xFF
+    buffer = b"noise" + bytes(corrupted) + encode_record("soil", 4, 300.0)
+
+    readings, consumed = decode_records(buffer)
+
+    assert [reading["sensor"]["name"] for reading in readings] == ["soil04"]
+    assert consumed == len(buffer)
+
+
+def test_unknown_type_is_skipped():
+    frame = bytearray(encode_record("temp", 1, 70.0))
+    frame[2] = 99
+    body = bytes(frame[1:FRAME_LENGTH - 2])
+    frame[FRAME_LENGTH - 2:] = crc_hqx(body, 0).to_bytes(2, "big")
+
+    assert decode_records(bytes(frame)) == ([], FRAME_LENGTH)
+
+
+def test_sync_byte_inside_noise():
+    buffer = bytes((FRAME_SYNC, 1, 2)) + encode_record("fanspeed", 1, 1200.0)
+
+    readings, _ = decode_records(buffer)
+
+    assert readings[0]["sensor"]["name"] == "fan01"
@@ -0,0 +1,52 @@
+from sgreen2_pi.data_reading_listener import MAX_LINE_BYTES, SerialPortReader
+
+LINE = b'{"sensor": {"type": "temp", "name": "temp01"}, "reading": 70.25}'
+
+
+class FakePort:
+    """
+    Hands out the chunks it was given one read at a time, like a serial port in non-blocking mode
+    """
+
+    def __init__(self, chunks: list):
+        self.chunks = list(chunks)
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size: int) -> bytes:
+        return self.chunks.pop(0) if self.chunks else b""
+
+
+def reader_of(chunks: list) -> SerialPortReader:
+    reader = SerialPortReader("/dev/ttyTEST", 9600, "json")
+    reader.port = FakePort(chunks)
+    return reader
+
+
+def test_lines_split_across_reads():
+    reader = reader_of([LINE[:10], LINE[10:] + b"\n" + LINE[:5], LINE[5:] + b"\n"])
+
+    assert reader.read_readings() == list()
+    assert [reading["reading"] for _, reading in reader.read_readings()] == [70.25]
+    assert [reading["reading"] for _, reading in reader.read_readings()] == [70.25]
+    assert not reader.buffer
+
+
+def test_garbage_lines_are_dropped():
+    reader = reader_of([b"\x00\xff garbage\n" + LINE + b"\n"])
+
+    assert [body for body, _ in reader.read_readings()] == [LINE]
+
+
+def test_noise_without_newlines_does_not_grow_the_buffer():
+    noise = b"\xfe" * 1000
+    reader = reader_of([noise] * 20 + [b"\n" + LINE + b"\n"])
+
+    for _ in range(20):
+        assert reader.read_readings() == list()
+        assert len(reader.buffer) <= MAX_LINE_BYTES
+
+    # reading picks up again after the next newline
+    assert [body for body, _ in reader.read_readings()] == [LINE]
@@ -0,0 +1,44 @@
+"""
+The programs keep their heavy dependencies out of start up: importing them must not import any of the modules that
+are only imported once they are needed. Each program is imported in a fresh interpreter, so what the tests imported
+themselves does not count. How long start up takes is measured by bench_startup.py, not checked here
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.bench_startup import LAZY_MODULES, PROGRAMS, ROOT
+
+# on top of the ones bench_startup.py reports, the whole email package goes with smtplib
+HEAVY_MODULES = tuple(sorted(set(LAZY_MODULES) | {"email"}))
+
+
+def imported_modules(module: str) -> list:
+    """
+    Imports a module in a fresh interpreter
+    :param module: the module to import
+    :return: the names of every module imported with it
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    process = subprocess.run([sys.executable, "-c", "import sys, {0}; print('\\n'.join(sys.modules))".format(module)],
+                             cwd=ROOT, env=env, capture_output=True, text=True)
+
+    if process.returncode != 0:
+        if "ModuleNotFoundError" in process.stderr:
+            pytest.skip(module + " needs a dependency that is not installed")
+        raise RuntimeError("importing " + module + " failed:\n" + process.stderr)
+
+    return process.stdout.split()
+
+
+@pytest.mark.parametrize("program", sorted(PROGRAMS))
+def test_heavy_modules_are_not_imported_at_startup(program):
+    module, _ = PROGRAMS[program]
+
+    imported = imported_modules(module)
+
+    assert module in imported
+    assert [name for name in imported
+            if any(name == heavy or name.startswith(heavy + ".") for heavy in HEAVY_MODULES)] == list()
@@ -0,0 +1,62 @@
+import time
+
+from benchmarks.fakes import FakeRestApi
+from sgreen2_greenhouse.payload_codec import PayloadNegotiator
+from sgreen2_pi.upload_lane import UploadLane
+
+READING = '{"sensor": {"type": "temp", "name": "temp01"}, "reading": 70}'
+
+
+class BrokenNegotiator(PayloadNegotiator):
+    """
+    Fails to encode one body the way a bug in the encoding would
+    """
+
+    def prepare(self, url: str, data, headers=None, parsed=None) -> tuple:
+        if data == "broken":
+            raise TypeError("cannot encode the body")
+
+        return PayloadNegotiator.prepare(self, url, data, headers, parsed)
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.01)
+
+    return True
+
+
+def test_a_reading_that_cannot_be_sent_is_dropped_and_the_lane_keeps_going():
+    api = FakeRestApi().start()
+    try:
+        lane = UploadLane("remote", api.url, retry_backoff=0, negotiator=BrokenNegotiator())
+        lane.start()
+
+        lane.put("broken")
+        lane.put(READING)
+
+        assert wait_for(lambda: lane.uploaded == 1)
+        assert lane.is_alive()
+        assert lane.failed == 1
+        assert "cannot encode the body" in lane.last_error
+        assert len(api.posted_readings) == 1
+    finally:
+        api.stop()
+
+
+def test_a_reading_the_api_rejects_is_not_sent_again():
+    api = FakeRestApi().start()
+    try:
+        lane = UploadLane("remote", api.url + "/nowhere", retry_backoff=0)
+        lane.start()
+
+        lane.put(READING)
+
+        assert wait_for(lambda: lane.failed == 1)
+        assert lane.last_error.startswith("status code 404")
+        assert not lane.queue
+    finally:
+        api.stop()